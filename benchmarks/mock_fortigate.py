@@ -0,0 +1,444 @@
+#!/usr/bin/env python3
+"""
+Servidor SSH simulando FortiGates para benchmark e testes locais
+Cada porta é um dispositivo: shell interativo com prompt e paginação (--More--),
+show full-configuration, comandos get do _collect_system_information,
+checksum de configuração, SCP/SFTP do arquivo de configuração, link com banda limitada
+e injeção de falhas
+"""
+
+import sys
+import time
+import random
+import socket
+import logging
+import argparse
+import threading
+from typing import List
+import paramiko
+
+SYSTEM_OUTPUTS = {
+    'get system status': (
+        "Version: FortiGate-60F v7.2.5,build1517,230606 (GA.F)\n"
+        "Serial-Number: FGT60FTK00000000\n"
+        "BIOS version: 05000006\n"
+        "Hostname: {hostname}\n"
+        "Operation Mode: NAT\n"
+        "Current virtual domain: root\n"
+        "Virtual domain configuration: disable\n"
+        "License Status: Valid\n"
+        "System time: Mon Aug 29 02:00:00 2025\n"
+    ),
+    'get system performance status': (
+        "CPU states: 1% user 1% system 0% nice 98% idle 0% iowait 0% irq 0% softirq\n"
+        "Memory: 1903816k total, 1001836k used (52.6%), 901980k free (47.4%)\n"
+        "Average network usage: 1523 / 1433 kbps in 1 minute\n"
+        "Uptime: 12 days,  3 hours,  42 minutes\n"
+    ),
+    'get system ha status': "HA Health Status: OK\nModel: FortiGate-60F\nMode: standalone\n",
+    'get system status | grep License': "License Status: Valid\n",
+}
+
+def build_config(hostname: str, size_kb: int, header: bool = True) -> str:
+    """Configuração sintética no formato do FortiOS com aproximadamente size_kb"""
+    lines = [
+        "#config-version=FGT60F-7.2.5-FW-build1517-230606:opmode=0:vdom=0:user=admin",
+        "#conf_file_ver=1234567890",
+        "#buildno=1517",
+        "#global_vdom=1",
+    ] if header else []
+    lines += [
+        "config system global",
+        f'    set hostname "{hostname}"',
+        '    set timezone "America/Sao_Paulo"',
+        "end",
+        "config firewall address",
+    ]
+    size = sum(len(line) + 1 for line in lines)
+    index = 0
+    while size < size_kb * 1024:
+        block = [
+            f'    edit "host-{index}"',
+            f'        set uuid 00000000-0000-0000-0000-{index:012d}',
+            f'        set subnet 10.{index // 65536 % 256}.{index // 256 % 256}.{index % 256} 255.255.255.255',
+            '    next',
+        ]
+        lines += block
+        size += sum(len(line) + 1 for line in block)
+        index += 1
+    lines.append("end")
+    return "\n".join(lines) + "\n"
+
+def generated_output(command: str, hostname: str, vdoms: List[str] = ()) -> str:
+    """Saída dos comandos get com volume proporcional a um firewall real"""
+    if command == 'get system interface':
+        return "".join(
+            f"== [ port{i} ]\nname: port{i}   mode: static    ip: 10.{i}.0.1 255.255.255.0   status: up    "
+            f"netbios-forward: disable    type: physical   ring-rx: 0   ring-tx: 0\n"
+            for i in range(1, 21)
+        )
+    if command == 'get router info routing-table all':
+        return "Routing table for VRF=0\n" + "".join(
+            f"S       10.{i // 256}.{i % 256}.0/24 [10/0] via 10.0.0.254, port1, [1/0]\n" for i in range(200)
+        )
+    if command == 'get system arp':
+        return "Address           Age(min)   Hardware Addr      Interface\n" + "".join(
+            f"10.0.0.{i:<13} 0          00:09:0f:09:00:{i % 256:02x}  port1\n" for i in range(1, 100)
+        )
+    if command == 'get system session list':
+        return "PROTO   EXPIRE SOURCE           SOURCE-NAT       DESTINATION      DESTINATION-NAT\n" + "".join(
+            f"tcp     3599   10.0.0.{i % 250}:{40000 + i} -                8.8.8.8:443      -\n" for i in range(500)
+        )
+    if command in SYSTEM_OUTPUTS:
+        return SYSTEM_OUTPUTS[command].format(hostname=hostname)
+    if command == 'diagnose sys vd list':
+        return "list virtual firewall info:\n" + "".join(
+            f"name={vdom}/{vdom} index={i} enabled fib_ver=1 use=100 rt_num=10 asym_rt=0 sip_helper=0\n"
+            for i, vdom in enumerate(vdoms + ['vsys_ha', 'vsys_fgfm'])
+        )
+    if command.startswith('diagnose sys ha checksum'):
+        return "is_manage_master()=1, is_root_master()=1\ndebugzone\nall: 6b 1a 3c 0d\n\nchecksum\nall: 6b 1a 3c 0d\n"
+    return "Unknown action 0\nCommand fail. Return code -61\n"
+
+def throttled_send(channel: paramiko.Channel, data: bytes, bandwidth_kbps: float, chunk_size: int = 4096):
+    """Enviar em blocos respeitando a banda simulada (0 = ilimitada)"""
+    if not bandwidth_kbps:
+        channel.sendall(data)
+        return
+    for i in range(0, len(data), chunk_size):
+        chunk = data[i:i + chunk_size]
+        channel.sendall(chunk)
+        time.sleep(len(chunk) / (bandwidth_kbps * 1024))
+
+class ThrottledSocket:
+    """Socket com banda limitada no envio, medida em bytes no fio (após compressão/cifra do SSH)"""
+    
+    def __init__(self, sock: socket.socket, bandwidth_kbps: float):
+        self._sock = sock
+        self._rate = bandwidth_kbps * 1024
+    
+    def send(self, data) -> int:
+        sent = self._sock.send(bytes(data[:16384]))
+        time.sleep(sent / self._rate)
+        return sent
+    
+    def sendall(self, data):
+        view = memoryview(data)
+        while view:
+            view = view[self.send(view):]
+    
+    def __getattr__(self, name):
+        return getattr(self._sock, name)
+
+class MockDevice:
+    """Estado e parâmetros de um FortiGate simulado"""
+    
+    def __init__(self, index: int, args):
+        self.hostname = f"FGT-SIM-{index:03d}"
+        self.args = args
+        # Multi-VDOM: o tamanho total é dividido entre a configuração global e os VDOMs
+        self.vdoms = ['root'] + [f"vdom{i}" for i in range(1, args.vdoms)] if args.vdoms else []
+        if self.vdoms:
+            part_kb = max(1, args.config_kb // (len(self.vdoms) + 1))
+            self.scopes = {'global': build_config(self.hostname, part_kb, header=False)}
+            for vdom in self.vdoms:
+                self.scopes[vdom] = build_config(f"{self.hostname}-{vdom}", part_kb, header=False)
+            self.config = (
+                "#config-version=FGT60F-7.2.5-FW-build1517-230606:opmode=0:vdom=1:user=admin\n"
+                "config vdom\n" + "".join(f"edit {vdom}\nnext\n" for vdom in self.vdoms) + "end\n"
+                "config global\n" + self.scopes['global'] + "end\n"
+                + "".join(f"config vdom\nedit {vdom}\n{self.scopes[vdom]}end\n" for vdom in self.vdoms)
+            )
+        else:
+            self.scopes = {}
+            self.config = build_config(self.hostname, args.config_kb)
+        self.config_bytes = self.config.encode('utf-8')
+
+class MockServer(paramiko.ServerInterface):
+    def __init__(self, device: MockDevice):
+        self.device = device
+        # Requisição de cada canal (id -> (tipo, comando)); vários canais podem abrir ao mesmo tempo
+        self.requests = {}
+        self.condition = threading.Condition()
+    
+    def _request(self, channel, kind, command=None):
+        with self.condition:
+            self.requests[channel.get_id()] = (kind, command)
+            self.condition.notify_all()
+    
+    def wait_request(self, channel, timeout):
+        with self.condition:
+            if not self.condition.wait_for(lambda: channel.get_id() in self.requests, timeout):
+                return None, None
+            return self.requests.pop(channel.get_id())
+    
+    def check_auth_password(self, username, password):
+        if random.random() < self.device.args.auth_fail_rate:
+            return paramiko.AUTH_FAILED
+        return paramiko.AUTH_SUCCESSFUL
+    
+    def get_allowed_auths(self, username):
+        return 'password'
+    
+    def check_channel_request(self, kind, chanid):
+        return paramiko.OPEN_SUCCEEDED
+    
+    def check_channel_pty_request(self, *args):
+        return True
+    
+    def check_channel_shell_request(self, channel):
+        self._request(channel, 'shell')
+        return True
+    
+    def check_channel_exec_request(self, channel, command):
+        self._request(channel, 'exec', command.decode())
+        return True
+    
+    def check_channel_subsystem_request(self, channel, name):
+        self._request(channel, 'subsystem')
+        return super().check_channel_subsystem_request(channel, name)
+
+class MockSFTPHandle(paramiko.SFTPHandle):
+    def __init__(self, device: MockDevice, flags=0):
+        super().__init__(flags)
+        self.data = device.config_bytes
+        self.bandwidth_kbps = device.args.bandwidth_kbps
+    
+    def read(self, offset, length):
+        chunk = self.data[offset:offset + length]
+        if self.bandwidth_kbps:
+            time.sleep(len(chunk) / (self.bandwidth_kbps * 1024))
+        return chunk
+    
+    def stat(self):
+        attributes = paramiko.SFTPAttributes()
+        attributes.st_size = len(self.data)
+        return attributes
+
+class MockSFTPServer(paramiko.SFTPServerInterface):
+    def __init__(self, server: MockServer, *args, **kwargs):
+        super().__init__(server, *args, **kwargs)
+        self.device = server.device
+    
+    def open(self, path, flags, attr):
+        return MockSFTPHandle(self.device, flags)
+    
+    def stat(self, path):
+        attributes = paramiko.SFTPAttributes()
+        attributes.st_size = len(self.device.config_bytes)
+        return attributes
+    
+    lstat = stat
+
+class Session:
+    """Sessão CLI interativa de um cliente"""
+    
+    def __init__(self, channel: paramiko.Channel, device: MockDevice):
+        self.channel = channel
+        self.device = device
+        self.args = device.args
+        self.prompt = f"{device.hostname} # "
+        self.paging = self.args.paging
+        # Contexto multi-VDOM: None (topo), 'global', 'vdom' (aguardando edit) ou o nome do VDOM
+        self.scope = None
+    
+    def send(self, data: bytes):
+        throttled_send(self.channel, data, self.args.bandwidth_kbps)
+    
+    def send_output(self, output: str) -> bool:
+        """Enviar saída de comando com paginação; False se a conexão foi derrubada"""
+        lines = output.replace('\n', '\r\n').split('\r\n')
+        drop_at = None
+        if random.random() < self.args.drop_rate:
+            drop_at = len(lines) // 2
+        page = self.args.page_lines if self.paging else len(lines)
+        for start in range(0, len(lines), page):
+            if drop_at is not None and start + page > drop_at:
+                self.send('\r\n'.join(lines[start:drop_at]).encode())
+                self.channel.get_transport().close()
+                return False
+            self.send('\r\n'.join(lines[start:start + page]).encode())
+            if start + page < len(lines):
+                self.channel.sendall(b'\r\n--More-- ')
+                while True:
+                    key = self.channel.recv(1)
+                    if not key:
+                        return False
+                    if key == b' ':
+                        break
+                self.channel.sendall(b'\r         \r')
+        return True
+    
+    def run(self):
+        try:
+            self._loop()
+        except (EOFError, OSError, paramiko.SSHException):
+            # Cliente encerrou a conexão sem "exit"
+            pass
+    
+    def _loop(self):
+        self.channel.sendall(self.prompt.encode())
+        buffer = b''
+        while True:
+            data = self.channel.recv(1024)
+            if not data:
+                return
+            buffer += data
+            while b'\n' in buffer:
+                line, buffer = buffer.split(b'\n', 1)
+                command = line.decode('utf-8', errors='ignore').strip()
+                self.channel.sendall((command + "\r\n").encode())
+                if command == 'exit':
+                    self.channel.close()
+                    return
+                if not self.handle(command):
+                    return
+    
+    def set_prompt(self, context: str = None):
+        self.prompt = f"{self.device.hostname} ({context}) # " if context else f"{self.device.hostname} # "
+        self.channel.sendall(self.prompt.encode())
+    
+    def handle(self, command: str) -> bool:
+        if command in ('', 'end'):
+            self.scope = None
+            self.set_prompt()
+            return True
+        if command in ('config global', 'config vdom'):
+            if not self.device.vdoms:
+                self.channel.sendall(("command parse error before 'global'\r\nCommand fail. Return code -61\r\n"
+                                      + self.prompt).encode())
+                return True
+            self.scope = command.split()[-1]
+            self.set_prompt(self.scope)
+            return True
+        if self.scope == 'vdom' and command.startswith('edit '):
+            self.scope = command.split()[-1]
+            self.set_prompt(self.scope)
+            return True
+        if command.startswith('config '):
+            self.prompt = f"{self.device.hostname} ({command.split()[-1]}) # "
+            self.channel.sendall(self.prompt.encode())
+            return True
+        if command.startswith('set output'):
+            self.paging = command != 'set output standard'
+            self.channel.sendall(self.prompt.encode())
+            return True
+        
+        if self.device.vdoms and self.scope is None and command.startswith('diagnose sys ha'):
+            # Em multi-VDOM os comandos diagnose de HA só existem no contexto global
+            self.channel.sendall(("command parse error before 'ha'\r\nCommand fail. Return code -61\r\n"
+                                  + self.prompt).encode())
+            return True
+        if self.args.command_delay:
+            time.sleep(self.args.command_delay)
+        if command == 'show full-configuration':
+            output = self.device.scopes.get(self.scope, self.device.config)
+        else:
+            output = generated_output(command, self.device.hostname, self.device.vdoms)
+        if not self.send_output(output):
+            return False
+        self.channel.sendall(("\r\n" + self.prompt).encode())
+        return True
+
+def scp_source(channel: paramiko.Channel, device: MockDevice):
+    """Lado servidor do protocolo SCP (scp -f)"""
+    try:
+        _scp_send(channel, device)
+    except (EOFError, OSError, paramiko.SSHException):
+        pass
+
+def _scp_send(channel: paramiko.Channel, device: MockDevice):
+    data = device.config_bytes
+    channel.recv(1)
+    channel.sendall(f"C0644 {len(data)} sys_config\n".encode())
+    channel.recv(1)
+    if random.random() < device.args.drop_rate:
+        channel.sendall(data[:len(data) // 2])
+        channel.get_transport().close()
+        return
+    throttled_send(channel, data, device.args.bandwidth_kbps, 32768)
+    channel.sendall(b'\x00')
+    channel.recv(1)
+    channel.send_exit_status(0)
+    channel.close()
+
+def handle_client(client: socket.socket, device: MockDevice, host_key: paramiko.PKey):
+    if device.args.link_kbps:
+        client = ThrottledSocket(client, device.args.link_kbps)
+    transport = paramiko.Transport(client)
+    # Compressão oferecida como no OpenSSH do FortiOS; usada apenas se o cliente pedir
+    transport.use_compression(True)
+    transport.add_server_key(host_key)
+    transport.set_subsystem_handler('sftp', paramiko.SFTPServer, MockSFTPServer)
+    server = MockServer(device)
+    try:
+        transport.start_server(server=server)
+    except (paramiko.SSHException, EOFError, OSError):
+        return
+    while transport.is_active():
+        channel = transport.accept(30)
+        if channel is None:
+            break
+        kind, command = server.wait_request(channel, 5)
+        if kind is None or kind == 'subsystem':
+            # SFTP: atendido pela thread do próprio paramiko
+            continue
+        if kind == 'shell':
+            threading.Thread(target=Session(channel, device).run, daemon=True).start()
+        elif command.startswith('scp -f'):
+            threading.Thread(target=scp_source, args=(channel, device), daemon=True).start()
+        else:
+            channel.sendall(generated_output(command, device.hostname, device.vdoms).encode())
+            channel.send_exit_status(0)
+            channel.close()
+
+def serve_device(port: int, device: MockDevice, host_key: paramiko.PKey, bind: str):
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((bind, port))
+    listener.listen(100)
+    while True:
+        client, _ = listener.accept()
+        threading.Thread(target=handle_client, args=(client, device, host_key), daemon=True).start()
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="FortiGates simulados via SSH (um por porta)")
+    parser.add_argument('--bind', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=2201, help='Porta do primeiro dispositivo')
+    parser.add_argument('--count', type=int, default=1, help='Número de dispositivos (portas consecutivas)')
+    parser.add_argument('--config-kb', type=int, default=200, help='Tamanho da configuração em KB')
+    parser.add_argument('--bandwidth-kbps', type=float, default=0, help='Banda simulada em KB/s (0 = ilimitada)')
+    parser.add_argument('--link-kbps', type=float, default=0,
+                        help='Banda do link em KB/s por conexão, medida após compressão (0 = ilimitada)')
+    parser.add_argument('--command-delay', type=float, default=0, help='Latência por comando em segundos')
+    parser.add_argument('--no-paging', dest='paging', action='store_false', help='Desabilitar --More--')
+    parser.add_argument('--page-lines', type=int, default=24, help='Linhas por página com paginação')
+    parser.add_argument('--drop-rate', type=float, default=0, help='Probabilidade de derrubar a conexão no meio da saída')
+    parser.add_argument('--auth-fail-rate', type=float, default=0, help='Probabilidade de falha de autenticação')
+    parser.add_argument('--vdoms', type=int, default=0, help='Número de VDOMs (0 = sem multi-VDOM)')
+    parser.add_argument('--seed', type=int, help='Semente para a injeção de falhas')
+    return parser
+
+def main():
+    args = build_parser().parse_args()
+    if args.seed is not None:
+        random.seed(args.seed)
+    logging.basicConfig(level=logging.WARNING)
+    # Conexões encerradas pelo cliente geram erros de socket esperados no paramiko
+    logging.getLogger('paramiko').setLevel(logging.CRITICAL)
+    
+    host_key = paramiko.RSAKey.generate(2048)
+    for index in range(args.count):
+        device = MockDevice(index + 1, args)
+        threading.Thread(
+            target=serve_device, args=(args.port + index, device, host_key, args.bind), daemon=True
+        ).start()
+    print(f"{args.count} FortiGate(s) simulados em {args.bind}:{args.port}-{args.port + args.count - 1}")
+    sys.stdout.flush()
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+"""
+Benchmark de throughput do backup FortiGate
+Sobe N FortiGates simulados (mock_fortigate.py em outro processo), executa o
+FortiGateSSHBackup contra eles e reporta dispositivos/minuto, latência p50/p99
+por dispositivo, tempo médio por fase e pico de memória (RSS) do processo de backup;
+com --profiles compara a taxa de transferência de cada perfil de transporte SSH
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import logging
+import argparse
+import shutil
+import resource
+import tempfile
+import threading
+import subprocess
+from pathlib import Path
+from typing import Dict, List
+
+BENCH_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCH_DIR.parent / 'src'))
+
+def percentile(values: List[float], pct: float) -> float:
+    """Percentil pelo método nearest-rank"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * pct // 100))
+    return ordered[int(rank) - 1]
+
+def peak_rss_mb() -> float:
+    """Pico de RSS do processo atual (ru_maxrss é em KB no Linux e em bytes no macOS)"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def start_mock(args) -> subprocess.Popen:
+    """Iniciar os dispositivos simulados e aguardar todas as portas aceitarem conexões"""
+    command = [
+        sys.executable, str(BENCH_DIR / 'mock_fortigate.py'),
+        '--port', str(args.port),
+        '--count', str(args.devices),
+        '--config-kb', str(args.config_kb),
+        '--bandwidth-kbps', str(args.bandwidth_kbps),
+        '--command-delay', str(args.command_delay),
+        '--drop-rate', str(args.drop_rate),
+        '--auth-fail-rate', str(args.auth_fail_rate),
+        '--link-kbps', str(args.link_kbps),
+        '--vdoms', str(args.vdoms),
+    ]
+    if not args.paging:
+        command.append('--no-paging')
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+    
+    deadline = time.monotonic() + 30 + args.devices * 0.1
+    pending = set(range(args.port, args.port + args.devices))
+    while pending:
+        if process.poll() is not None:
+            raise RuntimeError(f"mock_fortigate.py encerrou com código {process.returncode}")
+        if time.monotonic() > deadline:
+            process.terminate()
+            raise RuntimeError(f"Dispositivos simulados não responderam: {len(pending)} portas")
+        for port in list(pending):
+            try:
+                with socket.create_connection(('127.0.0.1', port), timeout=1):
+                    pending.discard(port)
+            except OSError:
+                pass
+        if pending:
+            time.sleep(0.2)
+    return process
+
+def prepare_environment(args, work_dir: Path) -> Path:
+    """Inventário e variáveis de ambiente do backup apontando para o diretório temporário"""
+    devices = [
+        {
+            'name': f"bench-{i + 1:03d}",
+            'host': '127.0.0.1',
+            'port': args.port + i,
+            'username': 'admin',
+            'password': 'admin',
+            'vdom': 'root',
+            'description': 'FortiGate simulado'
+        }
+        for i in range(args.devices)
+    ]
+    config_file = work_dir / 'devices.json'
+    config_file.write_text(json.dumps({'devices': devices}, indent=2), encoding='utf-8')
+    
+    (work_dir / 'backups').mkdir()
+    (work_dir / 'logs').mkdir()
+    os.environ.update({
+        'BACKUP_DIR': str(work_dir / 'backups'),
+        'LOG_DIR': str(work_dir / 'logs'),
+        'LOG_TO_FILE': 'false',
+        'LOG_LEVEL': args.log_level,
+        'BACKUP_MAX_WORKERS': str(args.workers),
+        'BACKUP_FORMAT': args.format,
+        'BINARY_TRANSFER': args.transfer,
+        'BACKUP_STORAGE': args.storage,
+        'SKIP_UNCHANGED': 'true' if args.skip_unchanged else 'false',
+        'VDOM_CAPTURE': 'true' if args.vdom_capture else 'false',
+        'VDOM_MAX_CHANNELS': str(args.vdom_channels),
+        'COLLECT_SYSTEM_INFO': 'false' if args.no_system_info else 'true',
+        'SSH_TIMEOUT': str(args.ssh_timeout),
+        # Falhas injetadas não devem abrir o circuito entre as rodadas
+        'CIRCUIT_BREAKER_THRESHOLD': '0',
+        'ARCHIVE_ENABLED': 'false',
+        'TELEGRAM_BOT_TOKEN': '',
+        'TELEGRAM_CHAT_ID': ''
+    })
+    return config_file
+
+def run_round(backup_system, round_number: int) -> Dict:
+    """Uma execução completa; latência por dispositivo medida de fora do backup"""
+    latencies: Dict[str, float] = {}
+    lock = threading.Lock()
+    run_device_backup = type(backup_system).run_device_backup
+    
+    def timed(device):
+        start = time.perf_counter()
+        try:
+            return run_device_backup(backup_system, device)
+        finally:
+            with lock:
+                latencies[device['name']] = time.perf_counter() - start
+    
+    backup_system.run_device_backup = timed
+    start = time.perf_counter()
+    try:
+        results = backup_system.backup_all_devices()
+    finally:
+        del backup_system.run_device_backup
+    elapsed = time.perf_counter() - start
+    
+    report = backup_system.metrics.to_report()
+    phases: Dict[str, List[float]] = {}
+    total_bytes = 0
+    download_bytes = 0
+    download_seconds = 0.0
+    for device in report['devices'].values():
+        total_bytes += device['bytes']
+        for phase, entry in device['phases'].items():
+            phases.setdefault(phase, []).append(entry['seconds'])
+        download = device['phases'].get('config_download')
+        if download:
+            download_bytes += download['bytes']
+            download_seconds += download['seconds']
+    
+    values = list(latencies.values())
+    succeeded = sum(1 for success in results.values() if success)
+    return {
+        'round': round_number,
+        'ssh_profile': backup_system.ssh_profile_default,
+        'devices': len(results),
+        'succeeded': succeeded,
+        'failed': len(results) - succeeded,
+        'wall_seconds': round(elapsed, 3),
+        'devices_per_minute': round(len(results) / elapsed * 60, 1) if elapsed else 0.0,
+        'latency_p50': round(percentile(values, 50), 3),
+        'latency_p99': round(percentile(values, 99), 3),
+        'latency_max': round(max(values, default=0.0), 3),
+        'bytes': total_bytes,
+        'throughput_kbps': round(total_bytes / 1024 / elapsed, 1) if elapsed else 0.0,
+        # Taxa média de um download (bytes da configuração / tempo do config_download)
+        'download_kbps': round(download_bytes / 1024 / download_seconds, 1) if download_seconds else 0.0,
+        'phase_mean_seconds': {
+            phase: round(sum(samples) / len(samples), 4) for phase, samples in sorted(phases.items())
+        },
+        'peak_rss_mb': round(peak_rss_mb(), 1)
+    }
+
+def print_round(result: Dict):
+    print(
+        f"Rodada {result['round']} [{result['ssh_profile']}]: {result['succeeded']}/{result['devices']} ok "
+        f"em {result['wall_seconds']:.1f}s | "
+        f"{result['devices_per_minute']:.1f} disp/min | p50 {result['latency_p50']:.2f}s | "
+        f"p99 {result['latency_p99']:.2f}s | {result['throughput_kbps']:.0f} KB/s | "
+        f"download {result['download_kbps']:.0f} KB/s | "
+        f"RSS pico {result['peak_rss_mb']:.1f} MB"
+    )
+    for phase, seconds in result['phase_mean_seconds'].items():
+        print(f"    {phase:<16} {seconds * 1000:9.1f} ms (média por dispositivo)")
+
+def print_profiles(results: List[Dict]):
+    """Comparação entre perfis SSH: média das rodadas de cada perfil"""
+    by_profile: Dict[str, List[Dict]] = {}
+    for result in results:
+        by_profile.setdefault(result['ssh_profile'], []).append(result)
+    print("\nPerfil SSH        download KB/s   ssh_auth ms   disp/min")
+    for profile, rounds in by_profile.items():
+        download = sum(r['download_kbps'] for r in rounds) / len(rounds)
+        auth = sum(r['phase_mean_seconds'].get('ssh_auth', 0) for r in rounds) / len(rounds)
+        rate = sum(r['devices_per_minute'] for r in rounds) / len(rounds)
+        print(f"{profile:<16} {download:>14.1f} {auth * 1000:>13.1f} {rate:>10.1f}")
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Benchmark do backup contra FortiGates simulados")
+    parser.add_argument('--devices', type=int, default=20, help='Número de dispositivos simulados')
+    parser.add_argument('--workers', type=int, default=8, help='BACKUP_MAX_WORKERS')
+    parser.add_argument('--rounds', type=int, default=1, help='Execuções consecutivas (mesmo processo)')
+    parser.add_argument('--port', type=int, default=22200, help='Porta do primeiro dispositivo simulado')
+    parser.add_argument('--config-kb', type=int, default=200, help='Tamanho da configuração em KB')
+    parser.add_argument('--bandwidth-kbps', type=float, default=0, help='Banda simulada por sessão em KB/s')
+    parser.add_argument('--link-kbps', type=float, default=0,
+                        help='Banda do link por conexão em KB/s, após compressão SSH (0 = ilimitada)')
+    parser.add_argument('--profiles', default='',
+                        help='Perfis SSH comparados, separados por vírgula (ex.: default,wan,bulk)')
+    parser.add_argument('--command-delay', type=float, default=0, help='Latência por comando em segundos')
+    parser.add_argument('--no-paging', dest='paging', action='store_false', help='Dispositivos sem --More--')
+    parser.add_argument('--drop-rate', type=float, default=0, help='Probabilidade de queda no meio da saída')
+    parser.add_argument('--auth-fail-rate', type=float, default=0, help='Probabilidade de falha de autenticação')
+    parser.add_argument('--vdoms', type=int, default=0, help='VDOMs por dispositivo simulado (0 = sem multi-VDOM)')
+    parser.add_argument('--vdom-capture', action='store_true', help='VDOM_CAPTURE=true (global + VDOMs em paralelo)')
+    parser.add_argument('--vdom-channels', type=int, default=4, help='VDOM_MAX_CHANNELS')
+    parser.add_argument('--format', choices=['text', 'binary'], default='text', help='BACKUP_FORMAT')
+    parser.add_argument('--transfer', choices=['scp', 'sftp'], default='scp', help='BINARY_TRANSFER')
+    parser.add_argument('--storage', choices=['files', 'cas'], default='files', help='BACKUP_STORAGE')
+    parser.add_argument('--skip-unchanged', action='store_true', help='SKIP_UNCHANGED=true')
+    parser.add_argument('--no-system-info', action='store_true', help='COLLECT_SYSTEM_INFO=false')
+    parser.add_argument('--ssh-timeout', type=int, default=30, help='SSH_TIMEOUT')
+    parser.add_argument('--log-level', default='WARNING', help='LOG_LEVEL do backup')
+    parser.add_argument('--json', help='Gravar o resultado em JSON neste arquivo')
+    parser.add_argument('--keep', action='store_true', help='Manter o diretório temporário com os backups')
+    return parser
+
+def main():
+    args = build_parser().parse_args()
+    work_dir = Path(tempfile.mkdtemp(prefix='fortigate-bench-'))
+    config_file = prepare_environment(args, work_dir)
+    
+    print(
+        f"Benchmark: {args.devices} dispositivos, {args.workers} workers, config {args.config_kb} KB, "
+        f"formato {args.format}, armazenamento {args.storage}"
+    )
+    mock = start_mock(args)
+    results = []
+    try:
+        from fortigate_backup import FortiGateSSHBackup
+        logging.getLogger('paramiko').setLevel(logging.WARNING)
+        baseline_rss = peak_rss_mb()
+        backup_system = FortiGateSSHBackup(str(config_file))
+        profiles = [name.strip() for name in args.profiles.split(',') if name.strip()]
+        round_number = 0
+        # Cada perfil executa as suas rodadas com o mesmo processo e os mesmos dispositivos
+        for profile in profiles or [backup_system.ssh_profile_default]:
+            if profile not in backup_system.ssh_profiles:
+                raise SystemExit(f"Perfil SSH desconhecido: {profile}")
+            backup_system.ssh_profile_default = profile
+            for _ in range(args.rounds):
+                round_number += 1
+                result = run_round(backup_system, round_number)
+                print_round(result)
+                results.append(result)
+        if len(profiles) > 1:
+            print_profiles(results)
+    finally:
+        mock.terminate()
+        mock.wait()
+        if not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        else:
+            print(f"Backups mantidos em {work_dir}")
+    
+    if args.json:
+        summary = {
+            'parameters': {key: value for key, value in vars(args).items() if key not in ('json', 'keep')},
+            'baseline_rss_mb': round(baseline_rss, 1),
+            'rounds': results
+        }
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, indent=2, ensure_ascii=False)
+        print(f"Resultado gravado em {args.json}")
+    
+    if any(result['failed'] for result in results) and not (args.drop_rate or args.auth_fail_rate):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
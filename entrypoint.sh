@@ -43,8 +43,8 @@ if [ "$#" -eq 0 ]; then
         log "⏰ Agendamento ativo: $CRON_SCHEDULE"
         log "📋 Para ver logs: docker compose logs -f fortigate-backup"
         log "📋 Para executar manual: docker compose exec fortigate-backup python src/fortigate_backup.py"
-        # Iniciar scheduler em background
-        python src/scheduler.py
+        # Iniciar scheduler (exec: recebe o SIGTERM do docker stop e conclui a execução em andamento)
+        exec python src/scheduler.py
     else
         log "💡 Use: docker compose exec fortigate-backup python src/fortigate_backup.py"
         # Manter container rodando
@@ -31,12 +31,17 @@ show_help() {
     echo "  -f, --force         Executar sem confirmação"
     echo "  -l, --logs-only     Limpar apenas logs, manter backups"
     echo "  -b, --backups-only  Limpar apenas backups, manter logs"
+    echo "  -n, --dry-run       Apenas mostrar os backups que seriam removidos"
     echo "  -h, --help          Mostrar esta ajuda"
     echo ""
     echo "Exemplos:"
     echo "  $0 -d 7             # Manter apenas últimos 7 dias"
     echo "  $0 -f               # Executar sem confirmação"
     echo "  $0 -l -d 3          # Limpar logs com mais de 3 dias"
+    echo "  $0 -b -n            # Simular a retenção dos backups"
+    echo ""
+    echo "Com RETENTION_DAILY/WEEKLY/MONTHLY definidos no .env a retenção dos backups é GFS"
+    echo "e -d vale apenas para os logs."
 }
 
 # Função para verificar se o Docker está rodando
@@ -47,19 +52,33 @@ check_docker() {
     fi
 }
 
+# Executar o comando de limpeza do sistema (retenção calculada a partir do catálogo)
+run_retention() {
+    if docker compose ps | grep -q "fortigate-backup"; then
+        docker compose exec -T -e BACKUP_RETENTION_DAYS="$1" fortigate-backup python src/fortigate_backup.py cleanup "${@:2}"
+    else
+        BACKUP_DIR="$BACKUP_DIR" LOG_DIR="$LOG_DIR" BACKUP_RETENTION_DAYS="$1" python3 src/fortigate_backup.py cleanup "${@:2}"
+    fi
+}
+
 # Função para limpar backups antigos
 cleanup_backups() {
     local retention_days=$1
     local force=$2
+    local dry_run=$3
     
-    log "${BLUE}🧹 Iniciando limpeza de backups antigos (>${retention_days} dias)${NC}"
+    log "${BLUE}🧹 Iniciando limpeza de backups (retenção do catálogo, RETENTION_DAILY/WEEKLY/MONTHLY ou >${retention_days} dias)${NC}"
     
-    # Contar arquivos que serão removidos
+    # Simulação: o plano de retenção mostra o que seria removido
+    local plan
+    plan=$(run_retention "$retention_days" --dry-run)
     local count
-    if docker compose ps | grep -q "fortigate-backup"; then
-        count=$(docker compose exec fortigate-backup find /app/backups -name "*.conf" -type f -mtime +${retention_days} | wc -l)
-    else
-        count=$(find "$BACKUP_DIR" -name "*.conf" -type f -mtime +${retention_days} 2>/dev/null | wc -l || echo "0")
+    count=$(echo "$plan" | grep -c "^remover" || true)
+    
+    if [ "$dry_run" = true ]; then
+        echo "$plan"
+        log "${YELLOW}📋 Simulação: $count backups seriam removidos${NC}"
+        return 0
     fi
     
     if [ "$count" -eq 0 ]; then
@@ -67,7 +86,7 @@ cleanup_backups() {
         return 0
     fi
     
-    log "${YELLOW}📋 Encontrados $count arquivos de backup para remoção${NC}"
+    log "${YELLOW}📋 Encontrados $count backups para remoção${NC}"
     
     # Confirmar se não for forçado
     if [ "$force" != "true" ]; then
@@ -80,13 +99,7 @@ cleanup_backups() {
     fi
     
     # Executar limpeza
-    if docker compose ps | grep -q "fortigate-backup"; then
-        docker compose exec fortigate-backup find /app/backups -name "*.conf" -type f -mtime +${retention_days} -delete
-        docker compose exec fortigate-backup find /app/backups -name "*_info.json" -type f -mtime +${retention_days} -delete
-    else
-        find "$BACKUP_DIR" -name "*.conf" -type f -mtime +${retention_days} -delete 2>/dev/null || true
-        find "$BACKUP_DIR" -name "*_info.json" -type f -mtime +${retention_days} -delete 2>/dev/null || true
-    fi
+    run_retention "$retention_days" | tail -n 1
     
     log "${GREEN}✅ Limpeza de backups concluída${NC}"
 }
@@ -101,9 +114,9 @@ cleanup_logs() {
     # Contar arquivos que serão removidos
     local count
     if docker compose ps | grep -q "fortigate-backup"; then
-        count=$(docker compose exec fortigate-backup find /app/logs -name "*.log" -type f -mtime +${retention_days} | wc -l)
+        count=$(docker compose exec fortigate-backup find /app/logs -name "*.log*" -type f -mtime +${retention_days} | wc -l)
     else
-        count=$(find "$LOG_DIR" -name "*.log" -type f -mtime +${retention_days} 2>/dev/null | wc -l || echo "0")
+        count=$(find "$LOG_DIR" -name "*.log*" -type f -mtime +${retention_days} 2>/dev/null | wc -l || echo "0")
     fi
     
     if [ "$count" -eq 0 ]; then
@@ -125,9 +138,9 @@ cleanup_logs() {
     
     # Executar limpeza
     if docker compose ps | grep -q "fortigate-backup"; then
-        docker compose exec fortigate-backup find /app/logs -name "*.log" -type f -mtime +${retention_days} -delete
+        docker compose exec fortigate-backup find /app/logs -name "*.log*" -type f -mtime +${retention_days} -delete
     else
-        find "$LOG_DIR" -name "*.log" -type f -mtime +${retention_days} -delete 2>/dev/null || true
+        find "$LOG_DIR" -name "*.log*" -type f -mtime +${retention_days} -delete 2>/dev/null || true
     fi
     
     log "${GREEN}✅ Limpeza de logs concluída${NC}"
@@ -143,7 +156,7 @@ show_stats() {
         docker compose exec fortigate-backup du -sh /app/backups 2>/dev/null | cut -f1 | xargs echo "  Espaço utilizado:"
         
         echo "Logs:"
-        docker compose exec fortigate-backup find /app/logs -name "*.log" -type f | wc -l | xargs echo "  Arquivos de log:"
+        docker compose exec fortigate-backup find /app/logs -name "*.log*" -type f | wc -l | xargs echo "  Arquivos de log:"
         docker compose exec fortigate-backup du -sh /app/logs 2>/dev/null | cut -f1 | xargs echo "  Espaço utilizado:"
     else
         echo "Backups:"
@@ -151,7 +164,7 @@ show_stats() {
         du -sh "$BACKUP_DIR" 2>/dev/null | cut -f1 | xargs echo "  Espaço utilizado:" || echo "  Espaço utilizado: N/A"
         
         echo "Logs:"
-        find "$LOG_DIR" -name "*.log" -type f 2>/dev/null | wc -l | xargs echo "  Arquivos de log:"
+        find "$LOG_DIR" -name "*.log*" -type f 2>/dev/null | wc -l | xargs echo "  Arquivos de log:"
         du -sh "$LOG_DIR" 2>/dev/null | cut -f1 | xargs echo "  Espaço utilizado:" || echo "  Espaço utilizado: N/A"
     fi
 }
@@ -162,6 +175,7 @@ main() {
     local force=false
     local logs_only=false
     local backups_only=false
+    local dry_run=false
     
     # Parse dos argumentos
     while [[ $# -gt 0 ]]; do
@@ -182,6 +196,10 @@ main() {
                 backups_only=true
                 shift
                 ;;
+            -n|--dry-run)
+                dry_run=true
+                shift
+                ;;
             -h|--help)
                 show_help
                 exit 0
@@ -211,10 +229,12 @@ main() {
     if [ "$logs_only" = true ]; then
         cleanup_logs "$retention_days" "$force"
     elif [ "$backups_only" = true ]; then
-        cleanup_backups "$retention_days" "$force"
+        cleanup_backups "$retention_days" "$force" "$dry_run"
     else
-        cleanup_backups "$retention_days" "$force"
-        cleanup_logs "$retention_days" "$force"
+        cleanup_backups "$retention_days" "$force" "$dry_run"
+        if [ "$dry_run" != true ]; then
+            cleanup_logs "$retention_days" "$force"
+        fi
     fi
     
     # Mostrar estatísticas finais
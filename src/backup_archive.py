@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""
+Arquivo histórico compactado de backups FortiGate
+Cada dispositivo/tipo é guardado como snapshot completo seguido de deltas por linha
+compactados, com novo snapshot (re-base) a cada ARCHIVE_MAX_CHAIN versões
+"""
+
+import gzip
+import json
+import difflib
+import hashlib
+import logging
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from backup_store import AtomicBackupWriter
+
+class BackupArchive:
+    """Histórico de versões em formato base + deltas
+    
+    Estrutura: archive/<dispositivo>/<tipo>/index.json, <timestamp>.base.gz e
+    <timestamp>.delta.gz. Reconstruir qualquer versão exige no máximo max_chain deltas.
+    """
+    
+    def __init__(self, root: Path, max_chain: int = 30, compress_level: int = 6):
+        self.root = Path(root)
+        self.max_chain = max(1, max_chain)
+        self.compress_level = compress_level
+        # Última versão (série, timestamp, linhas) da série em andamento, evita reler a cadeia a
+        # cada append; apenas uma série fica em memória, mesmo em processos de longa duração
+        self._last: Optional[tuple] = None
+    
+    def _series_dir(self, device_name: str, kind: str) -> Path:
+        return self.root / device_name / kind
+    
+    def _load_index(self, series: Path) -> List[Dict]:
+        index_file = series / 'index.json'
+        if not index_file.exists():
+            return []
+        with open(index_file, 'r', encoding='utf-8') as f:
+            return json.load(f)['versions']
+    
+    def _save_index(self, series: Path, versions: List[Dict]):
+        with AtomicBackupWriter(series / 'index.json') as writer:
+            writer.write(json.dumps({'versions': versions}, indent=1))
+            writer.commit()
+    
+    def _write_blob(self, path: Path, payload: bytes):
+        with AtomicBackupWriter(path) as writer:
+            writer.write_bytes(gzip.compress(payload, compresslevel=self.compress_level))
+            writer.commit()
+    
+    def _read_blob(self, path: Path) -> bytes:
+        with open(path, 'rb') as f:
+            return gzip.decompress(f.read())
+    
+    @staticmethod
+    def _make_delta(old: List[str], new: List[str]) -> List:
+        """Delta por linha: ["c", i1, i2] copia linhas da versão anterior, ["i", [...]] insere"""
+        ops = []
+        matcher = difflib.SequenceMatcher(None, old, new)
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            if tag == 'equal':
+                ops.append(['c', i1, i2])
+            elif tag in ('replace', 'insert'):
+                ops.append(['i', new[j1:j2]])
+        return ops
+    
+    @staticmethod
+    def _apply_delta(old: List[str], ops: List) -> List[str]:
+        new = []
+        for op in ops:
+            if op[0] == 'c':
+                new.extend(old[op[1]:op[2]])
+            else:
+                new.extend(op[1])
+        return new
+    
+    def versions(self, device_name: str, kind: str = 'config') -> List[Dict]:
+        """Versões arquivadas do dispositivo em ordem cronológica"""
+        return self._load_index(self._series_dir(device_name, kind))
+    
+    def _reconstruct(self, series: Path, versions: List[Dict], position: int) -> List[str]:
+        """Reconstruir a versão na posição informada a partir do último snapshot"""
+        base = position
+        while versions[base]['type'] != 'base':
+            base -= 1
+        lines = self._read_blob(series / versions[base]['file']).decode('utf-8').splitlines(True)
+        for version in versions[base + 1:position + 1]:
+            ops = json.loads(self._read_blob(series / version['file']))
+            lines = self._apply_delta(lines, ops)
+        return lines
+    
+    def add(self, device_name: str, kind: str, timestamp: str, content: bytes) -> Dict:
+        """Acrescentar uma versão ao histórico"""
+        # Conteúdo fora de UTF-8 gera UnicodeDecodeError antes de qualquer gravação
+        lines = content.decode('utf-8').splitlines(True)
+        series = self._series_dir(device_name, kind)
+        series.mkdir(parents=True, exist_ok=True)
+        versions = self._load_index(series)
+        if versions and timestamp <= versions[-1]['timestamp']:
+            raise ValueError(f"Versão {timestamp} não é posterior à última arquivada ({versions[-1]['timestamp']})")
+        
+        entry = {
+            'timestamp': timestamp,
+            'sha256': hashlib.sha256(content).hexdigest(),
+            'size': len(content)
+        }
+        
+        # Distância até o último snapshot define se é hora de re-base
+        chain = 0
+        for version in reversed(versions):
+            if version['type'] == 'base':
+                break
+            chain += 1
+        
+        delta_payload = None
+        if versions and chain < self.max_chain:
+            cached = self._last
+            if cached and cached[0] == series and cached[1] == versions[-1]['timestamp']:
+                previous = cached[2]
+            else:
+                previous = self._reconstruct(series, versions, len(versions) - 1)
+            delta_payload = json.dumps(self._make_delta(previous, lines), separators=(',', ':')).encode('utf-8')
+            # Delta maior que metade do conteúdo não compensa: grava snapshot
+            if len(delta_payload) > len(content) // 2:
+                delta_payload = None
+        
+        if delta_payload is None:
+            entry.update(type='base', file=f"{timestamp}.base.gz")
+            self._write_blob(series / entry['file'], content)
+        else:
+            entry.update(type='delta', file=f"{timestamp}.delta.gz")
+            self._write_blob(series / entry['file'], delta_payload)
+        
+        versions.append(entry)
+        self._save_index(series, versions)
+        self._last = (series, timestamp, lines)
+        return entry
+    
+    def read(self, device_name: str, timestamp: str, kind: str = 'config') -> Optional[bytes]:
+        """Conteúdo original de uma versão (None se não arquivada)"""
+        series = self._series_dir(device_name, kind)
+        versions = self._load_index(series)
+        for position, version in enumerate(versions):
+            if version['timestamp'] == timestamp:
+                content = ''.join(self._reconstruct(series, versions, position)).encode('utf-8')
+                if hashlib.sha256(content).hexdigest() != version['sha256']:
+                    raise ValueError(f"Versão corrompida no arquivo: {device_name} {kind} {timestamp}")
+                return content
+        return None
+    
+    def ingest(self, files: Iterable[Tuple[str, str, str, Path]], keep_plain: int = 1,
+               on_series: Optional[Callable[[List[Dict]], None]] = None) -> List[Dict]:
+        """Mover arquivos .conf/.txt para o histórico, mantendo os N mais recentes em texto puro
+
+        Recebe tuplas (dispositivo, tipo, timestamp, caminho). Cada arquivo só é removido
+        depois de lido de volta do histórico e conferido por hash. `on_series` recebe as
+        entradas arquivadas de cada série logo após a remoção dos arquivos (mesmo se a série
+        for interrompida por erro), para que o catálogo nunca aponte para arquivos removidos.
+        Arquivos já ausentes cuja versão está no histórico contam como arquivados.
+        """
+        series_files: Dict[tuple, List[tuple]] = {}
+        for device, kind, timestamp, path in files:
+            series_files.setdefault((device, kind), []).append((timestamp, Path(path)))
+        
+        archived = []
+        for (device, kind), items in sorted(series_files.items()):
+            items.sort()
+            pending = items[:-keep_plain] if keep_plain > 0 else items
+            known = {version['timestamp']: version for version in self.versions(device, kind)}
+            last = max(known) if known else ''
+            series_archived = []
+            try:
+                for timestamp, path in pending:
+                    entry = known.get(timestamp)
+                    if entry is None:
+                        if timestamp < last:
+                            logging.warning(f"Arquivo anterior ao histórico, mantido em texto: {path.name}")
+                            continue
+                        try:
+                            content = path.read_bytes()
+                        except FileNotFoundError:
+                            logging.warning(f"Arquivo ausente e fora do histórico: {path.name}")
+                            continue
+                        try:
+                            entry = self.add(device, kind, timestamp, content)
+                        except UnicodeDecodeError:
+                            logging.warning(f"Arquivo fora de UTF-8, mantido em texto: {path.name}")
+                            continue
+                        if self.read(device, timestamp, kind) != content:
+                            raise ValueError(f"Falha na verificação do arquivo: {path.name}")
+                    path.unlink(missing_ok=True)
+                    series_archived.append({
+                        'device': device, 'kind': kind, 'timestamp': timestamp,
+                        'path': f"{self.root.name}/{device}/{kind}",
+                        'size': entry['size'], 'sha256': entry['sha256']
+                    })
+            finally:
+                # O cache só é útil dentro da série
+                self._last = None
+                archived.extend(series_archived)
+                if on_series and series_archived:
+                    on_series(series_archived)
+        return archived
+    
+    def prune_series(self, device_name: str, kind: str, before_timestamp: str) -> int:
+        """Remover as versões de uma série anteriores ao timestamp, promovendo a primeira restante a snapshot"""
+        series = self._series_dir(device_name, kind)
+        if not (series / 'index.json').exists():
+            return 0
+        return self._prune_series(series, before_timestamp)
+    
+    def _prune_series(self, series: Path, before_timestamp: str) -> int:
+        versions = self._load_index(series)
+        keep_from = next(
+            (i for i, version in enumerate(versions) if version['timestamp'] >= before_timestamp),
+            len(versions)
+        )
+        if keep_from == 0:
+            return 0
+        
+        obsolete = [version['file'] for version in versions[:keep_from]]
+        if keep_from < len(versions) and versions[keep_from]['type'] != 'base':
+            content = ''.join(self._reconstruct(series, versions, keep_from)).encode('utf-8')
+            rebased = dict(versions[keep_from], type='base', file=f"{versions[keep_from]['timestamp']}.base.gz")
+            self._write_blob(series / rebased['file'], content)
+            obsolete.append(versions[keep_from]['file'])
+            versions[keep_from] = rebased
+        
+        # Índice gravado antes de apagar os blobs: uma interrupção deixa apenas arquivos órfãos
+        self._save_index(series, versions[keep_from:])
+        for file_name in obsolete:
+            (series / file_name).unlink(missing_ok=True)
+        if self._last and self._last[0] == series:
+            self._last = None
+        return keep_from
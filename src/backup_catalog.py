@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+Catálogo de backups FortiGate
+Índice SQLite (dispositivo, timestamp, tipo, tamanho, hash, caminho) atualizado a cada
+backup gravado, usado para contagens, retenção e consultas sem varrer o diretório
+"""
+
+import json
+import sqlite3
+import hashlib
+import logging
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+from backup_store import BACKUP_FILE_RE
+
+# Terminador do cabeçalho gravado em .conf e _system_*.txt
+HEADER_END = ("#" + "="*50 + "\n\n").encode('utf-8')
+
+class BackupCatalog:
+    """Índice transacional dos backups armazenados"""
+    
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS backups (
+            device TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            timestamp TEXT NOT NULL,
+            storage TEXT NOT NULL,
+            path TEXT NOT NULL,
+            size INTEGER,
+            sha256 TEXT,
+            created_at TEXT NOT NULL,
+            PRIMARY KEY (device, kind, timestamp)
+        );
+        CREATE INDEX IF NOT EXISTS idx_backups_timestamp ON backups (timestamp);
+        CREATE INDEX IF NOT EXISTS idx_backups_sha256 ON backups (sha256);
+        CREATE TABLE IF NOT EXISTS device_state (
+            device TEXT PRIMARY KEY,
+            probe_checksum TEXT,
+            config_sha256 TEXT,
+            config_timestamp TEXT,
+            consecutive_failures INTEGER DEFAULT 0,
+            failure_kind TEXT,
+            last_error TEXT,
+            last_attempt_at TEXT,
+            breaker_opened_at TEXT,
+            updated_at TEXT
+        );
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        );
+    """
+    
+    # Colunas acrescentadas depois da primeira versão do esquema (migradas com ALTER TABLE)
+    DEVICE_STATE_COLUMNS = {
+        'consecutive_failures': 'INTEGER DEFAULT 0',
+        'failure_kind': 'TEXT',
+        'last_error': 'TEXT',
+        'last_attempt_at': 'TEXT',
+        'breaker_opened_at': 'TEXT'
+    }
+    
+    def __init__(self, db_path: Path):
+        self.db_path = Path(db_path)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        with self._conn:
+            self._conn.executescript(self.SCHEMA)
+            self._migrate()
+    
+    def _migrate(self):
+        """Acrescentar colunas novas em catálogos criados por versões anteriores"""
+        existing = {row['name'] for row in self._conn.execute("PRAGMA table_info(device_state)")}
+        for column, definition in self.DEVICE_STATE_COLUMNS.items():
+            if column not in existing:
+                self._conn.execute(f"ALTER TABLE device_state ADD COLUMN {column} {definition}")
+    
+    def close(self):
+        with self._lock:
+            self._conn.close()
+    
+    @property
+    def is_built(self) -> bool:
+        """Indica se o catálogo já foi construído a partir do diretório"""
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = 'built_at'").fetchone()
+        return row is not None
+    
+    def record(self, device: str, kind: str, timestamp: str, storage: str, path: str,
+               size: Optional[int] = None, sha256: Optional[str] = None):
+        """Registrar (ou atualizar) um backup"""
+        self.record_many([{
+            'device': device, 'kind': kind, 'timestamp': timestamp, 'storage': storage,
+            'path': path, 'size': size, 'sha256': sha256
+        }])
+    
+    def record_many(self, entries: Iterable[Dict]):
+        """Registrar vários backups em uma única transação"""
+        with self._lock, self._conn:
+            self._insert(entries)
+    
+    def _insert(self, entries: Iterable[Dict]):
+        created_at = datetime.now().isoformat(timespec='seconds')
+        rows = [
+            (e['device'], e['kind'], e['timestamp'], e['storage'], e['path'],
+             e.get('size'), e.get('sha256'), created_at)
+            for e in entries
+        ]
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO backups "
+            "(device, kind, timestamp, storage, path, size, sha256, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            rows
+        )
+    
+    def relocate_many(self, entries: Iterable[Dict]):
+        """Atualizar armazenamento/caminho mantendo tamanho e hash originais"""
+        rows = [(e['storage'], e['path'], e['device'], e['kind'], e['timestamp']) for e in entries]
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "UPDATE backups SET storage = ?, path = ? WHERE device = ? AND kind = ? AND timestamp = ?",
+                rows
+            )
+    
+    def remove_many(self, entries: Iterable[Dict]):
+        """Remover registros (dispositivo, tipo, timestamp) em uma transação"""
+        keys = [(e['device'], e['kind'], e['timestamp']) for e in entries]
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "DELETE FROM backups WHERE device = ? AND kind = ? AND timestamp = ?", keys
+            )
+    
+    def _query(self, sql: str, params: tuple = ()) -> List[Dict]:
+        with self._lock:
+            return [dict(row) for row in self._conn.execute(sql, params)]
+    
+    def count(self, device: str, kind: str = 'config') -> int:
+        """Backups com conteúdo próprio (entradas "inalterado" não geram arquivo)"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT COUNT(*) FROM backups WHERE device = ? AND kind = ? AND storage != 'unchanged'",
+                (device, kind)
+            ).fetchone()
+        return row[0]
+    
+    def list(self, device: Optional[str] = None, kind: Optional[str] = None,
+             storage: Optional[str] = None) -> List[Dict]:
+        """Backups em ordem cronológica, com filtros opcionais"""
+        clauses, params = [], []
+        for column, value in (('device', device), ('kind', kind), ('storage', storage)):
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        return self._query(f"SELECT * FROM backups {where} ORDER BY device, kind, timestamp", tuple(params))
+    
+    def latest(self, device: str, kind: str = 'config', stored_only: bool = False) -> Optional[Dict]:
+        """Backup mais recente; stored_only ignora entradas "inalterado" sem conteúdo próprio"""
+        storage_filter = "AND storage != 'unchanged'" if stored_only else ""
+        rows = self._query(
+            f"SELECT * FROM backups WHERE device = ? AND kind = ? {storage_filter} "
+            "ORDER BY timestamp DESC LIMIT 1",
+            (device, kind)
+        )
+        return rows[0] if rows else None
+    
+    def get_state(self, device: str) -> Optional[Dict]:
+        """Estado persistido do dispositivo (checksum da última configuração, falhas consecutivas)"""
+        rows = self._query("SELECT * FROM device_state WHERE device = ?", (device,))
+        return rows[0] if rows else None
+    
+    def update_state(self, device: str, **fields):
+        """Atualizar campos do estado do dispositivo"""
+        fields['updated_at'] = datetime.now().isoformat(timespec='seconds')
+        columns = ', '.join(fields)
+        placeholders = ', '.join('?' for _ in fields)
+        updates = ', '.join(f"{column} = excluded.{column}" for column in fields)
+        with self._lock, self._conn:
+            self._conn.execute(
+                f"INSERT INTO device_state (device, {columns}) VALUES (?, {placeholders}) "
+                f"ON CONFLICT(device) DO UPDATE SET {updates}",
+                (device, *fields.values())
+            )
+    
+    def referenced_hashes(self, storage: str = 'cas') -> set:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT DISTINCT sha256 FROM backups WHERE storage = ? AND sha256 IS NOT NULL", (storage,)
+            )
+            return {row[0] for row in rows}
+    
+    @staticmethod
+    def _body_digest(path: Path) -> str:
+        """SHA-256 do conteúdo após o cabeçalho (mesmo critério usado na gravação)"""
+        content = path.read_bytes()
+        position = content.find(HEADER_END)
+        if position >= 0:
+            content = content[position + len(HEADER_END):]
+        return hashlib.sha256(content).hexdigest()
+    
+    def rebuild(self, backup_dir: Path, archive_root: Optional[Path] = None) -> int:
+        """Reconstruir o catálogo a partir dos arquivos existentes"""
+        backup_dir = Path(backup_dir)
+        entries = []
+        for path in backup_dir.iterdir():
+            match = BACKUP_FILE_RE.match(path.name)
+            if not match or not path.is_file():
+                continue
+            entry = {
+                'device': match.group('device'),
+                'kind': match.group('kind'),
+                'timestamp': match.group('timestamp'),
+                'path': path.name
+            }
+            try:
+                if match.group('ext') == 'ref':
+                    with open(path, 'r', encoding='utf-8') as f:
+                        pointer = json.load(f)
+                    entry.update(storage='cas', size=pointer.get('size'), sha256=pointer.get('sha256'))
+                else:
+                    entry.update(storage='file', size=path.stat().st_size, sha256=self._body_digest(path))
+            except (OSError, ValueError) as e:
+                logging.warning(f"Arquivo ignorado na reconstrução do catálogo: {path.name} ({e})")
+                continue
+            entries.append(entry)
+        
+        # Versões do histórico compactado
+        if archive_root and Path(archive_root).exists():
+            for index_file in Path(archive_root).glob('*/*/index.json'):
+                device, kind = index_file.parent.parent.name, index_file.parent.name
+                with open(index_file, 'r', encoding='utf-8') as f:
+                    versions = json.load(f)['versions']
+                # O índice guarda o hash do arquivo completo, não do conteúdo sem cabeçalho
+                for version in versions:
+                    entries.append({
+                        'device': device, 'kind': kind, 'timestamp': version['timestamp'],
+                        'storage': 'archive',
+                        'path': str(index_file.parent.relative_to(backup_dir)),
+                        'size': version['size'], 'sha256': None
+                    })
+        
+        # Substituição completa em uma única transação
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM backups")
+            self._insert(entries)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('built_at', ?)",
+                (datetime.now().isoformat(timespec='seconds'),)
+            )
+        return len(entries)
@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+"""
+Armazenamento de backups FortiGate
+Gravação atômica dos arquivos de backup com hash calculado durante a escrita
+e armazenamento deduplicado endereçado por conteúdo (SHA-256)
+"""
+
+import os
+import re
+import json
+import hashlib
+import logging
+import tempfile
+from pathlib import Path
+from typing import Dict, Optional
+
+# Nome dos arquivos de backup: {dispositivo}_{tipo}_{YYYYMMDD}_{HHMMSS}.{extensão}
+# (tipo global/vdom-<nome> na captura separada por VDOM)
+BACKUP_FILE_RE = re.compile(
+    r'^(?P<device>.+)_(?P<kind>config|system|global|vdom-.+?)_(?P<timestamp>\d{8}_\d{6})\.(?P<ext>conf|txt|ref)$'
+)
+
+def config_header(device_name: str, host: str, date: str, vdom: str) -> str:
+    """Cabeçalho padrão dos arquivos .conf"""
+    return (
+        f"# Backup de configuração do FortiGate\n"
+        f"# Dispositivo: {device_name} ({host})\n"
+        f"# Data: {date}\n"
+        f"# VDOM: {vdom}\n"
+        + "#" + "="*50 + "\n\n"
+    )
+
+class AtomicBackupWriter:
+    """Grava um backup em arquivo temporário e publica com rename atômico
+    
+    Apenas o conteúdo passado a write() entra no SHA-256 e na contagem de bytes;
+    o cabeçalho (que contém a data) fica de fora para que o hash identifique a configuração.
+    """
+    
+    def __init__(self, final_path: Path):
+        self.final_path = Path(final_path)
+        fd, temp_name = tempfile.mkstemp(
+            dir=self.final_path.parent, prefix=f".{self.final_path.name}.", suffix='.tmp'
+        )
+        self.temp_path = Path(temp_name)
+        self._file = os.fdopen(fd, 'wb')
+        self._sha256 = hashlib.sha256()
+        self.size = 0
+        self.committed = False
+    
+    def write_header(self, text: str):
+        """Gravar cabeçalho (não entra no hash)"""
+        self._file.write(text.encode('utf-8'))
+    
+    def write(self, data: str):
+        """Gravar um bloco de conteúdo atualizando hash e tamanho"""
+        self.write_bytes(data.encode('utf-8'))
+    
+    def write_bytes(self, data: bytes):
+        """Gravar um bloco binário atualizando hash e tamanho"""
+        self._sha256.update(data)
+        self.size += len(data)
+        self._file.write(data)
+    
+    def write_raw(self, source):
+        """Copiar conteúdo binário de um arquivo aberto atualizando hash e tamanho"""
+        for chunk in iter(lambda: source.read(1024 * 1024), b''):
+            self.write_bytes(chunk)
+    
+    @property
+    def sha256(self) -> str:
+        return self._sha256.hexdigest()
+    
+    def commit(self) -> Path:
+        """Sincronizar em disco e renomear para o nome definitivo"""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        os.replace(self.temp_path, self.final_path)
+        self.committed = True
+        return self.final_path
+    
+    def abort(self):
+        """Descartar o arquivo temporário"""
+        if not self._file.closed:
+            self._file.close()
+        self.temp_path.unlink(missing_ok=True)
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, tb):
+        # Sem commit explícito o backup parcial nunca aparece no diretório
+        if not self.committed:
+            self.abort()
+
+
+class DedupObjectWriter:
+    """Grava um objeto no armazenamento deduplicado durante o streaming
+    
+    Enquanto o conteúdo recebido for idêntico ao objeto base (backup anterior do
+    dispositivo), nada é gravado em disco: os bytes são apenas comparados. Na primeira
+    divergência o prefixo já confirmado é copiado do objeto base para um temporário e a
+    gravação segue normalmente.
+    """
+    
+    def __init__(self, store: 'ContentStore', base_digest: Optional[str] = None):
+        self.store = store
+        self.base_digest = base_digest
+        self._base = None
+        if base_digest and store.object_path(base_digest).exists():
+            self._base = open(store.object_path(base_digest), 'rb')
+        self._temp = None
+        self.temp_path: Optional[Path] = None
+        self._sha256 = hashlib.sha256()
+        self.size = 0
+        self.committed = False
+        self.deduplicated = False
+    
+    @property
+    def sha256(self) -> str:
+        return self._sha256.hexdigest()
+    
+    def _open_temp(self):
+        fd, temp_name = tempfile.mkstemp(dir=self.store.temp_dir, suffix='.tmp')
+        self.temp_path = Path(temp_name)
+        self._temp = os.fdopen(fd, 'wb')
+    
+    def _diverge(self, matched: int):
+        """Abandonar a comparação e materializar o prefixo idêntico ao objeto base"""
+        self._open_temp()
+        self._base.seek(0)
+        remaining = matched
+        while remaining:
+            chunk = self._base.read(min(remaining, 1024 * 1024))
+            self._temp.write(chunk)
+            remaining -= len(chunk)
+        self._base.close()
+        self._base = None
+    
+    def write(self, data: str):
+        """Processar um bloco de conteúdo"""
+        self.write_bytes(data.encode('utf-8'))
+    
+    def write_bytes(self, encoded: bytes):
+        """Processar um bloco binário"""
+        matched = self.size
+        self._sha256.update(encoded)
+        self.size += len(encoded)
+        
+        if self._base is not None:
+            if self._base.read(len(encoded)) == encoded:
+                return
+            self._diverge(matched)
+        elif self._temp is None:
+            self._open_temp()
+        self._temp.write(encoded)
+    
+    def commit(self) -> str:
+        """Finalizar o objeto e retornar seu SHA-256"""
+        digest = self.sha256
+        if self._base is not None:
+            # Conteúdo idêntico até aqui: só é duplicata se o objeto base também terminou
+            if self._base.read(1) == b'' and digest == self.base_digest:
+                self._base.close()
+                self._base = None
+                self.deduplicated = True
+                self.committed = True
+                return digest
+            self._diverge(self.size)
+        elif self._temp is None:
+            self._open_temp()
+        
+        self._temp.flush()
+        os.fsync(self._temp.fileno())
+        self._temp.close()
+        
+        object_path = self.store.object_path(digest)
+        if object_path.exists():
+            # Mesmo conteúdo já armazenado por outra execução/dispositivo
+            self.temp_path.unlink()
+            self.deduplicated = True
+        else:
+            object_path.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(self.temp_path, object_path)
+        self.committed = True
+        return digest
+    
+    def abort(self):
+        """Descartar dados parciais"""
+        if self._base is not None:
+            self._base.close()
+            self._base = None
+        if self._temp is not None:
+            if not self._temp.closed:
+                self._temp.close()
+            self.temp_path.unlink(missing_ok=True)
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, tb):
+        if not self.committed:
+            self.abort()
+
+class ContentStore:
+    """Armazenamento de configurações endereçado por conteúdo
+    
+    O corpo da configuração é gravado uma única vez em objects/<aa>/<sha256>; cada
+    execução grava apenas um ponteiro JSON {dispositivo}_config_{timestamp}.ref com os
+    metadados do cabeçalho.
+    """
+    
+    POINTER_SUFFIX = '.ref'
+    
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self.objects_dir = self.root / 'objects'
+        self.temp_dir = self.objects_dir / 'tmp'
+        self.temp_dir.mkdir(parents=True, exist_ok=True)
+    
+    def object_path(self, digest: str) -> Path:
+        return self.objects_dir / digest[:2] / digest
+    
+    def pointer_path(self, device_name: str, timestamp: str, kind: str = 'config') -> Path:
+        return self.root / f"{device_name}_{kind}_{timestamp}{self.POINTER_SUFFIX}"
+    
+    def object_writer(self, base_digest: Optional[str] = None) -> DedupObjectWriter:
+        """Criar writer comparando com o objeto base (normalmente o último backup)"""
+        return DedupObjectWriter(self, base_digest)
+    
+    def write_pointer(self, pointer: Dict) -> Path:
+        """Gravar ponteiro de uma execução de forma atômica"""
+        path = self.pointer_path(pointer['device'], pointer['timestamp'], pointer.get('kind', 'config'))
+        with AtomicBackupWriter(path) as writer:
+            writer.write(json.dumps(pointer, indent=2, ensure_ascii=False) + "\n")
+            writer.commit()
+        return path
+    
+    def read_pointer(self, path: Path) -> Dict:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    
+    def materialize(self, pointer: Dict, output: Path) -> Path:
+        """Reconstruir o arquivo .conf tradicional (cabeçalho + configuração)"""
+        with AtomicBackupWriter(output) as writer:
+            # Backups binários são o arquivo original do FortiGate, sem cabeçalho
+            if pointer.get('format', 'text') != 'binary':
+                writer.write_header(config_header(
+                    pointer['device'], pointer.get('host', ''), pointer.get('date', ''),
+                    pointer.get('vdom', 'root')
+                ))
+            with open(self.object_path(pointer['sha256']), 'rb') as source:
+                writer.write_raw(source)
+            if writer.sha256 != pointer['sha256']:
+                raise ValueError(f"Objeto corrompido: {pointer['sha256']}")
+            writer.commit()
+        return output
+    
+    def collect_garbage(self, referenced: Optional[set] = None) -> int:
+        """Remover objetos que não são mais referenciados por nenhum ponteiro
+
+        Sem o conjunto de hashes referenciados (vindo do catálogo), os ponteiros são lidos do disco.
+        """
+        if referenced is None:
+            referenced = set()
+            for pointer_file in self.root.glob(f"*{self.POINTER_SUFFIX}"):
+                try:
+                    referenced.add(self.read_pointer(pointer_file)['sha256'])
+                except (OSError, ValueError, KeyError) as e:
+                    logging.warning(f"Ponteiro ilegível, coleta de objetos cancelada: {pointer_file.name} ({e})")
+                    return 0
+        
+        removed = 0
+        for object_file in self.objects_dir.glob('??/*'):
+            if object_file.name not in referenced:
+                object_file.unlink()
+                removed += 1
+        return removed
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+Parser e diff estrutural de configurações FortiOS
+Leitura em streaming dos blocos config/edit/set/next/end e comparação entre duas
+versões por objeto (adicionados, removidos e alterados por seção)
+"""
+
+import re
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Aspas não escapadas: valores multilinha (certificados, scripts) continuam até fechá-las
+UNESCAPED_QUOTE_RE = re.compile(r'(?<!\\)"')
+
+# Chave das configurações diretas de um bloco config (sem edit), ex.: "config system global"
+SETTINGS_KEY = '(settings)'
+
+def _unquote(value: str) -> str:
+    value = value.strip()
+    if len(value) >= 2 and value[0] == value[-1] == '"':
+        return value[1:-1]
+    return value
+
+def iter_config_events(lines: Iterable[str]) -> Iterator[Tuple]:
+    """Eventos da configuração linha a linha, sem carregar o arquivo
+    
+    Gera ('config', nome), ('edit', chave), ('set', opção, valor), ('unset', opção),
+    ('next',) e ('end',). Comentários e o cabeçalho do backup (#) são ignorados.
+    """
+    pending: Optional[List[str]] = None
+    for raw in lines:
+        line = raw.rstrip('\r\n')
+        if pending is not None:
+            pending.append(line)
+            if len(UNESCAPED_QUOTE_RE.findall(line)) % 2:
+                name, _, value = '\n'.join(pending).partition(' ')
+                pending = None
+                yield ('set', name, value)
+            continue
+        
+        stripped = line.strip()
+        if not stripped or stripped.startswith('#'):
+            continue
+        keyword, _, rest = stripped.partition(' ')
+        if keyword == 'set':
+            if len(UNESCAPED_QUOTE_RE.findall(rest)) % 2:
+                pending = [rest]
+                continue
+            name, _, value = rest.partition(' ')
+            yield ('set', name, value)
+        elif keyword == 'config':
+            yield ('config', rest)
+        elif keyword == 'edit':
+            yield ('edit', _unquote(rest))
+        elif keyword == 'unset':
+            yield ('unset', rest)
+        elif keyword in ('next', 'end'):
+            yield (keyword,)
+        # Demais linhas (prompt, avisos do CLI) não fazem parte da configuração
+
+def index_config(lines: Iterable[str]) -> Dict[Tuple[str, str], Dict[str, str]]:
+    """Objetos da configuração indexados por (seção, chave) -> {opção: valor}
+    
+    A seção é o caminho dos blocos config, com a chave dos edits intermediários entre
+    colchetes (ex.: "vdom[root] / firewall policy"). Configurações diretas de um bloco
+    usam a chave SETTINGS_KEY. A ordem dos objetos de cada seção é preservada.
+    """
+    objects: Dict[Tuple[str, str], Dict[str, str]] = {}
+    # Pilha de (tipo, nome): ('config', 'firewall policy') / ('edit', '10')
+    stack: List[Tuple[str, str]] = []
+    
+    def current() -> Tuple[str, str]:
+        if stack and stack[-1][0] == 'edit':
+            key, parents = stack[-1][1], stack[:-1]
+        else:
+            key, parents = SETTINGS_KEY, stack
+        parts: List[str] = []
+        for kind, name in parents:
+            if kind == 'config':
+                parts.append(name)
+            elif parts:
+                parts[-1] += f"[{name}]"
+        return ' / '.join(parts), key
+    
+    for event in iter_config_events(lines):
+        kind = event[0]
+        if kind == 'config':
+            stack.append(('config', event[1]))
+        elif kind == 'edit':
+            stack.append(('edit', event[1]))
+            objects.setdefault(current(), {})
+        elif kind == 'set':
+            objects.setdefault(current(), {})[event[1]] = event[2]
+        elif kind == 'unset':
+            objects.setdefault(current(), {}).pop(event[1], None)
+        elif kind == 'next':
+            if stack and stack[-1][0] == 'edit':
+                stack.pop()
+        elif kind == 'end':
+            # "end" fecha o edit aberto (sem next) e o bloco config
+            if stack and stack[-1][0] == 'edit':
+                stack.pop()
+            if stack:
+                stack.pop()
+    return objects
+
+def diff_configs(old_lines: Iterable[str], new_lines: Iterable[str]) -> Dict:
+    """Diferença estrutural entre duas versões de configuração
+    
+    Retorna {'sections': {seção: {'added': [...], 'removed': [...], 'changed': {chave:
+    {opção: [antes, depois]}}, 'reordered': bool}}, 'totals': {...}} apenas com seções alteradas.
+    """
+    old = index_config(old_lines)
+    new = index_config(new_lines)
+    
+    sections: Dict[str, Dict] = {}
+    
+    def section(name: str) -> Dict:
+        return sections.setdefault(name, {'added': [], 'removed': [], 'changed': {}, 'reordered': False})
+    
+    for key, settings in new.items():
+        if key not in old:
+            section(key[0])['added'].append(key[1])
+            continue
+        previous = old[key]
+        if previous == settings:
+            continue
+        changes = {
+            option: [previous.get(option), settings.get(option)]
+            for option in list(previous) + [option for option in settings if option not in previous]
+            if previous.get(option) != settings.get(option)
+        }
+        section(key[0])['changed'][key[1]] = changes
+    for key in old:
+        if key not in new:
+            section(key[0])['removed'].append(key[1])
+    
+    # Ordem dos objetos é semântica em algumas seções (ex.: firewall policy)
+    old_order: Dict[str, List[str]] = {}
+    new_order: Dict[str, List[str]] = {}
+    for index, order in ((old, old_order), (new, new_order)):
+        for name, key in index:
+            if key != SETTINGS_KEY:
+                order.setdefault(name, []).append(key)
+    for name, keys in new_order.items():
+        common = set(keys) & set(old_order.get(name, []))
+        if [key for key in keys if key in common] != [key for key in old_order.get(name, []) if key in common]:
+            section(name)['reordered'] = True
+    
+    return {
+        'sections': dict(sorted(sections.items())),
+        'totals': {
+            'added': sum(len(entry['added']) for entry in sections.values()),
+            'removed': sum(len(entry['removed']) for entry in sections.values()),
+            'changed': sum(len(entry['changed']) for entry in sections.values()),
+            'objects_old': len(old),
+            'objects_new': len(new)
+        }
+    }
+
+def _display(value: Optional[str], width: int = 80) -> str:
+    """Valor em uma linha para o relatório"""
+    if value is None:
+        return '(ausente)'
+    value = ' '.join(value.split())
+    return value if len(value) <= width else value[:width - 3] + '...'
+
+def summarize_diff(diff: Dict) -> str:
+    """Resumo de uma linha: +adicionados ~alterados -removidos"""
+    totals = diff['totals']
+    if not diff['sections']:
+        return "sem alterações"
+    return f"+{totals['added']} ~{totals['changed']} -{totals['removed']} em {len(diff['sections'])} seções"
+
+def format_diff(diff: Dict, max_items: int = 20, show_values: bool = True) -> str:
+    """Relatório em texto, limitado a max_items objetos por seção e categoria"""
+    if not diff['sections']:
+        return "Nenhuma alteração estrutural"
+    
+    def limited(items: List[str]) -> List[str]:
+        extra = len(items) - max_items
+        return items[:max_items] + ([f"... (+{extra})"] if extra > 0 else [])
+    
+    lines = [f"Alterações: {summarize_diff(diff)}"]
+    for name, entry in diff['sections'].items():
+        lines.append(f"\n[{name}]" + (" (ordem alterada)" if entry['reordered'] else ""))
+        for key in limited(entry['added']):
+            lines.append(f"  + {key}")
+        for key in limited(entry['removed']):
+            lines.append(f"  - {key}")
+        for key in limited(list(entry['changed'])):
+            if key not in entry['changed']:
+                lines.append(f"  {key}")
+                continue
+            lines.append(f"  ~ {key}")
+            if show_values:
+                for option, (before, after) in entry['changed'][key].items():
+                    lines.append(f"      {option}: {_display(before)} -> {_display(after)}")
+    return '\n'.join(lines)
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+Download do arquivo de configuração do FortiGate (backup binário)
+Transferência em streaming via SCP (requer "set admin-scp enable") ou SFTP,
+com progresso, verificação e novas tentativas em caso de interrupção
+"""
+
+import time
+import socket
+import logging
+from typing import Callable, Optional
+import paramiko
+
+class ConfigTransferError(Exception):
+    """Falha na transferência do arquivo de configuração"""
+
+class TransferInterrupted(ConfigTransferError):
+    """Transferência interrompida (nova tentativa pode resolver)"""
+
+class ConfigDownloader:
+    """Baixa o arquivo de configuração para um writer de backup
+    
+    O writer deve oferecer write_bytes(), size e abort(). No SFTP uma transferência
+    interrompida é retomada do último byte recebido; no SCP (que não permite offset) o
+    arquivo é baixado novamente com um writer novo.
+    """
+    
+    # Todo arquivo de configuração do FortiOS começa com esta linha
+    CONFIG_SIGNATURE = b'#config-version='
+    
+    def __init__(self, ssh: paramiko.SSHClient, reconnect: Callable[[], Optional[paramiko.SSHClient]],
+                 remote_path: str = 'sys_config', method: str = 'scp', retries: int = 3,
+                 timeout: int = 30, chunk_size: int = 65536):
+        self.ssh = ssh
+        self.reconnect = reconnect
+        self.remote_path = remote_path
+        self.method = method
+        self.retries = max(1, retries)
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        self._owned_clients = []
+        self._next_progress = 0
+        self._head = b''
+    
+    def _progress(self, received: int, total: int):
+        """Registrar progresso a cada 10%"""
+        if total <= 0:
+            return
+        percent = received * 100 // total
+        if percent >= self._next_progress:
+            logging.debug(f"Download de {self.remote_path}: {percent}% ({received}/{total} bytes)")
+            self._next_progress = percent - percent % 10 + 10
+    
+    def _write(self, writer, data: bytes):
+        """Repassar dados ao writer guardando o início do arquivo para verificação"""
+        if len(self._head) < len(self.CONFIG_SIGNATURE):
+            self._head += data[:len(self.CONFIG_SIGNATURE) - len(self._head)]
+        writer.write_bytes(data)
+    
+    def _read_line(self, channel: paramiko.Channel) -> bytes:
+        """Ler uma linha de controle do protocolo SCP"""
+        line = b''
+        while not line.endswith(b'\n'):
+            data = channel.recv(1)
+            if not data:
+                raise TransferInterrupted("Canal SCP encerrado durante o cabeçalho")
+            line += data
+        return line
+    
+    def _fetch_scp(self, ssh: paramiko.SSHClient, writer) -> int:
+        """Receber o arquivo pelo protocolo SCP (modo source do servidor)"""
+        channel = ssh.get_transport().open_session()
+        try:
+            channel.settimeout(self.timeout)
+            channel.exec_command(f"scp -f {self.remote_path}")
+            channel.sendall(b'\x00')
+            
+            header = self._read_line(channel)
+            # Linha "T" (tempos do arquivo) pode anteceder o cabeçalho do arquivo
+            if header.startswith(b'T'):
+                channel.sendall(b'\x00')
+                header = self._read_line(channel)
+            if header[:1] in (b'\x01', b'\x02'):
+                raise ConfigTransferError(header[1:].decode('utf-8', errors='ignore').strip())
+            if not header.startswith(b'C'):
+                raise ConfigTransferError(f"Resposta SCP inesperada: {header[:60]!r}")
+            
+            # Cabeçalho "C<modo> <tamanho> <nome>"
+            try:
+                size = int(header.split(b' ', 2)[1])
+            except (ValueError, IndexError):
+                raise ConfigTransferError(f"Cabeçalho SCP inválido: {header[:60]!r}") from None
+            if size < 0:
+                raise ConfigTransferError(f"Tamanho inválido no cabeçalho SCP: {size}")
+            channel.sendall(b'\x00')
+            
+            received = 0
+            while received < size:
+                data = channel.recv(min(self.chunk_size, size - received))
+                if not data:
+                    raise TransferInterrupted(f"Transferência interrompida em {received}/{size} bytes")
+                self._write(writer, data)
+                received += len(data)
+                self._progress(received, size)
+            
+            status = channel.recv(1)
+            if status != b'\x00':
+                raise ConfigTransferError(f"Servidor SCP reportou erro ao final da transferência: {status!r}")
+            channel.sendall(b'\x00')
+            return size
+        finally:
+            channel.close()
+    
+    def _fetch_sftp(self, ssh: paramiko.SSHClient, writer) -> int:
+        """Receber o arquivo via SFTP a partir do offset já gravado"""
+        sftp = ssh.open_sftp()
+        try:
+            sftp.get_channel().settimeout(self.timeout)
+            size = sftp.stat(self.remote_path).st_size
+            if writer.size > size:
+                raise ConfigTransferError("Arquivo remoto menor que o já recebido (alterado durante o download?)")
+            with sftp.open(self.remote_path, 'rb') as remote:
+                remote.seek(writer.size)
+                remote.prefetch(size)
+                while writer.size < size:
+                    data = remote.read(min(self.chunk_size, size - writer.size))
+                    if not data:
+                        raise TransferInterrupted(f"Transferência interrompida em {writer.size}/{size} bytes")
+                    self._write(writer, data)
+                    self._progress(writer.size, size)
+            return size
+        finally:
+            sftp.close()
+    
+    def _connection(self, attempt: int) -> paramiko.SSHClient:
+        """Conexão da tentativa atual (a original na primeira, uma nova nas seguintes)"""
+        if attempt == 1 and self.ssh.get_transport() and self.ssh.get_transport().is_active():
+            return self.ssh
+        ssh = self.reconnect()
+        if not ssh:
+            raise ConfigTransferError("Não foi possível reconectar ao dispositivo")
+        self._owned_clients.append(ssh)
+        return ssh
+    
+    def download(self, writer_factory: Callable[[], object]):
+        """Baixar o arquivo e retornar o writer completo (ainda não publicado)"""
+        writer = writer_factory()
+        self._head = b''
+        last_error = None
+        try:
+            for attempt in range(1, self.retries + 1):
+                start = time.monotonic()
+                self._next_progress = 0
+                try:
+                    ssh = self._connection(attempt)
+                    if self.method == 'sftp':
+                        expected = self._fetch_sftp(ssh, writer)
+                    else:
+                        expected = self._fetch_scp(ssh, writer)
+                    
+                    if writer.size != expected:
+                        raise TransferInterrupted(f"Tamanho divergente: {writer.size} de {expected} bytes")
+                    if self._head != self.CONFIG_SIGNATURE:
+                        raise ConfigTransferError("Arquivo recebido não é uma configuração FortiOS")
+                    
+                    elapsed = max(time.monotonic() - start, 0.001)
+                    logging.info(
+                        f"Download de {self.remote_path} concluído: {writer.size} bytes em {elapsed:.2f}s "
+                        f"({writer.size / elapsed / 1024:.1f} KB/s)"
+                    )
+                    return writer
+                except (TransferInterrupted, paramiko.SSHException, socket.error, EOFError) as e:
+                    last_error = e
+                    logging.warning(f"Tentativa {attempt}/{self.retries} de download falhou: {e}")
+                    if self.method != 'sftp':
+                        # SCP não permite retomar: recomeça com um writer vazio
+                        writer.abort()
+                        writer = writer_factory()
+                        self._head = b''
+            raise ConfigTransferError(f"Download de {self.remote_path} falhou: {last_error}")
+        except Exception:
+            # Erros reportados pelo servidor (ex.: admin-scp desabilitado) não são repetidos;
+            # qualquer falha não prevista também descarta o temporário
+            writer.abort()
+            raise
+        finally:
+            for client in self._owned_clients:
+                client.close()
+            self._owned_clients = []
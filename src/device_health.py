@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Verificação de acessibilidade dos dispositivos FortiGate
+Varredura TCP paralela antes do backup e circuit breaker persistido no catálogo
+para dispositivos com falhas consecutivas
+"""
+
+import time
+import socket
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Optional, Tuple
+from backup_catalog import BackupCatalog
+
+def tcp_probe(host: str, port: int, timeout: float) -> Optional[str]:
+    """Abrir e fechar uma conexão TCP; retorna a descrição do erro ou None se acessível"""
+    try:
+        with socket.create_connection((host, port), timeout=timeout):
+            return None
+    except socket.timeout:
+        return f"sem resposta em {timeout:g}s"
+    except OSError as e:
+        return e.strerror or str(e)
+
+def reachability_sweep(devices: Iterable[Dict], timeout: float, workers: int = 32) -> Dict[str, Optional[str]]:
+    """Testar em paralelo a porta SSH de todos os dispositivos
+    
+    Cada par host:porta é testado uma única vez, mesmo que apareça em várias entradas.
+    Retorna {dispositivo: erro ou None}.
+    """
+    targets: Dict[Tuple[str, int], list] = {}
+    for device in devices:
+        if 'name' in device and 'host' in device:
+            targets.setdefault((device['host'], int(device.get('port', 22))), []).append(device['name'])
+    if not targets:
+        return {}
+    
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=min(workers, len(targets)), thread_name_prefix='probe') as executor:
+        errors = dict(zip(targets, executor.map(lambda target: tcp_probe(*target, timeout), targets)))
+    
+    results = {}
+    for target, names in targets.items():
+        for name in names:
+            results[name] = errors[target]
+    reachable = sum(1 for error in results.values() if error is None)
+    logging.info(
+        f"Verificação de acessibilidade: {reachable}/{len(results)} dispositivos acessíveis "
+        f"em {time.monotonic() - start:.1f}s"
+    )
+    return results
+
+class CircuitBreaker:
+    """Circuit breaker por dispositivo com estado no catálogo
+    
+    Após `threshold` falhas consecutivas o circuito abre: o dispositivo deixa de receber
+    tentativas SSH completas e passa a ser apenas testado via TCP a cada execução. Se a
+    falha era de acesso, a primeira resposta TCP libera uma tentativa; se era do backup em si
+    (autenticação, CLI), uma nova tentativa só ocorre a cada `retry_interval`.
+    """
+    
+    def __init__(self, catalog: BackupCatalog, threshold: int = 3, retry_interval: timedelta = timedelta(hours=6)):
+        self.catalog = catalog
+        self.threshold = threshold
+        self.retry_interval = retry_interval
+    
+    @property
+    def enabled(self) -> bool:
+        return self.threshold > 0
+    
+    def is_open(self, device_name: str) -> bool:
+        if not self.enabled:
+            return False
+        state = self.catalog.get_state(device_name)
+        return bool(state and state['breaker_opened_at'])
+    
+    def check(self, device_name: str, probe_error: Optional[str]) -> Optional[str]:
+        """Motivo para ignorar o dispositivo nesta execução, ou None para tentar o backup"""
+        if probe_error:
+            return f"inacessível: {probe_error}"
+        if not self.is_open(device_name):
+            return None
+        
+        state = self.catalog.get_state(device_name)
+        if state['failure_kind'] == 'unreachable':
+            logging.info(f"Circuito aberto para {device_name}, mas a porta SSH voltou a responder: nova tentativa")
+            return None
+        last_attempt = datetime.fromisoformat(state['last_attempt_at']) if state['last_attempt_at'] else None
+        if last_attempt is None or datetime.now() - last_attempt >= self.retry_interval:
+            logging.info(f"Circuito aberto para {device_name}: tentativa de recuperação")
+            return None
+        next_attempt = (last_attempt + self.retry_interval).strftime('%d/%m/%Y %H:%M')
+        return (
+            f"circuito aberto após {state['consecutive_failures']} falhas "
+            f"({state['last_error']}), próxima tentativa após {next_attempt}"
+        )
+    
+    def record(self, device_name: str, success: bool, attempted: bool = True, error: Optional[str] = None):
+        """Registrar o resultado da execução do dispositivo"""
+        now = datetime.now().isoformat(timespec='seconds')
+        fields = {'last_attempt_at': now} if attempted else {}
+        if success:
+            if self.is_open(device_name):
+                logging.info(f"Circuito fechado para {device_name}: backup voltou a funcionar")
+            self.catalog.update_state(
+                device_name, consecutive_failures=0, failure_kind=None, last_error=None,
+                breaker_opened_at=None, **fields
+            )
+            return
+        
+        state = self.catalog.get_state(device_name) or {}
+        failures = (state.get('consecutive_failures') or 0) + 1
+        fields.update(
+            consecutive_failures=failures,
+            failure_kind='backup' if attempted else 'unreachable',
+            last_error=error or 'falha no backup'
+        )
+        if self.enabled and failures >= self.threshold and not state.get('breaker_opened_at'):
+            fields['breaker_opened_at'] = now
+            logging.warning(f"Circuito aberto para {device_name} após {failures} falhas consecutivas")
+        self.catalog.update_state(device_name, **fields)
@@ -7,97 +7,213 @@ Adaptado do projeto backup-datacom para FortiGate usando SSH
 
 import os
 import sys
+import re
 import json
+import time
+import fcntl
+import socket
 import logging
+import argparse
+import threading
+import ipaddress
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Dict, Iterator, List, Optional
 import paramiko
-from scp import SCPClient
 from dotenv import load_dotenv
-
-class TelegramNotifier:
-    """Classe para envio de notificações via Telegram"""
-    
-    def __init__(self, bot_token: str, chat_id: str):
-        self.bot_token = bot_token
-        self.chat_id = chat_id
-        self.base_url = f"https://api.telegram.org/bot{bot_token}"
-    
-    def send_message(self, message: str) -> bool:
-        """Envia mensagem via Telegram"""
-        try:
-            import requests
-            url = f"{self.base_url}/sendMessage"
-            data = {
-                "chat_id": self.chat_id,
-                "text": message,
-                "parse_mode": "HTML"
-            }
-            response = requests.post(url, data=data, timeout=10)
-            return response.status_code == 200
-        except Exception as e:
-            logging.error(f"Erro ao enviar mensagem Telegram: {e}")
-            return False
+from fortigate_shell import FortiGateShell
+from backup_store import AtomicBackupWriter, ContentStore, config_header
+from backup_archive import BackupArchive
+from backup_catalog import BackupCatalog
+from config_diff import diff_configs, format_diff, summarize_diff
+from config_transfer import ConfigDownloader, ConfigTransferError
+from device_health import CircuitBreaker, reachability_sweep, tcp_probe
+from logging_config import log_context, new_run_id, rotating_file_handler, setup_logging
+from metrics import MetricsRegistry, RunMetrics
+from notifications import TelegramNotifier
+from retention import RetentionPolicy
+from ssh_transport import KnownHostsCache, load_profiles, resolve_profile
+from sharding import (
+    collect_shard_results, parse_shard, select_shard, shard_label, shard_of, write_shard_result
+)
 
 class FortiGateSSHBackup:
     """Classe principal para backup de FortiGate via SSH"""
     
-    def __init__(self, config_file: str = "config/devices.json"):
+    def __init__(self, config_file: str = "config/devices.json", shard: Optional[str] = None,
+                 log_name: str = 'fortigate_backup', rotate_logs: bool = True):
         # Carregar variáveis de ambiente
         load_dotenv()
         
+        # Shard "i/N": apenas os dispositivos cujo hash do nome cai neste shard ('' desabilita
+        # mesmo com BACKUP_SHARD definido, como no coordenador)
+        if shard is None:
+            shard = os.getenv('BACKUP_SHARD', '')
+        self.shard = parse_shard(shard) if shard else None
+        # Resumo no Telegram por shard (o coordenador merge-shards envia o consolidado)
+        self.shard_summary = False
+        
         # Configurações
         self.config_file = config_file
         self.backup_dir = Path(os.getenv('BACKUP_DIR', '/app/backups'))
         self.log_dir = Path(os.getenv('LOG_DIR', '/app/logs'))
         self.retention_days = int(os.getenv('BACKUP_RETENTION_DAYS', '30'))
+        # Retenção GFS por dispositivo (0 em todos = apenas BACKUP_RETENTION_DAYS)
+        self.retention = RetentionPolicy(
+            max_age_days=self.retention_days,
+            daily=int(os.getenv('RETENTION_DAILY', '0')),
+            weekly=int(os.getenv('RETENTION_WEEKLY', '0')),
+            monthly=int(os.getenv('RETENTION_MONTHLY', '0'))
+        )
+        self.retention_batch_size = max(1, int(os.getenv('RETENTION_BATCH_SIZE', '500')))
         self.ssh_timeout = int(os.getenv('SSH_TIMEOUT', '30'))
+        # Perfil de transporte SSH padrão (dispositivos podem definir "ssh_profile")
+        self.ssh_profile_default = os.getenv('SSH_PROFILE', 'default')
+        self.ssh_profiles = load_profiles()
         self.backup_format = os.getenv('BACKUP_FORMAT', 'text')  # text ou binary
+        self.binary_transfer = os.getenv('BINARY_TRANSFER', 'scp')  # scp ou sftp
+        self.binary_remote_path = os.getenv('BINARY_REMOTE_PATH', 'sys_config')
+        self.binary_retries = int(os.getenv('BINARY_TRANSFER_RETRIES', '3'))
+        self.storage_mode = os.getenv('BACKUP_STORAGE', 'files')  # files ou cas (deduplicado)
+        self.skip_unchanged = os.getenv('SKIP_UNCHANGED', 'false').lower() == 'true'
+        self.skip_unchanged_max_age = int(os.getenv('SKIP_UNCHANGED_MAX_AGE_HOURS', '168'))
+        self.diff_summary = os.getenv('DIFF_SUMMARY', 'false').lower() == 'true'
+        # Captura separada da configuração global e de cada VDOM em canais SSH paralelos
+        self.vdom_capture = os.getenv('VDOM_CAPTURE', 'false').lower() == 'true'
+        self.vdom_max_channels = max(2, int(os.getenv('VDOM_MAX_CHANNELS', '4')))
+        
+        # Concorrência: limite global e limites opcionais por site/sub-rede (0 = sem limite)
+        self.max_workers = max(1, int(os.getenv('BACKUP_MAX_WORKERS', '1')))
+        self.max_workers_per_site = int(os.getenv('BACKUP_MAX_WORKERS_PER_SITE', '0'))
+        self.max_workers_per_subnet = int(os.getenv('BACKUP_MAX_WORKERS_PER_SUBNET', '0'))
+        self.subnet_prefix = int(os.getenv('BACKUP_SUBNET_PREFIX', '24'))
+        # Backups em andamento por grupo; vagas reservadas pelo despachante antes do envio ao worker
+        self._group_active: Dict[str, int] = {}
+        self._group_limits_lock = threading.Lock()
+        
+        # Varredura TCP antes do backup (dispositivos fora do ar não esperam o SSH_TIMEOUT)
+        self.reachability_check = os.getenv('REACHABILITY_CHECK', 'true').lower() == 'true'
+        self.reachability_timeout = float(os.getenv('REACHABILITY_TIMEOUT', '3'))
+        self.reachability_workers = int(os.getenv('REACHABILITY_WORKERS', '32'))
+        self._reachability: Dict[str, Optional[str]] = {}
+        
+        # Resultado detalhado por dispositivo da última execução
+        self.device_reports: Dict[str, Dict] = {}
+        self._run_lock_file = None
+        # Lock compartilhado enquanto a execução grava objetos deduplicados (exclusivo na coleta de lixo)
+        self._objects_lock_file = None
+        
+        # Métricas: tempo/bytes por fase da execução atual e histogramas acumulados
+        self.metrics = RunMetrics()
+        self.metrics_dir = Path(os.getenv('METRICS_DIR', str(self.log_dir / 'metrics')))
+        if self.shard:
+            # Relatórios e estado do Prometheus separados por shard (processos concorrentes)
+            self.metrics_dir = self.metrics_dir / f"shard_{self.shard[0]}_of_{self.shard[1]}"
+        self.metrics_textfile = os.getenv('METRICS_TEXTFILE', '')
+        self.metrics_keep_reports = int(os.getenv('METRICS_KEEP_REPORTS', '100'))
         
         # Criar diretórios se não existirem
         self.backup_dir.mkdir(exist_ok=True)
         self.log_dir.mkdir(exist_ok=True)
+        self.metrics_dir.mkdir(parents=True, exist_ok=True)
+        self.metrics_registry = MetricsRegistry(self.metrics_dir / 'metrics_state.json')
+        # Resultados por shard consolidados pelo coordenador (diretório compartilhado entre nós)
+        self.shard_results_dir = Path(os.getenv('SHARD_RESULTS_DIR', str(self.backup_dir / 'shards')))
         
         # Configurar logging
-        self._setup_logging()
+        self._setup_logging(log_name, rotate_logs)
         
-        # Configurar Telegram
+        # Chaves de host persistidas (tofu/strict); "auto" aceita qualquer chave sem registrar
+        host_key_policy = os.getenv('SSH_HOST_KEY_POLICY', 'tofu').lower()
+        self.known_hosts = None if host_key_policy == 'auto' else KnownHostsCache(
+            Path(os.getenv('SSH_KNOWN_HOSTS', str(self.backup_dir / 'known_hosts'))), host_key_policy
+        )
+        
+        # Catálogo SQLite dos backups (construído a partir do diretório na primeira execução)
+        self.catalog = BackupCatalog(Path(os.getenv('CATALOG_DB', str(self.backup_dir / 'catalog.db'))))
+        
+        # Armazenamento deduplicado (objetos por hash + ponteiros por execução)
+        self.store = ContentStore(self.backup_dir) if self.storage_mode == 'cas' else None
+        
+        # Histórico compactado (snapshot + deltas) dos arquivos .conf/.txt
+        self.archive_enabled = os.getenv('ARCHIVE_ENABLED', 'false').lower() == 'true'
+        self.archive_keep_plain = int(os.getenv('ARCHIVE_KEEP_PLAIN', '1'))
+        self.archive = BackupArchive(
+            self.backup_dir / 'archive',
+            max_chain=int(os.getenv('ARCHIVE_MAX_CHAIN', '30'))
+        )
+        
+        if not self.catalog.is_built:
+            self.rebuild_catalog()
+        
+        # Circuit breaker: falhas consecutivas persistidas no catálogo (0 desabilita)
+        self.breaker = CircuitBreaker(
+            self.catalog,
+            threshold=int(os.getenv('CIRCUIT_BREAKER_THRESHOLD', '3')),
+            retry_interval=timedelta(hours=float(os.getenv('CIRCUIT_BREAKER_RETRY_HOURS', '6')))
+        )
+        
+        # Configurar Telegram (envio em segundo plano, sem bloquear os backups)
         self.telegram = None
+        self.telegram_flush_timeout = float(os.getenv('TELEGRAM_FLUSH_TIMEOUT', '30'))
         if os.getenv('TELEGRAM_BOT_TOKEN') and os.getenv('TELEGRAM_CHAT_ID'):
             self.telegram = TelegramNotifier(
                 os.getenv('TELEGRAM_BOT_TOKEN'),
-                os.getenv('TELEGRAM_CHAT_ID')
+                os.getenv('TELEGRAM_CHAT_ID'),
+                batch_window=float(os.getenv('TELEGRAM_BATCH_SECONDS', '5')),
+                min_interval=float(os.getenv('TELEGRAM_MIN_INTERVAL', '1')),
+                max_retries=int(os.getenv('TELEGRAM_MAX_RETRIES', '3'))
             )
         
         # Carregar dispositivos
+        self._devices_mtime = None
         self.devices = self._load_devices()
     
-    def _setup_logging(self):
-        """Configurar sistema de logging"""
-        log_level = getattr(logging, os.getenv('LOG_LEVEL', 'INFO').upper())
-        log_format = '%(asctime)s - %(levelname)s - %(message)s'
+    def _setup_logging(self, log_name: str, rotate_logs: bool):
+        """Configurar logging em fila: arquivo rotacionado e stdout gravados em segundo plano
         
-        # Configurar logging para arquivo
+        Cada papel (execução, scheduler) e cada shard tem o seu arquivo, rotacionado apenas pelo
+        processo dono; com rotate_logs=False (comandos avulsos) o arquivo só recebe registros e é
+        reaberto após a rotação.
+        """
+        handlers: List[logging.Handler] = [logging.StreamHandler(sys.stdout)]
         if os.getenv('LOG_TO_FILE', 'true').lower() == 'true':
-            log_file = self.log_dir / f"fortigate_backup_{datetime.now().strftime('%Y%m%d')}.log"
-            logging.basicConfig(
-                level=log_level,
-                format=log_format,
-                handlers=[
-                    logging.FileHandler(log_file),
-                    logging.StreamHandler(sys.stdout)
-                ]
-            )
-        else:
-            logging.basicConfig(level=log_level, format=log_format)
+            if self.shard:
+                log_name += f".shard_{self.shard[0]}_of_{self.shard[1]}"
+            handlers.append(rotating_file_handler(
+                self.log_dir / f"{log_name}.log",
+                rotation=os.getenv('LOG_ROTATION', 'time') if rotate_logs else 'external',
+                when=os.getenv('LOG_ROTATE_WHEN', 'midnight'),
+                max_bytes=int(float(os.getenv('LOG_MAX_MB', '50')) * 1024 * 1024),
+                backup_count=int(os.getenv('LOG_BACKUP_COUNT', '30'))
+            ))
+        setup_logging(
+            os.getenv('LOG_LEVEL', 'INFO'),
+            handlers,
+            json_lines=os.getenv('LOG_FORMAT', 'text').lower() == 'json'
+        )
     
     def _load_devices(self) -> List[Dict]:
         """Carregar configuração dos dispositivos"""
         try:
+            self._devices_mtime = os.path.getmtime(self.config_file)
             with open(self.config_file, 'r', encoding='utf-8') as f:
                 config = json.load(f)
-                return config.get('devices', [])
+            devices = config.get('devices', [])
+            try:
+                self.ssh_profiles = load_profiles(config.get('ssh_profiles'))
+            except (TypeError, ValueError) as e:
+                logging.error(f"Perfis SSH inválidos no devices.json, usando apenas os padrões: {e}")
+                self.ssh_profiles = load_profiles()
+            if self.shard:
+                selected = select_shard(devices, self.shard)
+                logging.info(
+                    f"Shard {shard_label(self.shard)}: {len(selected)} de {len(devices)} dispositivos"
+                )
+                return selected
+            return devices
         except FileNotFoundError:
             logging.error(f"Arquivo de configuração não encontrado: {self.config_file}")
             return []
@@ -105,58 +221,255 @@ class FortiGateSSHBackup:
             logging.error(f"Erro ao decodificar JSON: {e}")
             return []
     
+    def reload_devices_if_changed(self) -> bool:
+        """Recarregar o inventário se devices.json foi alterado desde a última leitura"""
+        try:
+            mtime = os.path.getmtime(self.config_file)
+        except OSError:
+            mtime = None
+        if mtime == self._devices_mtime:
+            return False
+        self.devices = self._load_devices()
+        logging.info(f"Inventário recarregado: {len(self.devices)} dispositivos")
+        return True
+    
     def _create_ssh_connection(self, device: Dict) -> Optional[paramiko.SSHClient]:
-        """Criar conexão SSH com o dispositivo"""
+        """Criar conexão SSH com o dispositivo usando o seu perfil de transporte"""
+        timeout = device.get('timeout', self.ssh_timeout)
+        port = device.get('port', 22)
         try:
+            profile = resolve_profile(device, self.ssh_profiles, self.ssh_profile_default)
             ssh = paramiko.SSHClient()
-            ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+            if self.known_hosts:
+                self.known_hosts.prepare(ssh, device['host'], port)
+            else:
+                ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
             
-            ssh.connect(
-                hostname=device['host'],
-                port=device.get('port', 22),
-                username=device['username'],
-                password=device['password'],
-                timeout=device.get('timeout', self.ssh_timeout),
-                allow_agent=False,
-                look_for_keys=False
-            )
+            # Conexão TCP separada do handshake/autenticação para medir cada etapa
+            with self.metrics.phase(device['name'], 'tcp_connect'):
+                sock = socket.create_connection((device['host'], port), timeout=timeout)
+            with self.metrics.phase(device['name'], 'ssh_auth'):
+                ssh.connect(
+                    hostname=device['host'],
+                    port=port,
+                    username=device['username'],
+                    password=device['password'],
+                    timeout=timeout,
+                    sock=sock,
+                    allow_agent=False,
+                    look_for_keys=False,
+                    compress=profile.compress,
+                    transport_factory=profile.transport_factory()
+                )
             
-            logging.info(f"Conexão SSH estabelecida com {device['name']} ({device['host']})")
+            logging.info(
+                f"Conexão SSH estabelecida com {device['name']} ({device['host']}, perfil {profile.describe()})"
+            )
             return ssh
             
+        except paramiko.BadHostKeyException as e:
+            logging.error(
+                f"Chave de host de {device['name']} diferente da registrada em {self.known_hosts.path} "
+                f"({e.key.get_name()} {e.key.fingerprint}); remova a entrada se a troca for esperada"
+            )
+            return None
         except Exception as e:
             logging.error(f"Erro ao conectar SSH em {device['name']}: {e}")
             return None
     
-    def _execute_command(self, ssh: paramiko.SSHClient, command: str) -> Optional[str]:
-        """Executar comando via SSH"""
+    def _probe_config_checksum(self, shell: FortiGateShell) -> Optional[str]:
+        """Obter o checksum de configuração calculado pelo próprio FortiOS
+        
+        Em unidades multi-VDOM o comando só é aceito no contexto global; sem checksum o
+        backup segue com o download completo.
+        """
+        in_global = shell.execute('config global')
+        chunks: List[str] = []
         try:
-            import time
-            
-            stdin, stdout, stderr = ssh.exec_command(command, timeout=self.ssh_timeout)
-            
-            # Aguardar um pouco para o comando processar
-            time.sleep(1)
-            
-            # Aguardar execução
-            exit_status = stdout.channel.recv_exit_status()
-            
-            output = stdout.read().decode('utf-8', errors='ignore')
-            error = stderr.read().decode('utf-8', errors='ignore')
-            
-            if exit_status == 0 or output.strip():
-                return output.strip()
-            else:
-                logging.error(f"Erro na execução do comando '{command}': {error}")
+            probed = shell.stream('diagnose sys ha checksum show', chunks.append)
+        finally:
+            if in_global:
+                shell.execute('end')
+        output = ''.join(chunks).strip()
+        if not probed or not output:
+            logging.debug(f"Checksum de configuração indisponível: {output[:200]}")
+            return None
+        # A última linha "all:" corresponde ao checksum de toda a configuração
+        checksum = None
+        for line in output.splitlines():
+            if line.strip().startswith('all:'):
+                checksum = line.split(':', 1)[1].strip()
+        return checksum or None
+    
+    def _find_unchanged_backup(self, device: Dict, probe_checksum: Optional[str]) -> Optional[Dict]:
+        """Último backup armazenado, se o checksum confirmar que a configuração não mudou"""
+        if not probe_checksum:
+            return None
+        state = self.catalog.get_state(device['name'])
+        latest = self.catalog.latest(device['name'], stored_only=True)
+        if not state or not latest or state['probe_checksum'] != probe_checksum:
+            return None
+        if latest['sha256'] != state['config_sha256']:
+            return None
+        # Download completo periódico mesmo sem alterações
+        last_download = datetime.strptime(state['config_timestamp'], '%Y%m%d_%H%M%S')
+        if datetime.now() - last_download > timedelta(hours=self.skip_unchanged_max_age):
+            return None
+        return latest
+    
+    def _download_configuration(self, shell: FortiGateShell, device: Dict, timestamp: str,
+                                kind: str = 'config', vdom: Optional[str] = None) -> Optional[Dict]:
+        """Baixar a configuração gravando em streaming
+        
+        Com kind 'global' ou 'vdom-<nome>' o shell já deve estar no contexto correspondente.
+        """
+        vdom = vdom or device.get('vdom', 'root')
+        header_date = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        backup_path = self.backup_dir / f"{device['name']}_{kind}_{timestamp}.conf"
+        
+        def new_writer():
+            if self.store:
+                previous = self.catalog.latest(device['name'], kind, stored_only=True)
+                return self.store.object_writer(previous['sha256'] if previous else None)
+            writer = AtomicBackupWriter(backup_path)
+            # O arquivo binário é gravado exatamente como está no FortiGate (restaurável)
+            if self.backup_format != 'binary':
+                writer.write_header(config_header(device['name'], device['host'], header_date, vdom))
+            return writer
+        
+        # Conteúdo gravado em streaming e publicado só em caso de sucesso
+        if self.backup_format == 'binary':
+            logging.info(f"Baixando configuração via {self.binary_transfer.upper()}: {self.binary_remote_path}")
+            downloader = ConfigDownloader(
+                shell.ssh,
+                reconnect=lambda: self._create_ssh_connection(device),
+                remote_path=self.binary_remote_path,
+                method=self.binary_transfer,
+                retries=self.binary_retries,
+                timeout=device.get('timeout', self.ssh_timeout)
+            )
+            try:
+                with self.metrics.phase(device['name'], 'config_download') as measurement:
+                    writer = downloader.download(new_writer)
+                    measurement['bytes'] = writer.size
+            except ConfigTransferError as e:
+                logging.error(f"Falha ao baixar configuração de {device['name']}: {e}")
+                if self.binary_transfer == 'scp':
+                    logging.error("Verifique se 'set admin-scp enable' está configurado em 'config system global'")
                 return None
+            with writer, self.metrics.phase(device['name'], 'disk_commit'):
+                writer.commit()
+        else:
+            backup_command = "show full-configuration"
+            writer = new_writer()
+            logging.info(f"Executando comando: {backup_command}")
+            with writer:
+                with self.metrics.phase(device['name'], 'config_download') as measurement:
+                    completed = shell.stream(backup_command, writer.write)
+                    measurement['bytes'] = writer.size
+                
+                if not completed or writer.size == 0:
+                    logging.error(f"Falha ao obter configuração de {device['name']}")
+                    return None
                 
+                with self.metrics.phase(device['name'], 'disk_commit'):
+                    writer.commit()
+        
+        if self.store:
+            backup_path = self.store.write_pointer({
+                'device': device['name'],
+                'host': device['host'],
+                'timestamp': timestamp,
+                'kind': kind,
+                'date': header_date,
+                'vdom': vdom,
+                'format': self.backup_format,
+                'sha256': writer.sha256,
+                'size': writer.size
+            })
+            if writer.deduplicated:
+                logging.info(f"Configuração inalterada, objeto reutilizado: {writer.sha256}")
+        
+        self.catalog.record(
+            device['name'], kind, timestamp, 'cas' if self.store else 'file',
+            backup_path.name, writer.size, writer.sha256
+        )
+        logging.info(f"Backup salvo: {backup_path} ({writer.size} bytes, sha256 {writer.sha256})")
+        return {'path': backup_path.name, 'size': writer.size, 'sha256': writer.sha256}
+    
+    def _vdom_capture_enabled(self, device: Dict) -> bool:
+        """Captura separada por VDOM (opção "vdom_capture" do dispositivo ou VDOM_CAPTURE)"""
+        if not device.get('vdom_capture', self.vdom_capture):
+            return False
+        if self.backup_format == 'binary':
+            logging.warning("Captura por VDOM disponível apenas no formato text, usando o arquivo completo")
+            return False
+        return True
+    
+    def _list_vdoms(self, shell: FortiGateShell, device: Dict) -> List[str]:
+        """VDOMs do dispositivo: lista do devices.json ou "diagnose sys vd list" (contexto global)"""
+        if device.get('vdoms'):
+            return list(device['vdoms'])
+        output = shell.run('diagnose sys vd list') or ''
+        # VDOMs internos do FortiOS (vsys_ha, vsys_fgfm) não têm configuração própria
+        names = [name for name in re.findall(r'name=([^/\s]+)/', output) if not name.startswith('vsys_')]
+        return list(dict.fromkeys(names))
+    
+    def _capture_vdom(self, ssh: paramiko.SSHClient, device: Dict, timestamp: str, vdom: str) -> Optional[Dict]:
+        """Capturar um VDOM em um canal próprio da mesma conexão SSH"""
+        log_context.device = device['name']
+        try:
+            with FortiGateShell(ssh, timeout=device.get('timeout', self.ssh_timeout)) as shell:
+                if not shell.execute('config vdom') or not shell.execute(f'edit {vdom}'):
+                    logging.error(f"Não foi possível entrar no VDOM {vdom}")
+                    return None
+                saved = self._download_configuration(shell, device, timestamp, f"vdom-{vdom}", vdom)
+                shell.execute('end')
+                return saved
         except Exception as e:
-            logging.error(f"Erro ao executar comando '{command}': {e}")
+            logging.error(f"Erro ao capturar o VDOM {vdom}: {e}")
+            return None
+        finally:
+            log_context.device = '-'
+    
+    def _capture_vdoms(self, shell: FortiGateShell, device: Dict, timestamp: str) -> Optional[bool]:
+        """Capturar a configuração global e a de cada VDOM como arquivos separados
+        
+        A global é baixada no shell principal enquanto os VDOMs usam canais adicionais da
+        mesma conexão, em paralelo. Retorna None se o dispositivo não estiver em modo multi-VDOM
+        ou se nenhum VDOM for identificado (o chamador baixa a configuração completa).
+        """
+        if not shell.execute('config global'):
+            logging.info("Dispositivo sem multi-VDOM, usando a configuração completa")
+            return None
+        vdoms = self._list_vdoms(shell, device)
+        if not vdoms:
+            # Saída de "diagnose sys vd list" não reconhecida: só a global deixaria os VDOMs sem backup
+            logging.warning("Nenhum VDOM identificado no modo multi-VDOM, usando a configuração completa")
+            shell.execute('end')
             return None
+        logging.info(f"Captura por VDOM: global + {len(vdoms)} VDOMs ({', '.join(vdoms)})")
+        
+        workers = max(1, min(self.vdom_max_channels - 1, len(vdoms)))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='vdom') as executor:
+            futures = {
+                vdom: executor.submit(self._capture_vdom, shell.ssh, device, timestamp, vdom) for vdom in vdoms
+            }
+            saved_global = self._download_configuration(shell, device, timestamp, 'global', 'global')
+            shell.execute('end')
+            captured = {vdom: future.result() for vdom, future in futures.items()}
+        
+        failed = [vdom for vdom, saved in captured.items() if not saved]
+        if not saved_global or failed:
+            logging.error(f"Captura por VDOM incompleta: {', '.join((['global'] if not saved_global else []) + failed)}")
+            return False
+        self.device_reports[device['name']] = {'status': 'success', 'kind': 'global', 'vdoms': vdoms}
+        return True
     
     def _backup_configuration(self, device: Dict) -> bool:
         """Fazer backup da configuração do FortiGate"""
         ssh = None
+        shell = None
         try:
             logging.info(f"Iniciando backup de configuração: {device['name']}")
             
@@ -165,41 +478,56 @@ class FortiGateSSHBackup:
             if not ssh:
                 return False
             
+            # Sessão CLI única para todos os comandos do dispositivo
+            shell = FortiGateShell(ssh, timeout=device.get('timeout', self.ssh_timeout))
+            with self.metrics.phase(device['name'], 'shell_open'):
+                shell.open()
+            
             # Gerar timestamp para o arquivo
             timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
             
-            # Executar comando de backup
-            vdom = device.get('vdom', 'root')
-            if self.backup_format == 'binary':
-                backup_command = f"execute backup config flash backup_{timestamp}.conf"
+            # Verificação rápida: checksum do FortiOS igual ao do último backup dispensa o download
+            # (o checksum é do equipamento inteiro; não se aplica à captura por VDOM)
+            split = self._vdom_capture_enabled(device)
+            probe_checksum = None
+            if self.skip_unchanged and not split:
+                with self.metrics.phase(device['name'], 'checksum_probe'):
+                    probe_checksum = self._probe_config_checksum(shell)
+            unchanged = self._find_unchanged_backup(device, probe_checksum)
+            if unchanged:
+                self.catalog.record(
+                    device['name'], 'config', timestamp, 'unchanged',
+                    unchanged['path'], unchanged['size'], unchanged['sha256']
+                )
+                self.device_reports[device['name']] = {'status': 'unchanged'}
+                logging.info(
+                    f"Configuração verificada como inalterada (checksum {probe_checksum}), "
+                    f"último backup: {unchanged['path']}"
+                )
             else:
-                backup_command = "show full-configuration"
-            
-            logging.info(f"Executando comando: {backup_command}")
-            config_output = self._execute_command(ssh, backup_command)
-            
-            if not config_output:
-                logging.error(f"Falha ao obter configuração de {device['name']}")
-                return False
-            
-            # Salvar configuração em arquivo
-            backup_filename = f"{device['name']}_config_{timestamp}.conf"
-            backup_path = self.backup_dir / backup_filename
-            
-            with open(backup_path, 'w', encoding='utf-8') as f:
-                f.write(f"# Backup de configuração do FortiGate\n")
-                f.write(f"# Dispositivo: {device['name']} ({device['host']})\n")
-                f.write(f"# Data: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-                f.write(f"# VDOM: {vdom}\n")
-                f.write("#" + "="*50 + "\n\n")
-                f.write(config_output)
-            
-            logging.info(f"Backup salvo: {backup_path}")
+                captured = self._capture_vdoms(shell, device, timestamp) if split else None
+                if captured is False:
+                    return False
+                previous = self.catalog.latest(device['name'], stored_only=True)
+                saved = self._download_configuration(shell, device, timestamp) if captured is None else None
+                if captured is None and not saved:
+                    return False
+                if saved:
+                    self.device_reports[device['name']] = {'status': 'success'}
+                if self.diff_summary and previous and saved:
+                    self._summarize_changes(device['name'], previous, saved)
+                if probe_checksum:
+                    self.catalog.update_state(
+                        device['name'], probe_checksum=probe_checksum,
+                        config_sha256=saved['sha256'], config_timestamp=timestamp
+                    )
             
             # Coletar informações do sistema se habilitado
             if os.getenv('COLLECT_SYSTEM_INFO', 'true').lower() == 'true':
-                self._collect_system_information(ssh, device, timestamp)
+                with self.metrics.phase(device['name'], 'system_info') as measurement:
+                    measurement['bytes'] = self._collect_system_information(shell, device, timestamp)
             
+            logging.info(f"Tempo por comando: {shell.timing_summary()}")
             return True
             
         except Exception as e:
@@ -208,11 +536,26 @@ class FortiGateSSHBackup:
             logging.error(f"Traceback completo: {traceback.format_exc()}")
             return False
         finally:
+            if shell:
+                shell.close()
             if ssh:
                 ssh.close()
     
-    def _collect_system_information(self, ssh: paramiko.SSHClient, device: Dict, timestamp: str):
-        """Coletar informações do sistema"""
+    def _summarize_changes(self, device_name: str, previous: Dict, saved: Dict):
+        """Diff estrutural do backup recém-gravado contra o anterior (resumo da execução)"""
+        if previous['sha256'] == saved['sha256']:
+            self.device_reports[device_name]['changes'] = "sem alterações"
+            return
+        try:
+            with self.metrics.phase(device_name, 'config_diff'):
+                diff = self.diff_entries(previous, self.catalog.latest(device_name, stored_only=True))
+            self.device_reports[device_name]['changes'] = summarize_diff(diff)
+            logging.info(f"Alterações desde {previous['timestamp']}:\n{format_diff(diff, show_values=False)}")
+        except Exception as e:
+            logging.warning(f"Não foi possível comparar com o backup anterior: {e}")
+    
+    def _collect_system_information(self, shell: FortiGateShell, device: Dict, timestamp: str) -> int:
+        """Coletar informações do sistema (retorna os bytes gravados)"""
         try:
             logging.info(f"Coletando informações do sistema: {device['name']}")
             
@@ -228,9 +571,10 @@ class FortiGateSSHBackup:
                 'license_info': 'get system status | grep License'
             }
             
+            # Comandos executados em sequência na mesma sessão, sem pausas fixas
             system_info = {}
             for info_type, command in system_commands.items():
-                output = self._execute_command(ssh, command)
+                output = shell.run(command)
                 if output:
                     system_info[info_type] = output
             
@@ -239,21 +583,30 @@ class FortiGateSSHBackup:
                 system_filename = f"{device['name']}_system_{timestamp}.txt"
                 system_path = self.backup_dir / system_filename
                 
-                with open(system_path, 'w', encoding='utf-8') as f:
-                    f.write(f"# Informações do Sistema - FortiGate\n")
-                    f.write(f"# Dispositivo: {device['name']} ({device['host']})\n")
-                    f.write(f"# Data: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-                    f.write("#" + "="*50 + "\n\n")
+                with AtomicBackupWriter(system_path) as writer:
+                    writer.write_header(
+                        f"# Informações do Sistema - FortiGate\n"
+                        f"# Dispositivo: {device['name']} ({device['host']})\n"
+                        f"# Data: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
+                        + "#" + "="*50 + "\n\n"
+                    )
                     
                     for info_type, output in system_info.items():
-                        f.write(f"\n{'='*20} {info_type.upper()} {'='*20}\n")
-                        f.write(output)
-                        f.write("\n")
+                        writer.write(f"\n{'='*20} {info_type.upper()} {'='*20}\n")
+                        writer.write(output)
+                        writer.write("\n")
+                    
+                    writer.commit()
                 
+                self.catalog.record(
+                    device['name'], 'system', timestamp, 'file', system_path.name, writer.size, writer.sha256
+                )
                 logging.info(f"Informações do sistema salvas: {system_path}")
+                return writer.size
             
         except Exception as e:
             logging.error(f"Erro ao coletar informações do sistema de {device['name']}: {e}")
+        return 0
     
     def backup_device(self, device: Dict, send_individual_notification: bool = True) -> bool:
         """Fazer backup de um dispositivo específico"""
@@ -273,20 +626,22 @@ class FortiGateSSHBackup:
             if success:
                 logging.info(f"Backup concluído com sucesso: {device['name']}")
                 if self.telegram and send_individual_notification:
-                    self.telegram.send_message(
+                    self.telegram.notify(
                         f"✅ <b>Backup Concluído</b>\n"
                         f"Dispositivo: {device['name']}\n"
                         f"Host: {device['host']}\n"
-                        f"Data: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}"
+                        f"Data: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}",
+                        batch=True
                     )
             else:
                 logging.error(f"Backup falhou para: {device['name']}")
                 if self.telegram and send_individual_notification:
-                    self.telegram.send_message(
+                    self.telegram.notify(
                         f"❌ <b>Backup Falhou</b>\n"
                         f"Dispositivo: {device['name']}\n"
                         f"Host: {device['host']}\n"
-                        f"Data: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}"
+                        f"Data: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}",
+                        batch=True
                     )
             
             return success
@@ -295,6 +650,78 @@ class FortiGateSSHBackup:
             logging.error(f"Erro inesperado durante backup de {device.get('name', 'Unknown')}: {e}")
             return False
     
+    def _device_groups(self, device: Dict) -> List[tuple]:
+        """Grupos (site/sub-rede) com limite de concorrência aos quais o dispositivo pertence"""
+        groups = []
+        if self.max_workers_per_site > 0 and device.get('site'):
+            groups.append((f"site:{device['site']}", self.max_workers_per_site))
+        if self.max_workers_per_subnet > 0:
+            try:
+                network = ipaddress.ip_network(f"{device['host']}/{self.subnet_prefix}", strict=False)
+                groups.append((f"subnet:{network}", self.max_workers_per_subnet))
+            except (KeyError, ValueError):
+                # Hostname ou host ausente: sem limite por sub-rede
+                pass
+        return groups
+    
+    def reserve_groups(self, device: Dict) -> Optional[List[str]]:
+        """Reservar vagas de site/sub-rede sem bloquear; None se algum grupo estiver cheio
+        
+        Os despachantes só entregam ao pool dispositivos com vaga, assim um worker nunca fica
+        parado esperando o limite de um grupo enquanto há dispositivos de outros grupos na fila.
+        """
+        groups = self._device_groups(device)
+        with self._group_limits_lock:
+            if any(self._group_active.get(group, 0) >= limit for group, limit in groups):
+                return None
+            for group, _ in groups:
+                self._group_active[group] = self._group_active.get(group, 0) + 1
+        return [group for group, _ in groups]
+    
+    def release_groups(self, groups: List[str]):
+        """Liberar as vagas reservadas por reserve_groups"""
+        with self._group_limits_lock:
+            for group in groups:
+                self._group_active[group] -= 1
+    
+    def _probe_device(self, device: Dict) -> Optional[str]:
+        """Resultado da varredura TCP da execução atual ou teste individual (modo agendado)"""
+        device_name = device.get('name')
+        if device_name in self._reachability:
+            return self._reachability.pop(device_name)
+        if 'host' in device and (self.reachability_check or self.breaker.is_open(device_name)):
+            with self.metrics.phase(device_name, 'tcp_probe'):
+                return tcp_probe(device['host'], int(device.get('port', 22)), self.reachability_timeout)
+        return None
+    
+    def run_device_backup(self, device: Dict) -> bool:
+        """Executar backup de um dispositivo (vagas de site/sub-rede reservadas por quem despacha)"""
+        device_name = device.get('name', 'Unknown')
+        log_context.device = device_name
+        try:
+            # Dispositivos inacessíveis ou com circuito aberto não ocupam vagas de site/sub-rede
+            probe_error = self._probe_device(device)
+            skip_reason = self.breaker.check(device_name, probe_error)
+            if skip_reason:
+                logging.warning(f"Dispositivo ignorado: {skip_reason}")
+                self.metrics.set_status(device_name, 'skipped')
+                self.device_reports[device_name] = {'status': 'skipped', 'reason': skip_reason}
+                if probe_error:
+                    self.breaker.record(device_name, False, attempted=False, error=probe_error)
+                return False
+            
+            success = self.backup_device(device, send_individual_notification=False)
+            self.breaker.record(device_name, success)
+            self.metrics.set_status(
+                device_name, self.device_reports.get(device_name, {}).get('status', 'success') if success else 'failed'
+            )
+            return success
+        except Exception as e:
+            logging.error(f"Erro ao processar dispositivo {device_name}: {e}")
+            return False
+        finally:
+            log_context.device = '-'
+    
     def backup_all_devices(self) -> Dict[str, bool]:
         """Fazer backup de todos os dispositivos configurados"""
         start_time = datetime.now()
@@ -304,45 +731,141 @@ class FortiGateSSHBackup:
             logging.warning("Nenhum dispositivo configurado para backup")
             return {}
         
-        results = {}
-        successful_backups = 0
-        failed_backups = 0
-        successful_devices = []
-        failed_devices = []
+        self.start_run()
+        
+        # Varredura TCP paralela de todos os dispositivos (ou só dos com circuito aberto)
+        probe_targets = self.devices if self.reachability_check else [
+            device for device in self.devices if self.breaker.is_open(device.get('name'))
+        ]
+        with self.metrics.phase(None, 'reachability_sweep'):
+            self._reachability = (
+                reachability_sweep(probe_targets, self.reachability_timeout, self.reachability_workers)
+                if probe_targets else {}
+            )
+        
+        # Dispositivos de maior prioridade iniciam primeiro (ordem do inventário como desempate)
+        ordered = sorted(self.devices, key=lambda device: -int(device.get('priority', 0)))
+        
+        # Executar backups (em paralelo quando BACKUP_MAX_WORKERS > 1)
+        workers = min(self.max_workers, len(ordered))
+        if workers > 1:
+            logging.info(f"Modo concorrente: {workers} workers simultâneos")
+            with self.metrics.phase(None, 'backups'):
+                success_by_device = self._dispatch_backups(ordered, workers)
+        else:
+            with self.metrics.phase(None, 'backups'):
+                success_by_device = {id(device): self.run_device_backup(device) for device in ordered}
+        
+        return self.report_results(
+            [(device, success_by_device[id(device)]) for device in self.devices], start_time
+        )
+    
+    def _dispatch_backups(self, ordered: List[Dict], workers: int) -> Dict[int, bool]:
+        """Enviar ao pool, na ordem de prioridade, apenas dispositivos cujos grupos têm vaga
+        
+        Dispositivos de um grupo cheio aguardam na fila sem ocupar worker; os demais passam à
+        frente. Retorna {id(dispositivo): sucesso}.
+        """
+        outcomes: Dict[int, bool] = {}
+        pending = list(ordered)
+        running: Dict = {}  # future -> (dispositivo, grupos reservados)
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='backup') as executor:
+            while pending or running:
+                waiting = []
+                for device in pending:
+                    groups = self.reserve_groups(device) if len(running) < workers else None
+                    if groups is None:
+                        waiting.append(device)
+                        continue
+                    running[executor.submit(self.run_device_backup, device)] = (device, groups)
+                pending = waiting
+                
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    device, groups = running.pop(future)
+                    self.release_groups(groups)
+                    outcomes[id(device)] = future.result()
+        return outcomes
+    
+    def report_results(self, outcomes: List[tuple], start_time: datetime) -> Dict[str, bool]:
+        """Consolidar resultados (dispositivo, sucesso) no log e na notificação Telegram
         
-        for device in self.devices:
+        Em modo shard o resumo é gravado no diretório de resultados para o coordenador; com
+        shard_summary (scheduler por shard, sem coordenador) o shard também envia o seu.
+        """
+        entries = self.outcome_entries(outcomes)
+        if self.shard:
+            path = write_shard_result(self.shard_results_dir, self.shard, start_time, datetime.now(), entries)
+            logging.info(f"Resultado do shard {shard_label(self.shard)} gravado em {path}")
+            if self.shard_summary:
+                self.send_summary(entries, start_time, datetime.now())
+            else:
+                self.log_summary(entries)
+        else:
+            self.send_summary(entries, start_time, datetime.now())
+        return {entry['device']: entry['success'] for entry in entries}
+    
+    def outcome_entries(self, outcomes: List[tuple]) -> List[Dict]:
+        """Resultado por dispositivo (sucesso, status e detalhes), na ordem recebida"""
+        entries = []
+        for device, success in outcomes:
             device_name = device.get('name', 'Unknown')
-            try:
-                success = self.backup_device(device, send_individual_notification=False)
-                results[device_name] = success
-                if success:
-                    successful_backups += 1
-                    # Contar arquivos de backup para este dispositivo
-                    backup_count = len(list(self.backup_dir.glob(f"{device_name}_config_*.conf")))
-                    successful_devices.append(f"• {device_name} ({backup_count} arquivo{'s' if backup_count != 1 else ''})")
-                else:
-                    failed_backups += 1
-                    failed_devices.append(f"• {device_name}")
-            except Exception as e:
-                logging.error(f"Erro ao processar dispositivo {device_name}: {e}")
-                results[device_name] = False
-                failed_backups += 1
-                failed_devices.append(f"• {device_name}")
+            report = self.device_reports.get(device_name, {})
+            entry = {'device': device_name, 'success': success, 'status': report.get('status', 'success')}
+            if success:
+                # Contar arquivos de backup para este dispositivo
+                backup_count = self.catalog.count(device_name, report.get('kind', 'config'))
+                details = f"{backup_count} arquivo{'s' if backup_count != 1 else ''}"
+                if report.get('vdoms'):
+                    details += f", {len(report['vdoms'])} VDOMs"
+                if report.get('status') == 'unchanged':
+                    details += ", inalterado"
+                elif report.get('changes'):
+                    details += f", {report['changes']}"
+                entry['details'] = details
+            elif report.get('status') == 'skipped':
+                entry['reason'] = report['reason']
+            else:
+                entry['status'] = 'failed'
+            entries.append(entry)
+        return entries
+    
+    def log_summary(self, entries: List[Dict]) -> str:
+        """Registrar no log a linha de resumo da execução"""
+        successful = sum(1 for entry in entries if entry['success'])
+        skipped = sum(1 for entry in entries if entry['status'] == 'skipped')
+        summary = f"Backup concluído. Sucessos: {successful}/{len(entries)}"
+        if skipped:
+            summary += f", ignorados (inacessíveis/circuito aberto): {skipped}"
+        logging.info(summary)
+        return summary
+    
+    def send_summary(self, entries: List[Dict], start_time: datetime, end_time: datetime,
+                     missing_shards: Optional[List[str]] = None):
+        """Resumo da execução no log e na notificação Telegram"""
+        successful_devices = [f"• {e['device']} ({e['details']})" for e in entries if e['success']]
+        skipped_devices = [f"• {e['device']} ({e['reason']})" for e in entries if e['status'] == 'skipped']
+        failed_devices = [f"• {e['device']}" for e in entries if e['status'] == 'failed']
+        # Shards sem resultado contam como falha: seus dispositivos não foram confirmados
+        failed_devices += [f"• shard {label} (sem resultado)" for label in missing_shards or []]
+        successful_backups = len(successful_devices)
+        failed_backups = len(failed_devices)
         
         # Calcular duração
-        end_time = datetime.now()
         duration = end_time - start_time
         duration_str = str(duration).split('.')[0]  # Remove microsegundos
         
         # Log do resumo
-        total_devices = len(self.devices)
-        logging.info(f"Backup concluído. Sucessos: {successful_backups}/{total_devices}")
+        self.log_summary(entries)
+        if missing_shards:
+            logging.warning(f"Shards sem resultado: {', '.join(missing_shards)}")
         
         # Notificação Telegram do resumo no formato da imagem
         if self.telegram:
-            if successful_backups == total_devices:
+            title = f"Backup FortiGate (shard {shard_label(self.shard)})" if self.shard else "Backup FortiGate"
+            if not failed_devices and not skipped_devices:
                 # Todos os backups foram bem-sucedidos
-                message = f"✅ <b>Backup FortiGate - Sucesso</b>\n\n"
+                message = f"✅ <b>{title} - Sucesso</b>\n\n"
                 message += f"📊 <b>Resumo:</b>\n"
                 message += f"• Sucessos: {successful_backups}\n"
                 message += f"• Falhas: {failed_backups}\n"
@@ -356,10 +879,12 @@ class FortiGateSSHBackup:
                 # Houve falhas
                 status_emoji = "⚠️" if successful_backups > 0 else "❌"
                 status_text = "Parcial" if successful_backups > 0 else "Falha"
-                message = f"{status_emoji} <b>Backup FortiGate - {status_text}</b>\n\n"
+                message = f"{status_emoji} <b>{title} - {status_text}</b>\n\n"
                 message += f"📊 <b>Resumo:</b>\n"
                 message += f"• Sucessos: {successful_backups}\n"
                 message += f"• Falhas: {failed_backups}\n"
+                if skipped_devices:
+                    message += f"• Ignorados: {len(skipped_devices)}\n"
                 message += f"• Duração: {duration_str}\n"
                 message += f"• Data: {end_time.strftime('%d/%m/%Y %H:%M:%S')}\n\n"
                 
@@ -369,32 +894,363 @@ class FortiGateSSHBackup:
                 
                 if failed_devices:
                     message += f"❌ <b>Dispositivos com Falha:</b>\n"
-                    message += "\n".join(failed_devices)
+                    message += "\n".join(failed_devices) + "\n\n"
+                
+                if skipped_devices:
+                    message += f"⏭️ <b>Dispositivos Ignorados:</b>\n"
+                    message += "\n".join(skipped_devices)
+            
+            self.telegram.notify(message)
+    
+    def merge_shard_results(self, total: int, wait_seconds: float = 0, max_age_hours: float = 12) -> bool:
+        """Coordenador: consolidar os resultados dos N shards em um único resumo
+        
+        Aguarda até `wait_seconds` pelos shards que ainda não gravaram resultado nas últimas
+        `max_age_hours` horas; retorna False se houver falhas ou shards sem resultado.
+        """
+        since = datetime.now() - timedelta(hours=max_age_hours)
+        deadline = time.monotonic() + wait_seconds
+        while True:
+            results, missing = collect_shard_results(self.shard_results_dir, total, since)
+            if not missing or time.monotonic() >= deadline:
+                break
+            logging.info(f"Aguardando shards: {', '.join(f'{i}/{total}' for i in missing)}")
+            time.sleep(min(10.0, max(0.0, deadline - time.monotonic())))
+        
+        if not results:
+            logging.error(f"Nenhum resultado de shard em {self.shard_results_dir}")
+            return False
+        
+        # Ordem do inventário completo
+        order = {device.get('name'): i for i, device in enumerate(self.devices)}
+        entries = sorted(
+            (entry for result in results.values() for entry in result['devices']),
+            key=lambda entry: order.get(entry['device'], len(order))
+        )
+        start_time = min(datetime.fromisoformat(result['started_at']) for result in results.values())
+        end_time = max(datetime.fromisoformat(result['finished_at']) for result in results.values())
+        missing_labels = [f"{index}/{total}" for index in missing]
+        self.send_summary(entries, start_time, end_time, missing_labels)
+        self.flush_notifications()
+        
+        with AtomicBackupWriter(self.shard_results_dir / 'summary.json') as writer:
+            writer.write(json.dumps({
+                'shards': total,
+                'missing_shards': missing_labels,
+                'started_at': start_time.isoformat(timespec='seconds'),
+                'finished_at': end_time.isoformat(timespec='seconds'),
+                'devices': entries
+            }, indent=2, ensure_ascii=False))
+            writer.commit()
+        
+        # Coleta adiada pelos shards que terminaram com outros ainda em execução
+        try:
+            self.collect_unreferenced_objects()
+        except Exception as e:
+            logging.error(f"Erro na coleta de objetos não referenciados: {e}")
+        return not missing and all(entry['success'] for entry in entries)
+    
+    def acquire_run_lock(self) -> bool:
+        """Obter o lock de execução (arquivo no diretório de backup) sem bloquear
+        
+        Garante que uma execução manual e uma agendada nunca rodam ao mesmo tempo.
+        """
+        # Shards no mesmo diretório de backup não disputam o lock entre si
+        lock_name = f".backup.shard_{self.shard[0]}_of_{self.shard[1]}.lock" if self.shard else '.backup.lock'
+        lock_file = open(self.backup_dir / lock_name, 'w')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return False
+        self._run_lock_file = lock_file
+        if self.store:
+            # Todos os shards gravam objetos no mesmo armazenamento: a coleta de lixo espera por eles
+            self._objects_lock_file = open(self.backup_dir / '.objects.lock', 'w')
+            fcntl.flock(self._objects_lock_file, fcntl.LOCK_SH)
+        return True
+    
+    def release_run_lock(self):
+        self._release_objects_lock()
+        if self._run_lock_file:
+            self._run_lock_file.close()
+            self._run_lock_file = None
+    
+    def _release_objects_lock(self):
+        if self._objects_lock_file:
+            self._objects_lock_file.close()
+            self._objects_lock_file = None
+    
+    def owns_device(self, device_name: str) -> bool:
+        """Dispositivo atendido por esta instância (todos sem shard; inclui os já fora do inventário)"""
+        return not self.shard or shard_of(device_name, self.shard[1]) == self.shard[0]
+    
+    def collect_unreferenced_objects(self) -> int:
+        """Remover objetos deduplicados sem ponteiros no catálogo
+        
+        Exige o lock exclusivo de objetos: se alguma execução (de qualquer shard) estiver
+        gravando backups, a coleta é adiada para a próxima limpeza.
+        """
+        if not self.store:
+            return 0
+        # Os backups desta execução já estão no catálogo: o lock compartilhado não é mais necessário
+        self._release_objects_lock()
+        with open(self.backup_dir / '.objects.lock', 'w') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                logging.info("Coleta de objetos adiada: outra execução está gravando backups")
+                return 0
+            removed = self.store.collect_garbage(self.catalog.referenced_hashes('cas'))
+        logging.info(f"Objetos não referenciados removidos: {removed}")
+        return removed
+    
+    def start_run(self):
+        """Reiniciar o estado por execução (relatórios, métricas e run id dos logs)"""
+        self.device_reports = {}
+        self.metrics = RunMetrics()
+        new_run_id()
+    
+    def publish_metrics(self):
+        """Gravar o relatório JSON da execução e atualizar a exposição do Prometheus"""
+        try:
+            self.metrics.finish()
+            report = self.metrics.to_report()
+            report_path = self.metrics_dir / f"run_{self.metrics.started_at.strftime('%Y%m%d_%H%M%S')}.json"
+            for path in (report_path, self.metrics_dir / 'last_run.json'):
+                with AtomicBackupWriter(path) as writer:
+                    writer.write(json.dumps(report, indent=2, ensure_ascii=False))
+                    writer.commit()
             
-            self.telegram.send_message(message)
+            # Manter apenas os relatórios mais recentes
+            reports = sorted(self.metrics_dir.glob('run_*.json'))
+            for old_report in reports[:-self.metrics_keep_reports] if self.metrics_keep_reports > 0 else []:
+                old_report.unlink(missing_ok=True)
+            
+            self.metrics_registry.add_run(self.metrics)
+            if self.metrics_textfile:
+                self.metrics_registry.write_textfile(Path(self.metrics_textfile))
+            logging.info(f"Relatório de métricas: {report_path}")
+        except Exception as e:
+            logging.error(f"Erro ao gravar métricas: {e}")
+    
+    def run_cycle(self) -> Optional[Dict[str, bool]]:
+        """Execução completa (backup, histórico e limpeza); None se outra estiver em andamento"""
+        if not self.acquire_run_lock():
+            logging.warning("Outra execução de backup está em andamento, execução ignorada")
+            return None
+        try:
+            results = self.backup_all_devices()
+            self.run_maintenance()
+            self.flush_notifications()
+            self.publish_metrics()
+            return results
+        finally:
+            self.release_run_lock()
+    
+    def run_maintenance(self):
+        """Tarefas após os backups: histórico compactado e limpeza"""
+        # Compactar histórico se habilitado
+        if self.archive_enabled:
+            with self.metrics.phase(None, 'archive'):
+                self.archive_backups()
         
-        return results
+        # Limpar backups antigos
+        with self.metrics.phase(None, 'cleanup'):
+            self.cleanup_old_backups()
+    
+    def flush_notifications(self, close: bool = False):
+        """Aguardar (com tempo máximo) o envio das notificações enfileiradas"""
+        if not self.telegram:
+            return
+        with self.metrics.phase(None, 'telegram'):
+            if close:
+                self.telegram.close(self.telegram_flush_timeout)
+            else:
+                self.telegram.flush(self.telegram_flush_timeout)
     
-    def cleanup_old_backups(self):
-        """Limpar backups antigos baseado no período de retenção"""
+    def cleanup_old_backups(self, dry_run: bool = False, device_name: Optional[str] = None) -> Optional[Dict]:
+        """Remover os backups fora da política de retenção
+        
+        O conjunto a remover é calculado a partir do catálogo (sem varrer o diretório); os
+        arquivos são apagados em lotes de RETENTION_BATCH_SIZE, cada lote seguido da remoção
+        dos registros. Com dry_run apenas o plano é retornado.
+        """
         try:
-            logging.info(f"Iniciando limpeza de backups antigos (>{self.retention_days} dias)")
+            logging.info(
+                f"Iniciando limpeza de backups ({self.retention.describe()})" + (" [simulação]" if dry_run else "")
+            )
+            plan = self.retention.plan(
+                entry for entry in self.catalog.list(device_name) if self.owns_device(entry['device'])
+            )
+            expired = plan['expire']
+            report = {
+                'policy': self.retention.describe(),
+                'dry_run': dry_run,
+                'keep': plan['keep'],
+                'expire': expired,
+                'removed_files': 0,
+                'pruned_versions': 0,
+                'removed_objects': 0,
+                # Apenas arquivos em texto/ponteiros: o histórico libera deltas compactados, não o tamanho original
+                'freed_bytes': sum(entry['size'] or 0 for entry in expired if entry['storage'] in ('file', 'cas')),
+                'expired_archive': sum(1 for entry in expired if entry['storage'] == 'archive')
+            }
+            if dry_run:
+                logging.info(f"Limpeza: {len(plan['keep'])} backups mantidos, {len(expired)} a remover")
+                return report
+            
+            for start in range(0, len(expired), self.retention_batch_size):
+                batch = expired[start:start + self.retention_batch_size]
+                for entry in batch:
+                    if entry['storage'] in ('file', 'cas'):
+                        (self.backup_dir / entry['path']).unlink(missing_ok=True)
+                        report['removed_files'] += 1
+                        logging.debug(f"Arquivo removido: {entry['path']}")
+                # Registros removidos por lote: uma interrupção não deixa entradas sem arquivo
+                self.catalog.remove_many(batch)
             
-            cutoff_date = datetime.now() - timedelta(days=self.retention_days)
-            removed_files = 0
+            # Histórico compactado: remove o início da cadeia até a versão mais antiga mantida
+            oldest_kept: Dict[tuple, str] = {}
+            for entry in plan['keep']:
+                key = (entry['device'], entry['kind'])
+                oldest_kept[key] = min(oldest_kept.get(key, entry['timestamp']), entry['timestamp'])
+            for key in sorted({(e['device'], e['kind']) for e in expired if e['storage'] == 'archive'}):
+                before = oldest_kept.get(key, '99999999_999999')
+                report['pruned_versions'] += self.archive.prune_series(key[0], key[1], before)
+            if report['pruned_versions']:
+                logging.info(f"Versões removidas do histórico compactado: {report['pruned_versions']}")
             
-            for backup_file in self.backup_dir.glob('*'):
-                if backup_file.is_file():
-                    file_mtime = datetime.fromtimestamp(backup_file.stat().st_mtime)
-                    if file_mtime < cutoff_date:
-                        backup_file.unlink()
-                        removed_files += 1
-                        logging.info(f"Arquivo removido: {backup_file.name}")
+            # Objetos deduplicados sem ponteiros restantes (adiada enquanto algum shard grava backups)
+            report['removed_objects'] = self.collect_unreferenced_objects()
             
-            logging.info(f"Limpeza concluída. {removed_files} arquivos removidos")
+            logging.info(
+                f"Limpeza concluída. {len(expired)} backups expirados, {report['removed_files']} arquivos removidos"
+            )
+            return report
             
         except Exception as e:
             logging.error(f"Erro durante limpeza de backups: {e}")
+            return None
+    
+    def materialize_backup(self, device_name: str, timestamp: Optional[str] = None,
+                           output: Optional[str] = None) -> Optional[Path]:
+        """Gerar o arquivo .conf de um backup do armazenamento deduplicado"""
+        store = self.store or ContentStore(self.backup_dir)
+        if timestamp:
+            entry = next((e for e in self.catalog.list(device_name, 'config') if e['timestamp'] == timestamp), None)
+        else:
+            entry = self.catalog.latest(device_name, stored_only=True)
+        # Entradas "inalterado" apontam para o ponteiro do último download
+        if not entry or not entry['path'].endswith(ContentStore.POINTER_SUFFIX):
+            logging.error(f"Backup deduplicado não encontrado: {device_name} {timestamp or '(mais recente)'}")
+            return None
+        pointer = store.read_pointer(self.backup_dir / entry['path'])
+        
+        output_path = Path(output) if output else self.backup_dir / f"{device_name}_config_{pointer['timestamp']}.conf"
+        store.materialize(pointer, output_path)
+        logging.info(f"Backup materializado: {output_path}")
+        return output_path
+    
+    def archive_backups(self, device_name: Optional[str] = None) -> int:
+        """Mover backups em texto para o histórico compactado"""
+        archived = 0
+        try:
+            logging.info("Compactando backups no histórico (snapshot + deltas)")
+            candidates = [
+                (entry['device'], entry['kind'], entry['timestamp'], self.backup_dir / entry['path'])
+                for entry in self.catalog.list(device=device_name, storage='file')
+                if self.owns_device(entry['device'])
+            ]
+            
+            def relocate(entries: List[Dict]):
+                # Catálogo atualizado a cada série, logo após a remoção dos arquivos em texto
+                nonlocal archived
+                for entry in entries:
+                    entry['storage'] = 'archive'
+                self.catalog.relocate_many(entries)
+                archived += len(entries)
+            
+            self.archive.ingest(candidates, self.archive_keep_plain, on_series=relocate)
+            logging.info(f"Arquivos movidos para o histórico: {archived}")
+            return archived
+        except Exception as e:
+            logging.error(f"Erro ao compactar backups: {e}")
+            return archived
+    
+    @contextmanager
+    def open_backup(self, entry: Dict) -> Iterator:
+        """Linhas de um backup do catálogo, qualquer que seja o armazenamento"""
+        if entry['storage'] == 'archive':
+            content = self.archive.read(entry['device'], entry['timestamp'], entry['kind'])
+            if content is None:
+                raise FileNotFoundError(f"Versão não encontrada no histórico: {entry['timestamp']}")
+            yield iter(content.decode('utf-8', errors='replace').splitlines())
+            return
+        
+        path = self.backup_dir / entry['path']
+        if path.name.endswith(ContentStore.POINTER_SUFFIX):
+            store = self.store or ContentStore(self.backup_dir)
+            path = store.object_path(store.read_pointer(path)['sha256'])
+        with open(path, 'r', encoding='utf-8', errors='replace') as f:
+            yield f
+    
+    def diff_entries(self, old_entry: Dict, new_entry: Dict) -> Dict:
+        """Diff estrutural entre dois backups do catálogo, lidos em streaming"""
+        with self.open_backup(old_entry) as old_lines, self.open_backup(new_entry) as new_lines:
+            return diff_configs(old_lines, new_lines)
+    
+    def diff_backups(self, device_name: str, old_timestamp: Optional[str] = None,
+                     new_timestamp: Optional[str] = None, kind: str = 'config') -> Optional[Dict]:
+        """Comparar duas versões do dispositivo (padrão: as duas últimas com conteúdo diferente)"""
+        # Entradas "inalterado" equivalem ao último backup com conteúdo anterior a elas
+        stored = [e for e in self.catalog.list(device_name, kind) if e['storage'] != 'unchanged']
+        
+        def version_at(timestamp: str, candidates: List[Dict]) -> Optional[Dict]:
+            return next((e for e in reversed(candidates) if e['timestamp'] <= timestamp), None)
+        
+        new_entry = version_at(new_timestamp, stored) if new_timestamp else (stored[-1] if stored else None)
+        if not new_entry:
+            logging.error(f"Backup não encontrado: {device_name} {new_timestamp or '(mais recente)'}")
+            return None
+        earlier = [e for e in stored if e['timestamp'] < new_entry['timestamp']]
+        if old_timestamp:
+            old_entry = version_at(old_timestamp, stored)
+        else:
+            old_entry = next(
+                (e for e in reversed(earlier) if not e['sha256'] or e['sha256'] != new_entry['sha256']),
+                earlier[-1] if earlier else None
+            )
+        if not old_entry:
+            logging.error(f"Nenhuma versão anterior para comparar: {device_name}")
+            return None
+        
+        diff = self.diff_entries(old_entry, new_entry)
+        diff.update(device=device_name, kind=kind, old=old_entry['timestamp'], new=new_entry['timestamp'])
+        return diff
+    
+    def rebuild_catalog(self) -> int:
+        """Reconstruir o catálogo a partir dos arquivos do diretório de backup"""
+        logging.info("Reconstruindo catálogo de backups a partir do diretório")
+        total = self.catalog.rebuild(self.backup_dir, self.archive.root)
+        logging.info(f"Catálogo reconstruído: {total} backups indexados")
+        return total
+    
+    def extract_backup(self, device_name: str, timestamp: str, kind: str = 'config',
+                       output: Optional[str] = None) -> Optional[Path]:
+        """Restaurar uma versão do histórico compactado para arquivo"""
+        content = self.archive.read(device_name, timestamp, kind)
+        if content is None:
+            logging.error(f"Versão não encontrada no histórico: {device_name} {kind} {timestamp}")
+            return None
+        
+        extension = 'txt' if kind == 'system' else 'conf'
+        output_path = Path(output) if output else self.backup_dir / f"{device_name}_{kind}_{timestamp}.{extension}"
+        with AtomicBackupWriter(output_path) as writer:
+            writer.write_bytes(content)
+            writer.commit()
+        logging.info(f"Versão extraída: {output_path}")
+        return output_path
     
     def test_telegram(self):
         """Testar notificação Telegram"""
@@ -410,15 +1266,115 @@ class FortiGateSSHBackup:
 
 def main():
     """Função principal"""
+    parser = argparse.ArgumentParser(description="Sistema de backup FortiGate via SSH")
+    subparsers = parser.add_subparsers(dest='command')
+    run_parser = subparsers.add_parser('run', help='Backup de todos os dispositivos e limpeza (padrão)')
+    run_parser.add_argument('--shard', help='Processar apenas o shard i/N do inventário (ex.: 1/4)')
+    merge_parser = subparsers.add_parser('merge-shards', help='Consolidar os resultados dos shards em um resumo')
+    merge_parser.add_argument('--shards', type=int, required=True, help='Número total de shards (N)')
+    merge_parser.add_argument('--wait', type=float, default=0, help='Segundos aguardando shards pendentes')
+    merge_parser.add_argument('--max-age-hours', type=float, default=12,
+                              help='Idade máxima de um resultado de shard')
+    shard_parser = subparsers.add_parser('shard-of', help='Mostrar o shard de cada dispositivo')
+    shard_parser.add_argument('--shards', type=int, required=True, help='Número total de shards (N)')
+    subparsers.add_parser('test-telegram', help='Enviar notificação de teste')
+    materialize_parser = subparsers.add_parser(
+        'materialize', help='Gerar arquivo .conf a partir do armazenamento deduplicado'
+    )
+    materialize_parser.add_argument('device', help='Nome do dispositivo')
+    materialize_parser.add_argument('--timestamp', help='Timestamp YYYYMMDD_HHMMSS (padrão: mais recente)')
+    materialize_parser.add_argument('--output', help='Arquivo de saída')
+    archive_parser = subparsers.add_parser('archive', help='Mover backups em texto para o histórico compactado')
+    archive_parser.add_argument('--device', help='Apenas este dispositivo')
+    extract_parser = subparsers.add_parser('extract', help='Restaurar uma versão do histórico compactado')
+    extract_parser.add_argument('device', help='Nome do dispositivo')
+    extract_parser.add_argument('timestamp', help='Timestamp YYYYMMDD_HHMMSS')
+    extract_parser.add_argument('--kind', default='config', help='config, system, global ou vdom-<nome>')
+    extract_parser.add_argument('--output', help='Arquivo de saída')
+    diff_parser = subparsers.add_parser('diff', help='Diferença estrutural entre duas versões da configuração')
+    diff_parser.add_argument('device', help='Nome do dispositivo')
+    diff_parser.add_argument('old', nargs='?', help='Timestamp da versão antiga (padrão: anterior à nova)')
+    diff_parser.add_argument('new', nargs='?', help='Timestamp da versão nova (padrão: mais recente)')
+    diff_parser.add_argument('--kind', default='config', help='config, global ou vdom-<nome>')
+    diff_parser.add_argument('--json', action='store_true', help='Saída em JSON')
+    diff_parser.add_argument('--max-items', type=int, default=50, help='Objetos listados por seção')
+    cleanup_parser = subparsers.add_parser('cleanup', help='Aplicar a política de retenção aos backups')
+    cleanup_parser.add_argument('--dry-run', action='store_true', help='Apenas listar o que seria removido')
+    cleanup_parser.add_argument('--device', help='Apenas este dispositivo')
+    cleanup_parser.add_argument('--verbose', action='store_true', help='Listar também os backups mantidos')
+    catalog_parser = subparsers.add_parser('catalog', help='Consultar ou reconstruir o catálogo de backups')
+    catalog_parser.add_argument('action', choices=['rebuild', 'list', 'latest'])
+    catalog_parser.add_argument('device', nargs='?', help='Nome do dispositivo (list/latest)')
+    catalog_parser.add_argument('--kind', default=None, help='config, system, global ou vdom-<nome>')
+    args = parser.parse_args()
+    if getattr(args, 'shard', None):
+        try:
+            parse_shard(args.shard)
+        except ValueError as e:
+            parser.error(str(e))
+    
     try:
-        # Inicializar sistema de backup
-        backup_system = FortiGateSSHBackup()
-        
-        # Executar backup de todos os dispositivos
-        backup_system.backup_all_devices()
+        # Inicializar sistema de backup; coordenador e shard-of usam o inventário completo
+        # mesmo com BACKUP_SHARD no ambiente (docker compose exec repassa o .env do contêiner)
+        shard = '' if args.command in ('merge-shards', 'shard-of') else getattr(args, 'shard', None)
+        # Apenas a execução de backup (protegida pelo lock) rotaciona o arquivo de log
+        backup_system = FortiGateSSHBackup(shard=shard, rotate_logs=args.command in (None, 'run'))
         
-        # Limpar backups antigos
-        backup_system.cleanup_old_backups()
+        if args.command == 'test-telegram':
+            backup_system.test_telegram()
+        elif args.command == 'materialize':
+            if not backup_system.materialize_backup(args.device, args.timestamp, args.output):
+                sys.exit(1)
+        elif args.command == 'catalog':
+            if args.action == 'rebuild':
+                backup_system.rebuild_catalog()
+            elif args.action == 'latest':
+                if not args.device:
+                    parser.error("informe o dispositivo")
+                entry = backup_system.catalog.latest(args.device, args.kind or 'config')
+                print(json.dumps(entry, indent=2) if entry else "Nenhum backup encontrado")
+            else:
+                for entry in backup_system.catalog.list(args.device, args.kind):
+                    print(f"{entry['device']}\t{entry['kind']}\t{entry['timestamp']}\t"
+                          f"{entry['storage']}\t{entry['size']}\t{entry['path']}")
+        elif args.command == 'diff':
+            diff = backup_system.diff_backups(args.device, args.old, args.new, args.kind)
+            if not diff:
+                sys.exit(1)
+            if args.json:
+                print(json.dumps(diff, indent=2, ensure_ascii=False))
+            else:
+                print(f"{diff['device']}: {diff['old']} -> {diff['new']}")
+                print(format_diff(diff, max_items=args.max_items))
+        elif args.command == 'cleanup':
+            report = backup_system.cleanup_old_backups(args.dry_run, args.device)
+            if report is None:
+                sys.exit(1)
+            if args.verbose:
+                for entry in report['keep']:
+                    print(f"manter\t{entry['device']}\t{entry['kind']}\t{entry['timestamp']}\t{entry['reason']}")
+            for entry in report['expire']:
+                print(f"remover\t{entry['device']}\t{entry['kind']}\t{entry['timestamp']}\t"
+                      f"{entry['storage']}\t{entry['path']}")
+            print(f"Política {report['policy']}: {len(report['keep'])} mantidos, {len(report['expire'])} "
+                  f"{'a remover' if report['dry_run'] else 'removidos'}, "
+                  f"{report['freed_bytes'] / 1024 / 1024:.1f} MB em arquivos"
+                  + (f", {report['expired_archive']} versões do histórico" if report['expired_archive'] else ""))
+        elif args.command == 'merge-shards':
+            if not backup_system.merge_shard_results(args.shards, args.wait, args.max_age_hours):
+                sys.exit(1)
+        elif args.command == 'shard-of':
+            for device in backup_system.devices:
+                print(f"{device.get('name')}\t{shard_of(device.get('name', ''), args.shards)}/{args.shards}")
+        elif args.command == 'archive':
+            backup_system.archive_backups(args.device)
+        elif args.command == 'extract':
+            if not backup_system.extract_backup(args.device, args.timestamp, args.kind, args.output):
+                sys.exit(1)
+        else:
+            # Backup de todos os dispositivos, histórico e limpeza
+            if backup_system.run_cycle() is None:
+                sys.exit(1)
         
     except KeyboardInterrupt:
         logging.info("Backup interrompido pelo usuário")
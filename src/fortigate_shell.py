@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Sessão CLI interativa com FortiGate
+Executa todos os comandos de um dispositivo em um único shell SSH persistente,
+detectando o prompt em vez de aguardar tempos fixos
+"""
+
+import re
+import time
+import codecs
+import socket
+import logging
+from typing import Callable, Dict, List, Optional
+import paramiko
+
+class FortiGateShellError(Exception):
+    """Erro de comunicação com o shell do FortiGate"""
+
+class FortiGateShell:
+    """Shell interativo persistente para execução sequencial de comandos"""
+    
+    # Marcador de paginação exibido quando o console não está em modo "standard"
+    MORE_MARKER = '--More--'
+    # Mensagens do FortiOS que indicam falha do comando
+    ERROR_MARKERS = ('Command fail', 'Unknown action', 'command parse error')
+    # Prompt inicial: "FGT60F # ", "FGT60F (global) # ", "FGT60F $ "
+    INITIAL_PROMPT_RE = re.compile(r'^([\w.\-]+)(?: \([^)]*\))? [#$] $')
+    
+    def __init__(self, ssh: paramiko.SSHClient, timeout: int = 30, width: int = 512):
+        self.ssh = ssh
+        self.timeout = timeout
+        self.width = width
+        self.channel: Optional[paramiko.Channel] = None
+        self.hostname: Optional[str] = None
+        self._prompt_re: Optional[re.Pattern] = None
+        self._decoder = codecs.getincrementaldecoder('utf-8')(errors='ignore')
+        self.timings: List[Dict] = []
+    
+    def open(self):
+        """Abrir o shell, aguardar o prompt e desabilitar a paginação"""
+        transport = self.ssh.get_transport()
+        self.channel = transport.open_session()
+        # Terminal largo evita quebra de linha em comandos e valores longos
+        self.channel.get_pty(term='vt100', width=self.width, height=0)
+        self.channel.invoke_shell()
+        self.channel.settimeout(self.timeout)
+        
+        self._wait_initial_prompt()
+        self._disable_paging()
+    
+    def close(self):
+        """Encerrar o shell"""
+        if self.channel:
+            try:
+                self.channel.send('exit\n')
+            except Exception:
+                pass
+            self.channel.close()
+            self.channel = None
+    
+    def __enter__(self):
+        self.open()
+        return self
+    
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+    
+    def _recv(self) -> str:
+        """Receber o próximo bloco de dados do canal"""
+        try:
+            data = self.channel.recv(65536)
+        except socket.timeout:
+            raise FortiGateShellError(f"Timeout aguardando resposta ({self.timeout}s)")
+        if not data:
+            raise FortiGateShellError("Canal SSH encerrado pelo dispositivo")
+        return self._decoder.decode(data)
+    
+    def _wait_initial_prompt(self):
+        """Ler o banner até o primeiro prompt e memorizar o hostname"""
+        buffer = ''
+        while True:
+            buffer += self._recv()
+            tail = buffer.rsplit('\n', 1)[-1].rsplit('\r', 1)[-1]
+            match = self.INITIAL_PROMPT_RE.match(tail)
+            if match:
+                self.hostname = match.group(1)
+                self._prompt_re = re.compile(re.escape(self.hostname) + r'(?: \([^)]*\))? [#$] $')
+                return
+    
+    def _disable_paging(self):
+        """Configurar o console para saída contínua (sem --More--)"""
+        if self.stream('config system console', self._discard):
+            if not self.stream('set output standard', self._discard):
+                # Ex.: perfil sem permissão de escrita; a paginação é tratada na leitura
+                logging.debug("Não foi possível desabilitar a paginação do console")
+            self.stream('end', self._discard)
+        else:
+            logging.debug("Contexto 'config system console' indisponível (multi-VDOM?)")
+        # Os comandos de configuração do console não entram na medição
+        self.timings.clear()
+    
+    def execute(self, command: str) -> bool:
+        """Executar comando descartando a saída (ex.: config/edit/end para trocar de contexto)"""
+        return self.stream(command, self._discard)
+    
+    @staticmethod
+    def _discard(data: str):
+        """Sink que descarta a saída"""
+    
+    def stream(self, command: str, sink: Callable[[str], None]) -> bool:
+        """Executar comando entregando a saída linha a linha ao sink
+        
+        Retorna False se o FortiOS reportar erro na execução do comando.
+        """
+        if not self.channel:
+            raise FortiGateShellError("Shell não iniciado")
+        
+        start = time.monotonic()
+        self.channel.sendall(f"{command}\n")
+        
+        pending = ''
+        echo_skipped = False
+        failed = False
+        total_bytes = 0
+        while True:
+            pending += self._recv()
+            
+            # Paginação: o FortiOS aguarda espaço para continuar
+            if self.MORE_MARKER in pending:
+                pending = pending.replace(self.MORE_MARKER, '')
+                self.channel.send(' ')
+            
+            lines = pending.split('\n')
+            pending = lines.pop()
+            for line in lines:
+                # '\r' sobrescreve a linha (limpeza do --More--)
+                line = line.rstrip('\r').rsplit('\r', 1)[-1]
+                if not echo_skipped:
+                    echo_skipped = True
+                    continue
+                if not failed and line.startswith(self.ERROR_MARKERS):
+                    failed = True
+                data = line + '\n'
+                total_bytes += len(data)
+                sink(data)
+            
+            if self._prompt_re.match(pending.rsplit('\r', 1)[-1]):
+                break
+        
+        elapsed = time.monotonic() - start
+        self.timings.append({'command': command, 'seconds': elapsed, 'bytes': total_bytes})
+        logging.debug(f"Comando '{command}' executado em {elapsed:.2f}s ({total_bytes} bytes)")
+        return not failed
+    
+    def run(self, command: str) -> Optional[str]:
+        """Executar comando e retornar a saída completa (None em caso de erro)"""
+        chunks: List[str] = []
+        if not self.stream(command, chunks.append):
+            logging.error(f"Erro na execução do comando '{command}': {''.join(chunks).strip()}")
+            return None
+        return ''.join(chunks).strip()
+    
+    def timing_summary(self) -> str:
+        """Resumo legível dos tempos por comando"""
+        return ', '.join(
+            f"'{item['command']}' {item['seconds']:.2f}s" for item in self.timings
+        )
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Logging assíncrono do sistema de backup
+Os registros entram em uma fila (QueueHandler) e são gravados por uma thread própria
+(QueueListener), sem que as threads de backup esperem por disco ou stdout. Cada registro
+leva o contexto da execução (run id, dispositivo e fase); o arquivo é rotacionado por
+tempo ou tamanho (ou externamente, pelo logrotate) e pode ser gravado em JSON lines
+"""
+
+import sys
+import json
+import queue
+import atexit
+import logging
+import threading
+import logging.handlers
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Iterator, List, Optional
+
+TEXT_FORMAT = '%(asctime)s - %(levelname)s - [%(device)s] %(message)s'
+
+# Contexto por thread: dispositivo e fase em processamento
+log_context = threading.local()
+
+# Identificador da execução atual, compartilhado por todas as threads
+_run_id = '-'
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_queue_handler: Optional[logging.handlers.QueueHandler] = None
+_handlers: List[logging.Handler] = []
+_lock = threading.Lock()
+
+def new_run_id() -> str:
+    """Iniciar uma nova execução; todos os registros seguintes levam o seu identificador"""
+    global _run_id
+    _run_id = datetime.now().strftime('%Y%m%d_%H%M%S')
+    return _run_id
+
+@contextmanager
+def log_phase(phase: str) -> Iterator[None]:
+    """Marcar os registros da thread atual com a fase em execução"""
+    previous = getattr(log_context, 'phase', '-')
+    log_context.phase = phase
+    try:
+        yield
+    finally:
+        log_context.phase = previous
+
+class LogContextFilter(logging.Filter):
+    """Adiciona run id, dispositivo e fase da thread atual a cada registro
+
+    Aplicado no QueueHandler, ainda na thread que gerou o registro (o contexto é por thread).
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.run_id = _run_id
+        record.device = getattr(log_context, 'device', '-')
+        record.phase = getattr(log_context, 'phase', '-')
+        return True
+
+class JsonLinesFormatter(logging.Formatter):
+    """Um objeto JSON por linha, com o contexto da execução"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'run_id': getattr(record, 'run_id', '-'),
+            'device': getattr(record, 'device', '-'),
+            'phase': getattr(record, 'phase', '-'),
+            'thread': record.threadName,
+            # O QueueHandler já incorpora o traceback à mensagem
+            'message': record.getMessage()
+        }
+        return json.dumps(entry, ensure_ascii=False)
+
+def _formatter(json_lines: bool) -> logging.Formatter:
+    return JsonLinesFormatter() if json_lines else logging.Formatter(TEXT_FORMAT)
+
+def rotating_file_handler(path: Path, rotation: str = 'time', when: str = 'midnight',
+                          max_bytes: int = 50 * 1024 * 1024, backup_count: int = 30) -> logging.Handler:
+    """Arquivo de log rotacionado por tempo (ex.: à meia-noite) ou por tamanho
+
+    Com rotation="external" o arquivo não é rotacionado pelo processo: é reaberto quando
+    renomeado por outro (logrotate ou o processo dono do arquivo).
+    """
+    if rotation == 'external':
+        return logging.handlers.WatchedFileHandler(path, encoding='utf-8')
+    if rotation == 'size':
+        return logging.handlers.RotatingFileHandler(
+            path, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8'
+        )
+    return logging.handlers.TimedRotatingFileHandler(
+        path, when=when, backupCount=backup_count, encoding='utf-8'
+    )
+
+def setup_logging(level: str = 'INFO', handlers: Optional[List[logging.Handler]] = None,
+                  json_lines: bool = False):
+    """Substituir os handlers do logger raiz pela fila atendida em segundo plano"""
+    global _listener, _queue_handler
+    with _lock:
+        stop_logging()
+        for handler in handlers or [logging.StreamHandler(sys.stdout)]:
+            if handler.formatter is None:
+                handler.setFormatter(_formatter(json_lines))
+            _handlers.append(handler)
+
+        root = logging.getLogger()
+        for handler in root.handlers[:]:
+            root.removeHandler(handler)
+        # Fila sem limite: nenhum registro é descartado nem bloqueia quem o gerou
+        log_queue: queue.Queue = queue.Queue(-1)
+        _queue_handler = logging.handlers.QueueHandler(log_queue)
+        # Filtro na entrada da fila para que logs de bibliotecas (paramiko) também recebam o contexto
+        _queue_handler.addFilter(LogContextFilter())
+        root.addHandler(_queue_handler)
+        root.setLevel(getattr(logging, level.upper(), logging.INFO))
+
+        _listener = logging.handlers.QueueListener(log_queue, *_handlers, respect_handler_level=True)
+        _listener.start()
+
+def add_log_handler(handler: logging.Handler, json_lines: Optional[bool] = None):
+    """Incluir um destino adicional (ex.: cron.log) na thread de gravação"""
+    global _listener
+    with _lock:
+        if handler.formatter is None:
+            if json_lines is None:
+                json_lines = any(isinstance(h.formatter, JsonLinesFormatter) for h in _handlers)
+            handler.setFormatter(_formatter(json_lines))
+        _handlers.append(handler)
+        if _listener:
+            # A lista de handlers do listener é fixa: reiniciar a thread (a fila é preservada)
+            _listener.stop()
+            _listener = logging.handlers.QueueListener(_listener.queue, *_handlers, respect_handler_level=True)
+            _listener.start()
+
+def stop_logging():
+    """Gravar os registros pendentes e encerrar a thread de gravação"""
+    global _listener, _queue_handler
+    if _listener:
+        _listener.stop()
+        _listener = None
+    if _queue_handler:
+        logging.getLogger().removeHandler(_queue_handler)
+        _queue_handler = None
+    for handler in _handlers:
+        handler.close()
+    _handlers.clear()
+
+atexit.register(stop_logging)
@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+"""
+Métricas de execução do backup FortiGate
+Tempo e bytes por dispositivo e por fase, gravados como relatório JSON de cada execução
+e expostos no formato texto do Prometheus (arquivo para o textfile collector ou HTTP)
+"""
+
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, List, Optional
+from backup_store import AtomicBackupWriter
+from logging_config import log_phase
+
+# Limites (segundos) dos buckets dos histogramas de duração
+DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+class RunMetrics:
+    """Tempos e bytes de uma execução, por dispositivo e fase
+    
+    Fases sem dispositivo (varredura, Telegram, limpeza) são da execução como um todo.
+    """
+    
+    def __init__(self):
+        self.started_at = datetime.now()
+        self.finished_at: Optional[datetime] = None
+        self._start = time.perf_counter()
+        self.duration = 0.0
+        self._lock = threading.Lock()
+        self.devices: Dict[str, Dict] = {}
+        self.run_phases: Dict[str, Dict] = {}
+    
+    def _phase_entry(self, device_name: Optional[str], phase: str) -> Dict:
+        if device_name is None:
+            phases = self.run_phases
+        else:
+            phases = self.devices.setdefault(device_name, {'status': None, 'phases': {}})['phases']
+        return phases.setdefault(phase, {'seconds': 0.0, 'bytes': 0})
+    
+    def record(self, device_name: Optional[str], phase: str, seconds: float, size: int = 0):
+        """Somar tempo e bytes de uma fase"""
+        with self._lock:
+            entry = self._phase_entry(device_name, phase)
+            entry['seconds'] += seconds
+            entry['bytes'] += size
+    
+    @contextmanager
+    def phase(self, device_name: Optional[str], phase: str):
+        """Medir um bloco; bytes transferidos podem ser informados em measurement['bytes']
+        
+        Os logs gerados dentro do bloco levam o nome da fase.
+        """
+        measurement = {'bytes': 0}
+        start = time.perf_counter()
+        try:
+            with log_phase(phase):
+                yield measurement
+        finally:
+            self.record(device_name, phase, time.perf_counter() - start, measurement['bytes'])
+    
+    def set_status(self, device_name: str, status: str):
+        with self._lock:
+            self.devices.setdefault(device_name, {'status': None, 'phases': {}})['status'] = status
+    
+    def finish(self):
+        self.finished_at = datetime.now()
+        self.duration = time.perf_counter() - self._start
+    
+    def to_report(self) -> Dict:
+        """Relatório JSON da execução"""
+        with self._lock:
+            return {
+                'started_at': self.started_at.isoformat(timespec='seconds'),
+                'finished_at': self.finished_at.isoformat(timespec='seconds') if self.finished_at else None,
+                'duration_seconds': round(self.duration, 3),
+                'phases': {
+                    phase: {'seconds': round(entry['seconds'], 3), 'bytes': entry['bytes']}
+                    for phase, entry in self.run_phases.items()
+                },
+                'devices': {
+                    name: {
+                        'status': device['status'],
+                        'seconds': round(sum(entry['seconds'] for entry in device['phases'].values()), 3),
+                        'bytes': sum(entry['bytes'] for entry in device['phases'].values()),
+                        'phases': {
+                            phase: {'seconds': round(entry['seconds'], 3), 'bytes': entry['bytes']}
+                            for phase, entry in device['phases'].items()
+                        }
+                    }
+                    for name, device in self.devices.items()
+                }
+            }
+
+class MetricsRegistry:
+    """Histogramas e contadores acumulados entre execuções no formato do Prometheus
+    
+    O estado é persistido em JSON para que o arquivo do textfile collector continue
+    acumulando entre execuções de processos diferentes (modo manual/subprocess).
+    """
+    
+    PREFIX = 'fortigate_backup'
+    
+    def __init__(self, state_file: Path):
+        self.state_file = Path(state_file)
+        self._lock = threading.Lock()
+        # Chaves serializáveis: "dispositivo|fase" (dispositivo vazio = fase da execução)
+        self.histograms: Dict[str, Dict] = {}
+        self.bytes_total: Dict[str, int] = {}
+        self.device_status: Dict[str, Dict] = {}
+        self.runs_total = 0
+        self.last_run: Dict = {}
+        self._load()
+    
+    def _load(self):
+        if not self.state_file.exists():
+            return
+        try:
+            with open(self.state_file, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            self.histograms = state.get('histograms', {})
+            self.bytes_total = state.get('bytes_total', {})
+            self.device_status = state.get('device_status', {})
+            self.runs_total = state.get('runs_total', 0)
+            self.last_run = state.get('last_run', {})
+        except (OSError, ValueError) as e:
+            logging.warning(f"Estado das métricas ilegível, reiniciando contadores: {e}")
+    
+    def _save(self):
+        self.state_file.parent.mkdir(parents=True, exist_ok=True)
+        with AtomicBackupWriter(self.state_file) as writer:
+            writer.write(json.dumps({
+                'histograms': self.histograms,
+                'bytes_total': self.bytes_total,
+                'device_status': self.device_status,
+                'runs_total': self.runs_total,
+                'last_run': self.last_run
+            }))
+            writer.commit()
+    
+    def _observe(self, key: str, seconds: float):
+        histogram = self.histograms.setdefault(
+            key, {'buckets': [0] * len(DURATION_BUCKETS), 'count': 0, 'sum': 0.0}
+        )
+        for i, limit in enumerate(DURATION_BUCKETS):
+            if seconds <= limit:
+                histogram['buckets'][i] += 1
+        histogram['count'] += 1
+        histogram['sum'] += seconds
+    
+    def add_run(self, run: RunMetrics):
+        """Acumular uma execução concluída e persistir o estado"""
+        report = run.to_report()
+        finished = (run.finished_at or datetime.now()).timestamp()
+        with self._lock:
+            self.runs_total += 1
+            self.last_run = {'timestamp': finished, 'duration': report['duration_seconds']}
+            for phase, entry in report['phases'].items():
+                self._observe(f"|{phase}", entry['seconds'])
+            for name, device in report['devices'].items():
+                # Dispositivos ignorados sem nenhuma fase medida não entram na latência total
+                if device['phases']:
+                    self._observe(f"{name}|total", device['seconds'])
+                for phase, entry in device['phases'].items():
+                    self._observe(f"{name}|{phase}", entry['seconds'])
+                    if entry['bytes']:
+                        key = f"{name}|{phase}"
+                        self.bytes_total[key] = self.bytes_total.get(key, 0) + entry['bytes']
+                status = self.device_status.setdefault(name, {})
+                status['success'] = 1 if device['status'] in ('success', 'unchanged') else 0
+                if status['success']:
+                    status['last_success'] = finished
+            self._save()
+    
+    @staticmethod
+    def _labels(**labels) -> str:
+        pairs = []
+        for name, value in labels.items():
+            value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+            pairs.append(f'{name}="{value}"')
+        return '{' + ','.join(pairs) + '}'
+    
+    def render(self) -> str:
+        """Exposição no formato texto do Prometheus"""
+        p = self.PREFIX
+        lines: List[str] = []
+        with self._lock:
+            lines += [
+                f"# HELP {p}_phase_duration_seconds Duração das fases do backup por dispositivo",
+                f"# TYPE {p}_phase_duration_seconds histogram"
+            ]
+            run_phases = []
+            for key, histogram in sorted(self.histograms.items()):
+                device_name, phase = key.rsplit('|', 1)
+                if not device_name:
+                    run_phases.append((phase, histogram))
+                    continue
+                lines += self._histogram_lines(
+                    f"{p}_phase_duration_seconds", histogram, device=device_name, phase=phase
+                )
+            lines += [
+                f"# HELP {p}_run_phase_duration_seconds Duração das fases de cada execução",
+                f"# TYPE {p}_run_phase_duration_seconds histogram"
+            ]
+            for phase, histogram in run_phases:
+                lines += self._histogram_lines(f"{p}_run_phase_duration_seconds", histogram, phase=phase)
+            
+            lines += [
+                f"# HELP {p}_phase_bytes_total Bytes transferidos por dispositivo e fase",
+                f"# TYPE {p}_phase_bytes_total counter"
+            ]
+            for key, total in sorted(self.bytes_total.items()):
+                device_name, phase = key.rsplit('|', 1)
+                lines.append(f"{p}_phase_bytes_total{self._labels(device=device_name, phase=phase)} {total}")
+            
+            lines += [
+                f"# HELP {p}_device_success Resultado da última execução do dispositivo (1 = sucesso)",
+                f"# TYPE {p}_device_success gauge"
+            ]
+            for name, status in sorted(self.device_status.items()):
+                lines.append(f"{p}_device_success{self._labels(device=name)} {status['success']}")
+            lines += [
+                f"# HELP {p}_device_last_success_timestamp_seconds Horário do último backup bem-sucedido",
+                f"# TYPE {p}_device_last_success_timestamp_seconds gauge"
+            ]
+            for name, status in sorted(self.device_status.items()):
+                if 'last_success' in status:
+                    lines.append(
+                        f"{p}_device_last_success_timestamp_seconds{self._labels(device=name)} "
+                        f"{status['last_success']:.0f}"
+                    )
+            
+            lines += [
+                f"# HELP {p}_runs_total Execuções concluídas",
+                f"# TYPE {p}_runs_total counter",
+                f"{p}_runs_total {self.runs_total}"
+            ]
+            if self.last_run:
+                lines += [
+                    f"# HELP {p}_last_run_timestamp_seconds Término da última execução",
+                    f"# TYPE {p}_last_run_timestamp_seconds gauge",
+                    f"{p}_last_run_timestamp_seconds {self.last_run['timestamp']:.0f}",
+                    f"# HELP {p}_last_run_duration_seconds Duração da última execução",
+                    f"# TYPE {p}_last_run_duration_seconds gauge",
+                    f"{p}_last_run_duration_seconds {self.last_run['duration']}"
+                ]
+        return "\n".join(lines) + "\n"
+    
+    def _histogram_lines(self, metric: str, histogram: Dict, **labels) -> List[str]:
+        lines = []
+        for limit, count in zip(DURATION_BUCKETS, histogram['buckets']):
+            lines.append(f"{metric}_bucket{self._labels(**labels, le=f'{limit:g}')} {count}")
+        lines.append(f"{metric}_bucket{self._labels(**labels, le='+Inf')} {histogram['count']}")
+        lines.append(f"{metric}_sum{self._labels(**labels)} {histogram['sum']:.6f}")
+        lines.append(f"{metric}_count{self._labels(**labels)} {histogram['count']}")
+        return lines
+    
+    def write_textfile(self, path: Path):
+        """Gravar o arquivo .prom para o textfile collector do node_exporter (rename atômico)"""
+        with AtomicBackupWriter(Path(path)) as writer:
+            writer.write(self.render())
+            writer.commit()
+    
+    def serve(self, port: int, host: str = '0.0.0.0') -> ThreadingHTTPServer:
+        """Servir /metrics em uma thread de fundo"""
+        registry = self
+        
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/metrics', '/'):
+                    self.send_error(404)
+                    return
+                body = registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            
+            def log_message(self, format, *args):
+                logging.debug(f"HTTP métricas: {format % args}")
+        
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+        logging.info(f"Métricas Prometheus disponíveis em http://{host}:{port}/metrics")
+        return server
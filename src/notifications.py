@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+Notificações Telegram sem bloquear os backups
+As mensagens entram em uma fila atendida por uma thread própria, com sessão HTTP
+reaproveitada, agrupamento das mensagens por dispositivo, respeito ao limite de envio
+do Telegram (429 / retry_after) e esvaziamento da fila com tempo máximo no encerramento
+"""
+
+import time
+import queue
+import logging
+import threading
+from typing import List, Optional
+import requests
+
+class TelegramNotifier:
+    """Envio de notificações via Telegram em segundo plano"""
+    
+    # Tamanho máximo do texto de uma mensagem na API do Telegram
+    MAX_MESSAGE_LENGTH = 4096
+    
+    def __init__(self, bot_token: str, chat_id: str, batch_window: float = 5.0, min_interval: float = 1.0,
+                 max_retries: int = 3, queue_size: int = 1000, timeout: float = 10):
+        self.bot_token = bot_token
+        self.chat_id = chat_id
+        self.base_url = f"https://api.telegram.org/bot{bot_token}"
+        self.batch_window = batch_window
+        self.min_interval = min_interval
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._session: Optional[requests.Session] = None
+        self._worker: Optional[threading.Thread] = None
+        self._worker_lock = threading.Lock()
+        # Serializa os envios (thread de fila e send_message) para respeitar o intervalo mínimo
+        self._send_lock = threading.Lock()
+        self._last_sent = 0.0
+    
+    def notify(self, message: str, batch: bool = False):
+        """Enfileirar mensagem sem aguardar o envio
+        
+        Mensagens com batch=True (por dispositivo) recebidas dentro de `batch_window` segundos
+        são enviadas juntas em uma única mensagem.
+        """
+        self._ensure_worker()
+        try:
+            self._queue.put_nowait(('batch' if batch else 'message', message))
+        except queue.Full:
+            logging.warning("Fila de notificações Telegram cheia, mensagem descartada")
+    
+    def send_message(self, message: str) -> bool:
+        """Enviar mensagem imediatamente (síncrono)"""
+        return self._deliver(message)
+    
+    def flush(self, timeout: float = 30) -> bool:
+        """Aguardar o envio das mensagens enfileiradas; False se o tempo máximo esgotar"""
+        if not self._worker or not self._worker.is_alive():
+            return True
+        done = threading.Event()
+        try:
+            self._queue.put(('flush', done), timeout=timeout)
+        except queue.Full:
+            return False
+        if not done.wait(timeout):
+            logging.warning(
+                f"Notificações Telegram pendentes após {timeout:g}s: ~{self._queue.qsize()} na fila"
+            )
+            return False
+        return True
+    
+    def close(self, timeout: float = 30) -> bool:
+        """Esvaziar a fila (com tempo máximo) e encerrar a thread de envio"""
+        flushed = self.flush(timeout)
+        with self._worker_lock:
+            if self._worker and self._worker.is_alive():
+                try:
+                    self._queue.put_nowait(None)
+                except queue.Full:
+                    pass
+                if flushed:
+                    self._worker.join(timeout)
+            self._worker = None
+        if self._session:
+            self._session.close()
+            self._session = None
+        return flushed
+    
+    def _ensure_worker(self):
+        with self._worker_lock:
+            if not self._worker or not self._worker.is_alive():
+                # Daemon: mensagens ainda pendentes não impedem o processo de terminar
+                self._worker = threading.Thread(target=self._run, name='telegram', daemon=True)
+                self._worker.start()
+    
+    def _run(self):
+        """Loop da thread de envio"""
+        batch: List[str] = []
+        deadline = 0.0
+        while True:
+            try:
+                item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()) if batch else None)
+            except queue.Empty:
+                self._deliver_batch(batch)
+                batch = []
+                continue
+            
+            if item is None:
+                self._deliver_batch(batch)
+                return
+            kind, payload = item
+            if kind == 'batch':
+                if not batch:
+                    deadline = time.monotonic() + self.batch_window
+                batch.append(payload)
+                continue
+            
+            # Mensagens agrupadas pendentes saem antes, preservando a ordem
+            self._deliver_batch(batch)
+            batch = []
+            if kind == 'message':
+                self._deliver(payload)
+            else:
+                payload.set()
+    
+    def _deliver_batch(self, messages: List[str]):
+        """Enviar mensagens agrupadas respeitando o tamanho máximo de uma mensagem"""
+        if not messages:
+            return
+        if len(messages) == 1:
+            self._deliver(messages[0])
+            return
+        
+        chunks: List[str] = []
+        current = f"📦 <b>{len(messages)} notificações</b>"
+        for message in messages:
+            if len(current) + 2 + len(message) > self.MAX_MESSAGE_LENGTH:
+                chunks.append(current)
+                current = message[:self.MAX_MESSAGE_LENGTH]
+            else:
+                current += "\n\n" + message
+        chunks.append(current)
+        for chunk in chunks:
+            self._deliver(chunk)
+    
+    def _get_session(self) -> requests.Session:
+        if self._session is None:
+            self._session = requests.Session()
+        return self._session
+    
+    def _deliver(self, message: str) -> bool:
+        """POST sendMessage com intervalo mínimo entre envios e novas tentativas"""
+        data = {
+            "chat_id": self.chat_id,
+            "text": message,
+            "parse_mode": "HTML"
+        }
+        with self._send_lock:
+            for attempt in range(self.max_retries + 1):
+                wait = self.min_interval - (time.monotonic() - self._last_sent)
+                if wait > 0:
+                    time.sleep(wait)
+                
+                try:
+                    response = self._get_session().post(f"{self.base_url}/sendMessage", data=data, timeout=self.timeout)
+                except requests.RequestException as e:
+                    error, retry_after = str(e), 2 ** attempt
+                else:
+                    self._last_sent = time.monotonic()
+                    if response.status_code == 200:
+                        return True
+                    if response.status_code == 429:
+                        # Limite de envio: o Telegram informa quantos segundos aguardar
+                        try:
+                            retry_after = float(response.json().get('parameters', {}).get('retry_after', 1))
+                        except ValueError:
+                            retry_after = 1
+                    elif response.status_code >= 500:
+                        retry_after = 2 ** attempt
+                    else:
+                        logging.error(f"Erro ao enviar mensagem Telegram: HTTP {response.status_code} {response.text}")
+                        return False
+                    error = f"HTTP {response.status_code}"
+                
+                if attempt < self.max_retries:
+                    logging.warning(
+                        f"Envio Telegram falhou ({error}), nova tentativa em {retry_after:g}s "
+                        f"({attempt + 1}/{self.max_retries})"
+                    )
+                    time.sleep(retry_after)
+        
+        logging.error(f"Erro ao enviar mensagem Telegram: {error}")
+        return False
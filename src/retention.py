@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Retenção de backups FortiGate
+Política GFS (diários, semanais e mensais por dispositivo) ou por idade, calculada
+apenas sobre as entradas do catálogo, sem varrer nem consultar o sistema de arquivos
+"""
+
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+TIMESTAMP_FORMAT = '%Y%m%d_%H%M%S'
+
+class RetentionPolicy:
+    """Quais backups do catálogo manter
+
+    Com daily, weekly e monthly em zero vale apenas a idade (max_age_days). Caso contrário
+    cada série (dispositivo, tipo) mantém o backup mais recente de cada um dos últimos
+    `daily` dias, `weekly` semanas ISO e `monthly` meses que tenham backups. Em ambos os
+    casos o último backup com conteúdo da série nunca é removido.
+    """
+
+    def __init__(self, max_age_days: int = 30, daily: int = 0, weekly: int = 0, monthly: int = 0):
+        self.max_age_days = max_age_days
+        self.daily = daily
+        self.weekly = weekly
+        self.monthly = monthly
+
+    @property
+    def gfs(self) -> bool:
+        return bool(self.daily or self.weekly or self.monthly)
+
+    def describe(self) -> str:
+        if self.gfs:
+            return f"GFS: {self.daily} diários, {self.weekly} semanais, {self.monthly} mensais"
+        return f"idade: {self.max_age_days} dias"
+
+    @staticmethod
+    def _bucket(period: str, moment: datetime) -> Tuple:
+        if period == 'daily':
+            return moment.date().timetuple()[:3]
+        if period == 'weekly':
+            return moment.isocalendar()[:2]
+        return moment.year, moment.month
+
+    @staticmethod
+    def _unchanged_sources(entries: List[Dict]) -> Dict[str, Dict]:
+        """Timestamp de cada entrada "inalterado" -> backup com conteúdo do qual ela depende
+
+        É o último backup armazenado até o seu timestamp com o mesmo SHA-256. O caminho não
+        serve para a ligação: o histórico compactado altera o da entrada armazenada.
+        """
+        sources: Dict[str, Dict] = {}
+        last_stored: Dict[Optional[str], Dict] = {}
+        for entry in reversed(entries):
+            if entry['storage'] != 'unchanged':
+                last_stored[entry['sha256']] = entry
+            elif entry['sha256'] in last_stored:
+                sources[entry['timestamp']] = last_stored[entry['sha256']]
+        return sources
+
+    def _series_keep(self, entries: List[Dict], cutoff: str) -> Dict[str, str]:
+        """Timestamps mantidos de uma série (ordem decrescente) -> motivo"""
+        keep: Dict[str, str] = {}
+        latest_stored = next((e for e in entries if e['storage'] != 'unchanged'), None)
+        if latest_stored:
+            keep[latest_stored['timestamp']] = 'último'
+
+        if not self.gfs:
+            for entry in entries:
+                if entry['timestamp'] >= cutoff:
+                    keep.setdefault(entry['timestamp'], 'recente')
+        else:
+            for period, limit in (('daily', self.daily), ('weekly', self.weekly), ('monthly', self.monthly)):
+                seen = set()
+                for entry in entries:
+                    bucket = self._bucket(period, datetime.strptime(entry['timestamp'], TIMESTAMP_FORMAT))
+                    if bucket in seen:
+                        continue
+                    if len(seen) >= limit:
+                        break
+                    seen.add(bucket)
+                    keep.setdefault(entry['timestamp'], period)
+
+        # Entradas "inalterado" mantidas dependem do backup com conteúdo que as originou
+        sources = self._unchanged_sources(entries)
+        for timestamp in [timestamp for timestamp in keep if timestamp in sources]:
+            keep.setdefault(sources[timestamp]['timestamp'], 'referenciado')
+
+        # O histórico compactado só remove o início da cadeia de deltas
+        if keep:
+            oldest_kept = min(keep)
+            for entry in entries:
+                if entry['storage'] == 'archive' and entry['timestamp'] > oldest_kept:
+                    keep.setdefault(entry['timestamp'], 'histórico')
+        return keep
+
+    def plan(self, entries: Iterable[Dict], now: Optional[datetime] = None) -> Dict[str, List[Dict]]:
+        """Separar as entradas do catálogo em {'keep': [...], 'expire': [...]}
+
+        As entradas mantidas recebem o campo 'reason' (último, recente, daily, weekly,
+        monthly, referenciado ou histórico).
+        """
+        cutoff = ((now or datetime.now()) - timedelta(days=self.max_age_days)).strftime(TIMESTAMP_FORMAT)
+        series: Dict[Tuple[str, str], List[Dict]] = {}
+        for entry in entries:
+            series.setdefault((entry['device'], entry['kind']), []).append(entry)
+
+        plan: Dict[str, List[Dict]] = {'keep': [], 'expire': []}
+        for key in sorted(series):
+            items = sorted(series[key], key=lambda e: e['timestamp'], reverse=True)
+            keep = self._series_keep(items, cutoff)
+            for entry in items:
+                if entry['timestamp'] in keep:
+                    plan['keep'].append(dict(entry, reason=keep[entry['timestamp']]))
+                else:
+                    plan['expire'].append(entry)
+        return plan
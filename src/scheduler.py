@@ -2,47 +2,347 @@
 """
 Scheduler simples para executar backups em intervalos definidos
 Substitui o cron para evitar problemas de permissões no container
+
+Modos (SCHEDULER_MODE):
+- inprocess (padrão): backups executados no próprio processo, reaproveitando
+  módulos, catálogo e inventário carregados entre execuções. Cada dispositivo é um job
+  com agendamento próprio (campo "schedule", padrão CRON_SCHEDULE) em uma fila ordenada
+  por prazo e prioridade, com jitter e backoff exponencial para dispositivos com falha
+- subprocess: um novo interpretador por execução, com a saída repassada linha a linha
 """
 
 import os
 import sys
-import time
+import heapq
+import random
+import signal
+import logging
+import threading
+import traceback
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, List, Optional
 from croniter import croniter
 
+# Espera máxima entre verificações do relógio (acompanha ajustes de horário do sistema)
+MAX_WAIT_SECONDS = 300
+
 def log_message(message):
     """Log com timestamp"""
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     print(f"[{timestamp}] {message}")
     sys.stdout.flush()
 
-def run_backup():
-    """Executa o backup"""
-    try:
-        log_message("🚀 Iniciando backup agendado")
-        result = subprocess.run(
-            [sys.executable, "/app/src/fortigate_backup.py"],
-            cwd="/app",
-            capture_output=True,
-            text=True
-        )
+class BackupScheduler:
+    """Agenda as execuções de backup conforme CRON_SCHEDULE"""
+    
+    def __init__(self, cron_schedule: str, mode: str = 'inprocess'):
+        self.cron_schedule = cron_schedule
+        self.mode = mode
+        self.app_dir = Path(os.getenv('APP_DIR', '/app'))
+        self.cron_log = Path(os.getenv('LOG_DIR', '/app/logs')) / 'cron.log'
+        self.stop_event = threading.Event()
+        self.run_lock = threading.Lock()
+        self.worker: Optional[threading.Thread] = None
+        self.backup_system = None
+        
+        # Fila de jobs por dispositivo (modo inprocess)
+        self.jitter = int(os.getenv('SCHEDULER_JITTER_SECONDS', '0'))
+        self.backoff_base = int(os.getenv('SCHEDULER_BACKOFF_BASE_MINUTES', '15')) * 60
+        self.backoff_max = int(os.getenv('SCHEDULER_BACKOFF_MAX_HOURS', '24')) * 3600
+        self.jobs: Dict[str, Dict] = {}
+        self.upcoming: List[tuple] = []  # (prazo, seq, dispositivo)
+        self.ready: List[tuple] = []     # (-prioridade, prazo, seq, dispositivo)
+        self.running: Dict = {}          # future -> dispositivo
+        self.running_groups: Dict = {}   # future -> vagas de site/sub-rede reservadas
+        self.wake = threading.Event()
+        self._seq = 0
+    
+    def stop(self, signum=None, frame=None):
+        """Encerrar o loop (a execução em andamento é concluída)"""
+        self.stop_event.set()
+        self.wake.set()
+    
+    def wait_until(self, moment: datetime) -> bool:
+        """Aguardar até o horário informado; False se o scheduler for interrompido"""
+        while True:
+            remaining = (moment - datetime.now()).total_seconds()
+            if remaining <= 0:
+                return True
+            if self.stop_event.wait(min(remaining, MAX_WAIT_SECONDS)):
+                return False
+    
+    def _load_backup_system(self):
+        """Criar o sistema de backup uma única vez e recarregar o inventário se alterado"""
+        if self.backup_system is None:
+            from fortigate_backup import FortiGateSSHBackup
+            from logging_config import add_log_handler
+            # Arquivo de log próprio: execuções manuais em paralelo gravam no fortigate_backup.log
+            self.backup_system = FortiGateSSHBackup(
+                str(self.app_dir / 'config' / 'devices.json'), log_name='fortigate_backup.scheduler'
+            )
+            # Rodadas de shards diferentes não coincidem: cada shard envia o próprio resumo
+            self.backup_system.shard_summary = True
+            
+            # Saída das execuções também no cron.log, gravada pela thread de logging
+            add_log_handler(logging.FileHandler(self.cron_log, encoding='utf-8'))
+            
+            # Endpoint /metrics do Prometheus enquanto o scheduler estiver ativo
+            metrics_port = int(os.getenv('METRICS_HTTP_PORT', '0'))
+            if metrics_port:
+                self.backup_system.metrics_registry.serve(metrics_port)
+            self._sync_jobs()
+        elif self.backup_system.reload_devices_if_changed():
+            self._sync_jobs()
+    
+    def _device_schedule(self, device: Dict) -> str:
+        schedule = device.get('schedule') or self.cron_schedule
+        if not croniter.is_valid(schedule):
+            log_message(f"❌ Agendamento inválido para {device['name']}: {schedule} (usando {self.cron_schedule})")
+            schedule = self.cron_schedule
+        return schedule
+    
+    def _schedule_job(self, name: str, after: datetime):
+        """Calcular o próximo prazo do job (respeitando backoff) e colocá-lo na fila"""
+        job = self.jobs[name]
+        start = max(after, job['backoff_until'] or after)
+        due = croniter(job['schedule'], start).get_next(datetime)
+        if self.jitter > 0:
+            # Espalha os handshakes SSH de dispositivos com o mesmo horário
+            due += timedelta(seconds=random.uniform(0, self.jitter))
+        self._seq += 1
+        job['due'], job['seq'] = due, self._seq
+        heapq.heappush(self.upcoming, (due, self._seq, name))
+    
+    def _sync_jobs(self):
+        """Criar, atualizar e remover jobs conforme o inventário atual"""
+        now = datetime.now()
+        devices = {device['name']: device for device in self.backup_system.devices if 'name' in device}
+        for name in list(self.jobs):
+            if name not in devices:
+                del self.jobs[name]
         
-        if result.returncode == 0:
-            log_message("✅ Backup concluído com sucesso")
-        else:
-            log_message(f"❌ Erro no backup: {result.stderr}")
+        running = set(self.running.values())
+        for name, device in devices.items():
+            job = self.jobs.setdefault(name, {'failures': 0, 'backoff_until': None, 'schedule': None, 'seq': 0})
+            job['device'] = device
+            job['priority'] = int(device.get('priority', 0))
+            schedule = self._device_schedule(device)
+            if job['schedule'] != schedule:
+                job['schedule'] = schedule
+                # Entradas antigas na fila ficam inválidas (seq diferente) e são descartadas
+                if name not in running:
+                    self._schedule_job(name, now)
+    
+    def _is_current(self, name: str, seq: int) -> bool:
+        job = self.jobs.get(name)
+        return job is not None and job['seq'] == seq
+    
+    def _collect_finished(self, outcomes: List[tuple]):
+        """Registrar jobs concluídos, aplicar backoff e reagendar"""
+        for future in [future for future in self.running if future.done()]:
+            name = self.running.pop(future)
+            self.backup_system.release_groups(self.running_groups.pop(future))
+            success = future.result()
+            job = self.jobs.get(name)
+            if job is None:
+                continue
+            outcomes.append((job['device'], success))
+            
+            if success:
+                job['failures'] = 0
+                job['backoff_until'] = None
+            else:
+                # Backoff exponencial: dispositivos fora do ar não ocupam workers a cada ciclo
+                job['failures'] += 1
+                delay = min(self.backoff_base * 2 ** (job['failures'] - 1), self.backoff_max)
+                job['backoff_until'] = datetime.now() + timedelta(seconds=delay)
+                log_message(
+                    f"⏳ {name}: {job['failures']} falha(s) consecutiva(s), próxima tentativa a partir de "
+                    f"{job['backoff_until'].strftime('%Y-%m-%d %H:%M:%S')}"
+                )
+            self._schedule_job(name, datetime.now())
+    
+    def _log_next_run(self):
+        pending = [(job['due'], name) for name, job in self.jobs.items() if job.get('due')]
+        if pending:
+            due, name = min(pending)
+            log_message(f"⏰ Próxima execução: {due.strftime('%Y-%m-%d %H:%M:%S')} ({name})")
+    
+    def _finish_round(self, round_start: datetime, outcomes: List[tuple]):
+        """Resumo da rodada (ordem do inventário), histórico, limpeza e liberação do lock"""
+        try:
+            order = {device.get('name'): i for i, device in enumerate(self.backup_system.devices)}
+            outcomes.sort(key=lambda outcome: order.get(outcome[0].get('name'), len(order)))
+            results = self.backup_system.report_results(outcomes, round_start)
+            self.backup_system.run_maintenance()
+            self.backup_system.publish_metrics()
+            if all(results.values()):
+                log_message("✅ Backup concluído com sucesso")
+            else:
+                log_message("❌ Backup concluído com falhas (ver logs)")
+        except Exception as e:
+            log_message(f"❌ Erro ao finalizar execução: {e}")
+            log_message(traceback.format_exc())
+        finally:
+            self.backup_system.release_run_lock()
+    
+    def run_jobs(self):
+        """Loop principal do modo inprocess: fila de jobs por dispositivo"""
+        self._load_backup_system()
+        self._log_next_run()
+        workers = self.backup_system.max_workers
+        executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='backup')
+        round_start = None
+        # Jobs com prazo até este instante pertencem à rodada atual; os seguintes abrem a próxima
+        round_cutoff = None
+        outcomes: List[tuple] = []
+        lock_warned = False
+        
+        while not self.stop_event.is_set():
+            # Limpo antes de examinar a fila: término de job durante o processamento não se perde
+            self.wake.clear()
+            now = datetime.now()
+            self._collect_finished(outcomes)
+            if round_start is None:
+                self._load_backup_system()
+            
+            # Jobs vencidos vão para a fila de prontos, ordenada por prioridade e prazo
+            # (durante uma rodada, apenas os que venceram dentro da sua janela)
+            promote_until = min(now, round_cutoff) if round_start else now
+            while self.upcoming and self.upcoming[0][0] <= promote_until:
+                due, seq, name = heapq.heappop(self.upcoming)
+                if self._is_current(name, seq):
+                    heapq.heappush(self.ready, (-self.jobs[name]['priority'], due, seq, name))
+            
+            # Início de rodada: lock compartilhado com execuções manuais
+            if self.ready and round_start is None:
+                if not self.backup_system.acquire_run_lock():
+                    if not lock_warned:
+                        log_message("⚠️ Outra execução de backup em andamento, jobs aguardando")
+                        lock_warned = True
+                    self.wake.wait(60)
+                    continue
+                lock_warned = False
+                round_start = now
+                round_cutoff = now + timedelta(seconds=self.jitter + 1)
+                outcomes = []
+                self.backup_system.start_run()
+                log_message("🚀 Iniciando backup agendado")
             
-        # Log do resultado
-        with open("/app/logs/cron.log", "a") as f:
-            f.write(f"\n--- Backup executado em {datetime.now()} ---\n")
-            f.write(f"Return code: {result.returncode}\n")
-            f.write(f"STDOUT:\n{result.stdout}\n")
-            f.write(f"STDERR:\n{result.stderr}\n")
-            f.write("-" * 50 + "\n")
+            # Jobs de site/sub-rede sem vaga voltam à fila sem ocupar worker; os seguintes passam à frente
+            deferred = []
+            while self.ready and len(self.running) < workers:
+                item = heapq.heappop(self.ready)
+                name, seq = item[3], item[2]
+                if not self._is_current(name, seq):
+                    continue
+                groups = self.backup_system.reserve_groups(self.jobs[name]['device'])
+                if groups is None:
+                    deferred.append(item)
+                    continue
+                future = executor.submit(self.backup_system.run_device_backup, self.jobs[name]['device'])
+                self.running[future] = name
+                self.running_groups[future] = groups
+                future.add_done_callback(lambda _: self.wake.set())
+            for item in deferred:
+                heapq.heappush(self.ready, item)
             
-    except Exception as e:
-        log_message(f"❌ Erro ao executar backup: {e}")
+            # Fim da rodada: nada em execução/pronto e nenhum job dentro da janela de jitter do
+            # início da rodada (jobs que vencem depois dela não a prolongam indefinidamente)
+            if (round_start and not self.running and not self.ready
+                    and not (self.upcoming and self.upcoming[0][0] <= round_cutoff)):
+                self._finish_round(round_start, outcomes)
+                round_start = None
+                round_cutoff = None
+                self._log_next_run()
+                # Jobs que venceram durante a rodada abrem a próxima imediatamente
+                continue
+            
+            timeout = MAX_WAIT_SECONDS
+            # Job vencido fora da janela da rodada só entra na próxima: o término de um job acorda o loop
+            if self.upcoming and not (round_start and round_cutoff < self.upcoming[0][0] <= now):
+                timeout = min(timeout, max(0.0, (self.upcoming[0][0] - datetime.now()).total_seconds()))
+            self.wake.wait(timeout)
+        
+        log_message("🛑 Scheduler interrompido")
+        if self.running:
+            log_message("⏳ Aguardando os backups em andamento terminarem")
+        executor.shutdown(wait=True)
+        if round_start:
+            self._collect_finished(outcomes)
+            self._finish_round(round_start, outcomes)
+        # Notificações ainda na fila são enviadas antes de encerrar (com tempo máximo)
+        self.backup_system.flush_notifications(close=True)
+    
+    def _backup_subprocess(self):
+        """Executar o backup em um novo interpretador repassando a saída linha a linha"""
+        with open(self.cron_log, 'a', buffering=1) as log_file:
+            log_file.write(f"\n--- Backup executado em {datetime.now()} ---\n")
+            process = subprocess.Popen(
+                [sys.executable, str(self.app_dir / 'src' / 'fortigate_backup.py'), 'run'],
+                cwd=str(self.app_dir),
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                text=True,
+                bufsize=1
+            )
+            for line in process.stdout:
+                log_file.write(line)
+                sys.stdout.write(line)
+            sys.stdout.flush()
+            return_code = process.wait()
+            log_file.write(f"Return code: {return_code}\n")
+            log_file.write("-" * 50 + "\n")
+        return return_code == 0
+    
+    def run_backup(self):
+        """Executa o backup (chamado na thread de execução, modo subprocess)"""
+        try:
+            log_message("🚀 Iniciando backup agendado")
+            if self._backup_subprocess():
+                log_message("✅ Backup concluído com sucesso")
+            else:
+                log_message("❌ Backup concluído com falhas (ver logs)")
+        
+        except Exception as e:
+            log_message(f"❌ Erro ao executar backup: {e}")
+            log_message(traceback.format_exc())
+        finally:
+            self.run_lock.release()
+    
+    def trigger(self, scheduled: datetime):
+        """Iniciar uma execução, recusando sobreposição com a anterior"""
+        if not self.run_lock.acquire(blocking=False):
+            log_message(
+                f"⚠️ Execução de {scheduled.strftime('%Y-%m-%d %H:%M:%S')} ignorada: "
+                f"execução anterior ainda em andamento"
+            )
+            return
+        self.worker = threading.Thread(target=self.run_backup, name='backup-run')
+        self.worker.start()
+    
+    def run(self):
+        """Loop principal do modo subprocess: um agendamento global"""
+        cron = croniter(self.cron_schedule, datetime.now())
+        while not self.stop_event.is_set():
+            next_run = cron.get_next(datetime)
+            # Horários perdidos (ex.: relógio ajustado para frente) não são recuperados
+            if next_run < datetime.now():
+                cron = croniter(self.cron_schedule, datetime.now())
+                continue
+            log_message(f"⏰ Próxima execução: {next_run.strftime('%Y-%m-%d %H:%M:%S')}")
+            
+            if not self.wait_until(next_run):
+                break
+            self.trigger(next_run)
+        
+        log_message("🛑 Scheduler interrompido")
+        if self.worker and self.worker.is_alive():
+            log_message("⏳ Aguardando a execução em andamento terminar")
+            self.worker.join()
 
 def main():
     """Função principal do scheduler"""
@@ -52,34 +352,24 @@ def main():
         log_message("❌ CRON_SCHEDULE não definido")
         sys.exit(1)
     
-    log_message(f"📅 Scheduler iniciado com agendamento: {cron_schedule}")
+    mode = os.getenv('SCHEDULER_MODE', 'inprocess')
+    if mode not in ('inprocess', 'subprocess'):
+        log_message(f"❌ SCHEDULER_MODE inválido: {mode} (use inprocess ou subprocess)")
+        sys.exit(1)
     
-    try:
-        cron = croniter(cron_schedule, datetime.now())
-    except Exception as e:
-        log_message(f"❌ Erro no formato do cron: {e}")
+    if not croniter.is_valid(cron_schedule):
+        log_message(f"❌ Erro no formato do cron: {cron_schedule}")
         sys.exit(1)
     
-    # Loop principal
-    while True:
-        try:
-            # Próxima execução
-            next_run = cron.get_next(datetime)
-            log_message(f"⏰ Próxima execução: {next_run.strftime('%Y-%m-%d %H:%M:%S')}")
-            
-            # Aguardar até a próxima execução
-            while datetime.now() < next_run:
-                time.sleep(30)  # Verificar a cada 30 segundos
-            
-            # Executar backup
-            run_backup()
-            
-        except KeyboardInterrupt:
-            log_message("🛑 Scheduler interrompido")
-            break
-        except Exception as e:
-            log_message(f"❌ Erro no scheduler: {e}")
-            time.sleep(60)  # Aguardar 1 minuto antes de tentar novamente
+    log_message(f"📅 Scheduler iniciado com agendamento: {cron_schedule} (modo {mode})")
+    
+    scheduler = BackupScheduler(cron_schedule, mode)
+    signal.signal(signal.SIGTERM, scheduler.stop)
+    signal.signal(signal.SIGINT, scheduler.stop)
+    if mode == 'inprocess':
+        scheduler.run_jobs()
+    else:
+        scheduler.run()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
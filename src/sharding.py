@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Execução particionada (shards) do inventário FortiGate
+Cada processo/contêiner recebe "i/N" e processa apenas os dispositivos cujo hash estável
+do nome cai no seu shard; os resultados de cada shard são gravados em JSON e consolidados
+por um coordenador em um único resumo
+"""
+
+import re
+import json
+import hashlib
+import logging
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from backup_store import AtomicBackupWriter
+
+SHARD_RE = re.compile(r'^\s*(\d+)\s*/\s*(\d+)\s*$')
+
+def parse_shard(value: str) -> Tuple[int, int]:
+    """Converter "i/N" (1 <= i <= N) em (i, N)"""
+    match = SHARD_RE.match(value or '')
+    if not match:
+        raise ValueError(f"Shard inválido: '{value}' (use i/N, ex.: 1/4)")
+    index, total = int(match.group(1)), int(match.group(2))
+    if total < 1 or not 1 <= index <= total:
+        raise ValueError(f"Shard inválido: '{value}' (i deve estar entre 1 e N)")
+    return index, total
+
+def shard_label(shard: Tuple[int, int]) -> str:
+    return f"{shard[0]}/{shard[1]}"
+
+def shard_of(device_name: str, total: int) -> int:
+    """Shard (1..N) do dispositivo: hash estável do nome, igual em qualquer processo ou nó"""
+    digest = hashlib.sha256(device_name.encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') % total + 1
+
+def select_shard(devices: List[Dict], shard: Tuple[int, int]) -> List[Dict]:
+    """Dispositivos do inventário que pertencem ao shard"""
+    index, total = shard
+    return [device for device in devices if shard_of(device.get('name', ''), total) == index]
+
+def shard_result_path(results_dir: Path, shard: Tuple[int, int]) -> Path:
+    return Path(results_dir) / f"shard_{shard[0]}_of_{shard[1]}.json"
+
+def write_shard_result(results_dir: Path, shard: Tuple[int, int], started_at: datetime,
+                       finished_at: datetime, entries: List[Dict]) -> Path:
+    """Gravar (de forma atômica) o resultado da execução do shard"""
+    Path(results_dir).mkdir(parents=True, exist_ok=True)
+    path = shard_result_path(results_dir, shard)
+    with AtomicBackupWriter(path) as writer:
+        writer.write(json.dumps({
+            'shard': shard_label(shard),
+            'started_at': started_at.isoformat(timespec='seconds'),
+            'finished_at': finished_at.isoformat(timespec='seconds'),
+            'devices': entries
+        }, indent=2, ensure_ascii=False))
+        writer.commit()
+    return path
+
+def collect_shard_results(results_dir: Path, total: int, since: datetime) -> Tuple[Dict[int, Dict], List[int]]:
+    """Resultados de cada shard concluídos a partir de `since`; retorna (resultados, shards pendentes)"""
+    results: Dict[int, Dict] = {}
+    missing: List[int] = []
+    for index in range(1, total + 1):
+        path = shard_result_path(results_dir, (index, total))
+        result: Optional[Dict] = None
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                result = json.load(f)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logging.warning(f"Resultado do shard ilegível: {path.name} ({e})")
+        if result and datetime.fromisoformat(result['finished_at']) >= since:
+            results[index] = result
+        else:
+            missing.append(index)
+    return results, missing
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Ajustes do transporte SSH por dispositivo
+Perfis de transporte (compressão, janela/pacote dos canais e preferência de kex/cifras)
+definidos no devices.json e cache persistente de chaves de host (known_hosts) no lugar
+de aceitar qualquer chave a cada conexão
+"""
+
+import os
+import fcntl
+import logging
+import threading
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+import paramiko
+
+# Perfis prontos; "ssh_profiles" no devices.json pode sobrescrevê-los ou criar outros
+BUILTIN_PROFILES: Dict[str, Dict] = {
+    # Padrões do paramiko
+    'default': {},
+    # Links lentos de filiais: compressão e janela maior para RTT alto
+    'wan': {'compress': True, 'window_size': 8 * 1024 * 1024},
+    # Configurações grandes em links rápidos: janela grande e cifras AES-GCM/CTR
+    'bulk': {
+        'window_size': 16 * 1024 * 1024,
+        'ciphers': ['aes128-gcm@openssh.com', 'aes128-ctr', 'aes256-gcm@openssh.com']
+    },
+}
+
+PROFILE_OPTIONS = ('compress', 'window_size', 'max_packet_size', 'kex', 'ciphers')
+
+class TransportProfile:
+    """Parâmetros aplicados ao paramiko.Transport antes do handshake"""
+
+    def __init__(self, name: str, compress: bool = False, window_size: Optional[int] = None,
+                 max_packet_size: Optional[int] = None, kex: Optional[List[str]] = None,
+                 ciphers: Optional[List[str]] = None):
+        self.name = name
+        self.compress = compress
+        self.window_size = window_size
+        self.max_packet_size = max_packet_size
+        self.kex = list(kex or [])
+        self.ciphers = list(ciphers or [])
+
+    @classmethod
+    def from_config(cls, name: str, options: Dict) -> 'TransportProfile':
+        unknown = set(options) - set(PROFILE_OPTIONS)
+        if unknown:
+            raise ValueError(f"Opções desconhecidas no perfil SSH '{name}': {', '.join(sorted(unknown))}")
+        return cls(
+            name,
+            compress=bool(options.get('compress', False)),
+            window_size=int(options['window_size']) if options.get('window_size') else None,
+            max_packet_size=int(options['max_packet_size']) if options.get('max_packet_size') else None,
+            kex=options.get('kex'),
+            ciphers=options.get('ciphers')
+        )
+
+    def describe(self) -> str:
+        parts = [self.name]
+        if self.compress:
+            parts.append('compressão')
+        if self.window_size:
+            parts.append(f"janela {self.window_size // 1024} KB")
+        if self.max_packet_size:
+            parts.append(f"pacote {self.max_packet_size // 1024} KB")
+        return ', '.join(parts)
+
+    @staticmethod
+    def _prefer(available: tuple, preferred: List[str], kind: str) -> List[str]:
+        """Algoritmos preferidos primeiro; os demais continuam disponíveis na negociação"""
+        unsupported = [name for name in preferred if name not in available]
+        if unsupported:
+            logging.warning(f"{kind} não suportados pelo paramiko ignorados: {', '.join(unsupported)}")
+        first = [name for name in preferred if name in available]
+        return first + [name for name in available if name not in first]
+
+    def transport_factory(self) -> Callable[..., paramiko.Transport]:
+        """Fábrica para SSHClient.connect(transport_factory=...)"""
+        def factory(sock, **kwargs) -> paramiko.Transport:
+            if self.window_size:
+                kwargs['default_window_size'] = self.window_size
+            if self.max_packet_size:
+                kwargs['default_max_packet_size'] = self.max_packet_size
+            transport = paramiko.Transport(sock, **kwargs)
+            options = transport.get_security_options()
+            if self.kex:
+                options.kex = self._prefer(options.kex, self.kex, 'Algoritmos de kex')
+            if self.ciphers:
+                options.ciphers = self._prefer(options.ciphers, self.ciphers, 'Cifras')
+            return transport
+        return factory
+
+def load_profiles(custom: Optional[Dict[str, Dict]] = None) -> Dict[str, TransportProfile]:
+    """Perfis prontos mais os definidos em "ssh_profiles" no devices.json"""
+    definitions = dict(BUILTIN_PROFILES)
+    definitions.update(custom or {})
+    return {name: TransportProfile.from_config(name, options) for name, options in definitions.items()}
+
+def resolve_profile(device: Dict, profiles: Dict[str, TransportProfile], default: str = 'default') -> TransportProfile:
+    """Perfil do dispositivo: nome de um perfil ou opções próprias em "ssh_profile" """
+    value = device.get('ssh_profile', default)
+    if isinstance(value, dict):
+        return TransportProfile.from_config(device.get('name', 'dispositivo'), value)
+    if value not in profiles:
+        raise ValueError(f"Perfil SSH desconhecido: '{value}' (disponíveis: {', '.join(sorted(profiles))})")
+    return profiles[value]
+
+def host_key_name(host: str, port: int) -> str:
+    """Nome da entrada no known_hosts, como o paramiko consulta"""
+    return host if port == 22 else f"[{host}]:{port}"
+
+class KnownHostsCache:
+    """Chaves de host persistidas entre execuções
+
+    Política "tofu": a primeira chave de cada dispositivo é registrada e uma chave diferente
+    depois disso recusa a conexão; "strict": apenas chaves já registradas são aceitas.
+    """
+
+    def __init__(self, path: Path, policy: str = 'tofu'):
+        if policy not in ('tofu', 'strict'):
+            raise ValueError(f"Política de chave de host inválida: '{policy}' (use tofu, strict ou auto)")
+        self.path = Path(path)
+        self.policy = policy
+        self._lock = threading.Lock()
+        self._keys = self._read()
+
+    def _read(self) -> paramiko.HostKeys:
+        keys = paramiko.HostKeys()
+        if self.path.exists():
+            keys.load(str(self.path))
+        return keys
+
+    def prepare(self, ssh: paramiko.SSHClient, host: str, port: int):
+        """Carregar no cliente a chave registrada do dispositivo e a política para chaves novas"""
+        name = host_key_name(host, port)
+        with self._lock:
+            known = self._keys.lookup(name)
+        if known:
+            for key_type, key in known.items():
+                ssh.get_host_keys().add(name, key_type, key)
+        ssh.set_missing_host_key_policy(_CachePolicy(self))
+
+    def add(self, name: str, key: paramiko.PKey):
+        """Registrar uma chave nova; o arquivo é relido e regravado sob lock (processos concorrentes)"""
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path.with_name(self.path.name + '.lock'), 'w') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                keys = self._read()
+                keys.add(name, key.get_name(), key)
+                temp_path = self.path.with_name(f".{self.path.name}.tmp")
+                keys.save(str(temp_path))
+                os.replace(temp_path, self.path)
+                self._keys = keys
+
+class _CachePolicy(paramiko.MissingHostKeyPolicy):
+    def __init__(self, cache: KnownHostsCache):
+        self.cache = cache
+
+    def missing_host_key(self, client, hostname, key):
+        if self.cache.policy == 'strict':
+            raise paramiko.SSHException(
+                f"Chave de host de {hostname} não registrada em {self.cache.path} (SSH_HOST_KEY_POLICY=strict)"
+            )
+        self.cache.add(hostname, key)
+        logging.info(f"Chave de host registrada: {hostname} {key.get_name()} {key.fingerprint}")
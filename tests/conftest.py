@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# Os módulos de src/ importam uns aos outros pelo nome (como em src/fortigate_backup.py)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'src'))
@@ -0,0 +1,51 @@
+from datetime import datetime, timedelta
+
+from retention import RetentionPolicy
+
+def entry(timestamp, storage, path, sha256, device='fw', kind='config'):
+    return {'device': device, 'kind': kind, 'timestamp': timestamp, 'storage': storage,
+            'path': path, 'size': 100, 'sha256': sha256}
+
+def daily_series(start, days, first_storage='archive'):
+    """Um backup armazenado no primeiro dia e entradas "inalterado" nos seguintes"""
+    stored_ts = start.strftime('%Y%m%d_%H%M%S')
+    entries = [entry(stored_ts, first_storage, 'archive/fw/config', start.strftime('%Y%m'))]
+    for day in range(1, days):
+        timestamp = (start + timedelta(days=day)).strftime('%Y%m%d_%H%M%S')
+        # Aponta para o nome do arquivo em texto, anterior à compactação
+        entries.append(entry(timestamp, 'unchanged', f"fw_config_{stored_ts}.conf", start.strftime('%Y%m')))
+    return entries
+
+def test_gfs_keeps_archived_source_of_unchanged_monthly_point():
+    entries = daily_series(datetime(2026, 1, 1, 2), 31)
+    entries.append(entry('20260201_020000', 'file', 'fw_config_20260201_020000.conf', '202602'))
+
+    plan = RetentionPolicy(max_age_days=30, monthly=3).plan(entries, now=datetime(2026, 2, 2))
+
+    kept = {e['timestamp']: e['reason'] for e in plan['keep']}
+    assert kept['20260131_020000'] == 'monthly'
+    assert kept['20260101_020000'] == 'referenciado'
+    assert kept['20260201_020000'] == 'último'
+    assert not [e for e in plan['expire'] if e['storage'] != 'unchanged']
+
+def test_unchanged_rows_depend_on_matching_hash_not_latest_stored():
+    entries = [
+        entry('20260101_020000', 'archive', 'archive/fw/config', 'a'),
+        entry('20260102_020000', 'archive', 'archive/fw/config', 'b'),
+        entry('20260103_020000', 'unchanged', 'fw_config_20260102_020000.conf', 'b'),
+        entry('20260110_020000', 'file', 'fw_config_20260110_020000.conf', 'c'),
+    ]
+
+    plan = RetentionPolicy(daily=2).plan(entries, now=datetime(2026, 1, 11))
+
+    kept = {e['timestamp']: e['reason'] for e in plan['keep']}
+    assert kept['20260102_020000'] == 'referenciado'
+    assert [e['timestamp'] for e in plan['expire']] == ['20260101_020000']
+
+def test_age_policy_keeps_latest_stored_backup():
+    entries = daily_series(datetime(2025, 1, 1), 5, first_storage='file')
+
+    plan = RetentionPolicy(max_age_days=30).plan(entries, now=datetime(2026, 1, 1))
+
+    assert [e['timestamp'] for e in plan['keep']] == ['20250101_000000']
+    assert len(plan['expire']) == 4